@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+'''
+Guesses per second of StorageManager.check_quiz_item with and without
+the in-memory answer index
+
+Usage: python3 benchmark/check_quiz_item.py [--sizes 1000 100000]
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+from common import populate, quiet_logs
+from storage_manager import StorageManager
+
+
+def guesses_per_second(storage_manager: StorageManager,
+                       guesses: list) -> float:
+    '''
+    Check all guesses against the first item
+    '''
+
+    start = time.perf_counter()
+    for guess in guesses:
+        storage_manager.check_quiz_item(guess, 1)
+    return len(guesses) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 100000, 1000000])
+    parser.add_argument('--guesses', type=int, default=20000)
+    args = parser.parse_args()
+
+    quiet_logs()
+
+    print(f"{'rows':>10} {'index':>6} {'memory KiB':>11} "
+          f"{'hits/s':>10} {'misses/s':>10}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            database = os.path.join(tmp_dir, 'benchmark.db')
+            populate(database, size)
+
+            hits = [f"answer{i * 7919 % size}" for i in range(args.guesses)]
+            misses = [f"miss{i}" for i in range(args.guesses)]
+            for kind in (None, "set", "bloom"):
+                # Counter updates are written behind, as in the bot
+                storage_manager = StorageManager(database=database,
+                                                 flush_interval=3600,
+                                                 flush_size=10 ** 9,
+                                                 answer_index=kind)
+                memory = 0
+                if kind:
+                    memory = storage_manager.answer_index.memory_usage()
+                hit_rate = guesses_per_second(storage_manager, hits)
+                miss_rate = guesses_per_second(storage_manager, misses)
+                storage_manager.writer.pending.clear()
+                storage_manager.close_connection()
+
+                print(f"{size:>10} {kind or 'none':>6} {memory / 1024:>11.0f} "
+                      f"{hit_rate:>10.0f} {miss_rate:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
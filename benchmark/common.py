@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+'''
+Helpers shared by the benchmarks
+'''
+
+import logging
+import os
+import sys
+import time
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'src')
+sys.path.insert(0, SRC_PATH)
+
+
+def quiet_logs() -> None:
+    '''
+    Keep log formatting and I/O out of the measurements
+    '''
+    logging.disable(logging.CRITICAL)
+
+
+def populate(database: str,
+             size: int,
+             user_id: int = 0) -> None:
+    '''
+    Create a database with `size` synthetic text items into the deck
+    of a user (the shared deck by default)
+    '''
+
+    from storage_manager import StorageManager
+
+    storage_manager = StorageManager(database=database)
+    storage_manager.insert_items(
+        ((f"answer{i}", f"quiz{i}") for i in range(size)),
+        batch_size=10000,
+        user_id=user_id)
+    storage_manager.close_connection()
+
+
+def measure(function, repeat: int) -> float:
+    '''
+    Mean latency in microseconds of `repeat` calls
+    '''
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+'''
+Compare two benchmark suite results and report the regressions
+
+Usage: python3 benchmark/compare.py base.json new.json [--threshold 0.2]
+
+Exits with status 1 if any benchmark is slower than the threshold.
+'''
+
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    '''
+    Read a suite result as a {(benchmark, size): result} dictionary
+    '''
+
+    with open(path, encoding='utf-8') as file_obj:
+        report = json.load(file_obj)
+    return {(result['benchmark'], result['size']): result
+            for result in report['results']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='p50_us',
+                        choices=['mean_us', 'p50_us', 'p95_us', 'p99_us'])
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed relative slowdown')
+    args = parser.parse_args()
+
+    base = load(args.base)
+    new = load(args.new)
+
+    regressions = 0
+    print(f"{'benchmark':>20} {'size':>8} {'base':>10} {'new':>10} "
+          f"{'change':>8}")
+    for key in sorted(base.keys() & new.keys()):
+        before = base[key].get(args.metric)
+        after = new[key].get(args.metric)
+        if not before or after is None:
+            continue
+
+        change = after / before - 1
+        regression = change > args.threshold
+        regressions += regression
+        print(f"{key[0]:>20} {key[1]:>8} {before:>10.2f} {after:>10.2f} "
+              f"{change:>+8.1%}{'  REGRESSION' if regression else ''}")
+
+    for key in sorted(base.keys() ^ new.keys()):
+        print(f"{key[0]:>20} {key[1]:>8} only in "
+              f"{'base' if key in base else 'new'}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
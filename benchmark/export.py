@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+'''
+Deck export and online backup benchmark: export throughput and peak
+memory by deck size, and the longest write while a backup runs
+
+Usage: python3 benchmark/export.py [--sizes 10000 100000 1000000]
+'''
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from common import populate, quiet_logs
+from exporter import write_export
+from storage_manager import StorageManager
+
+
+def bench_export(storage_manager: StorageManager,
+                 export_format: str) -> tuple:
+    '''
+    Seconds and peak traced memory in bytes of an export
+    '''
+
+    with tempfile.TemporaryFile() as output:
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = write_export(storage_manager.export_items(), output,
+                            export_format, max_size=2 ** 40)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def bench_backup(storage_manager: StorageManager,
+                 target: str,
+                 pages: int) -> tuple:
+    '''
+    Seconds of a backup and the longest insert done meanwhile
+    '''
+
+    longest = 0.0
+    done = threading.Event()
+
+    def write():
+        nonlocal longest
+        i = 0
+        while not done.is_set():
+            start = time.perf_counter()
+            storage_manager.insert_item("text", f"backup{i}", "write")
+            longest = max(longest, time.perf_counter() - start)
+            i += 1
+            time.sleep(0.001)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    start = time.perf_counter()
+    storage_manager.backup(target, pages=pages, sleep=0.001)
+    elapsed = time.perf_counter() - start
+    done.set()
+    writer.join()
+    return elapsed, longest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--pages', type=int, default=256)
+    args = parser.parse_args()
+
+    quiet_logs()
+    print(f"{'items':>10} {'format':>6} {'seconds':>8} {'items/s':>10} "
+          f"{'MB':>8} {'peak KiB':>9}")
+    backups = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            database = os.path.join(tmp_dir, 'benchmark.db')
+            populate(database, size)
+            storage_manager = StorageManager(database=database)
+            for export_format in ('csv', 'jsonl'):
+                elapsed, peak, length = bench_export(storage_manager,
+                                                     export_format)
+                print(f"{size:>10} {export_format:>6} {elapsed:>8.2f} "
+                      f"{size / elapsed:>10.0f} {length / 2 ** 20:>8.1f} "
+                      f"{peak / 1024:>9.0f}")
+            backups.append((size, *bench_backup(
+                storage_manager, os.path.join(tmp_dir, 'copy.db'),
+                args.pages)))
+            storage_manager.close_connection()
+
+    print(f"\n{'items':>10} {'backup s':>9} {'longest write ms':>17}")
+    for size, elapsed, longest in backups:
+        print(f"{size:>10} {elapsed:>9.2f} {longest * 1000:>17.1f}")
+
+
+if __name__ == '__main__':
+    main()
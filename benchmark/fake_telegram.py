@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+'''
+Local stand-in of the Telegram Bot API, for load tests without
+hitting the real service.
+
+It implements the subset used by the bot: getUpdates (with long
+polling), sendMessage, sendPhoto, sendAudio, sendVideo, sendDocument,
+getFile and file downloads. Updates are injected by the load harness,
+and every reply is timestamped and routed to its chat.
+
+Usage: python3 benchmark/fake_telegram.py [--port 8081]
+       and set `API_URL = "http://127.0.0.1:8081"` into [Telegram]
+'''
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+SEND_METHODS = {
+    "sendMessage": "text",
+    "sendPhoto": "photo",
+    "sendAudio": "audio",
+    "sendVideo": "video",
+    "sendDocument": "document",
+}
+
+
+class FakeTelegram:
+    '''
+    In-memory Telegram Bot API served over HTTP
+    '''
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0) -> None:
+
+        self.updates: List[dict] = []
+        self.condition = threading.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+        # Replies per chat: {chat_id: queue of (timestamp, method, payload)}
+        self.replies: Dict[int, queue.Queue] = {}
+        self.replies_lock = threading.Lock()
+
+        # Downloadable files: {file_id: (file_path, content)}
+        self.files: Dict[str, Tuple[str, bytes]] = {}
+
+        # Served requests per method
+        self.requests: Dict[str, int] = {}
+
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        '''
+        Base URL to be used as [Telegram] API_URL
+        '''
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeTelegram":
+        '''
+        Serve requests into a background thread
+        '''
+
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name="fake-telegram",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''
+        Stop the server and wake up pending long polls
+        '''
+
+        self.server.shutdown()
+        self.server.server_close()
+        with self.condition:
+            self.condition.notify_all()
+
+    def inbox(self,
+              chat_id: int) -> queue.Queue:
+        '''
+        Replies sent to a chat
+        '''
+
+        with self.replies_lock:
+            return self.replies.setdefault(chat_id, queue.Queue())
+
+    def add_file(self,
+                 file_id: str,
+                 content: bytes,
+                 file_path: str = "") -> None:
+        '''
+        Register a file to be served by getFile and downloads
+        '''
+        self.files[file_id] = (file_path or f"documents/{file_id}", content)
+
+    def inject(self,
+               chat_id: int,
+               text: Optional[str] = None,
+               **fields) -> float:
+        '''
+        Queue an incoming message from a user
+
+        Parameters:
+            - chat_id (int): Chat sending the message
+            - text (str): Text of the message
+            - fields: Other message fields, such as document or photo
+
+        Returns:
+            - float: Injection timestamp (time.perf_counter)
+        '''
+
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+        }
+        if text is not None:
+            message["text"] = text
+        message.update(fields)
+
+        with self.condition:
+            self.updates.append({"update_id": next(self._update_ids),
+                                 "message": message})
+            self.condition.notify_all()
+        return time.perf_counter()
+
+    def get_updates(self,
+                    offset: int = 0,
+                    timeout: float = 0,
+                    limit: int = 100) -> List[dict]:
+        '''
+        Confirm the updates before offset and wait for new ones
+        '''
+
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            # Updates below offset are confirmed and forgotten
+            if offset:
+                self.updates = [update for update in self.updates
+                                if update["update_id"] >= offset]
+            while not self.updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.updates[:limit]
+
+    def send(self,
+             method: str,
+             params: dict) -> dict:
+        '''
+        Record a reply and return the sent message object
+        '''
+
+        chat_id = int(params["chat_id"])
+        self.inbox(chat_id).put((time.perf_counter(), method, params))
+        message = {"message_id": next(self._message_ids),
+                   "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}}
+        field = SEND_METHODS[method]
+        message[field] = params.get(field)
+        return message
+
+    def call(self,
+             method: str,
+             params: dict) -> Tuple[int, dict]:
+        '''
+        Execute a Bot API method
+
+        Returns:
+            - tuple: (HTTP status, Bot API response)
+        '''
+
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if method == "getUpdates":
+            result = self.get_updates(int(params.get("offset", 0)),
+                                      float(params.get("timeout", 0)),
+                                      int(params.get("limit", 100)))
+        elif method in SEND_METHODS:
+            result = self.send(method, params)
+        elif method == "getFile":
+            file_id = params.get("file_id")
+            if file_id not in self.files:
+                return 400, {"ok": False, "error_code": 400,
+                             "description": "Bad Request: invalid file_id"}
+            file_path, content = self.files[file_id]
+            result = {"file_id": file_id, "file_unique_id": file_id,
+                      "file_size": len(content), "file_path": file_path}
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "FakeBot",
+                      "username": "fake_bot"}
+        elif method in ("setWebhook", "deleteWebhook"):
+            result = True
+        else:
+            return 404, {"ok": False, "error_code": 404,
+                         "description": "Not Found"}
+        return 200, {"ok": True, "result": result}
+
+    def _handler(self):
+        '''
+        Request handler class bound to this server
+        '''
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes: avoid the delayed
+            # ACK stalls of keep-alive connections
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                # Keep the harness output clean
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _dispatch(self, params):
+                # Paths are /bot<token>/<method>
+                parts = urlsplit(self.path).path.strip('/').split('/')
+                if len(parts) != 2 or not parts[0].startswith("bot"):
+                    self._send(404, b'{"ok": false}')
+                    return
+                status, response = api.call(parts[1], params)
+                self._send(status, json.dumps(response).encode())
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                # File downloads are /file/bot<token>/<file_path>
+                if path.startswith("/file/"):
+                    file_path = path.split('/', 3)[-1]
+                    for stored_path, content in api.files.values():
+                        if stored_path == file_path:
+                            self._send(200, content,
+                                       "application/octet-stream")
+                            return
+                    self._send(404, b'')
+                    return
+                self._dispatch(dict(parse_qsl(urlsplit(self.path).query)))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length) if length else b''
+                if self.headers.get("Content-Type", "").startswith(
+                        "application/json"):
+                    params = json.loads(body or b'{}')
+                else:
+                    params = dict(parse_qsl(body.decode()))
+                self._dispatch(params)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+
+    server = FakeTelegram(args.host, args.port)
+    print(f"Fake Telegram Bot API listening on {server.url}")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        server.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''
+Throughput benchmark of the CSV import pipeline
+
+Usage: python3 benchmark/import_csv.py [--lines 100000] [--legacy]
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+from common import quiet_logs
+from importer import import_csv
+from storage_manager import StorageManager, StorageManagerException
+
+
+def write_csv(path: str,
+              lines: int) -> None:
+    '''
+    Write a CSV file with 1% of duplicated answers
+    '''
+
+    with open(path, 'w', encoding='utf-8') as file_obj:
+        for i in range(lines):
+            file_obj.write(f"answer{i - i % 100 if i % 100 == 99 else i},"
+                           f"quiz{i}\n")
+
+
+def legacy_import(storage_manager: StorageManager,
+                  path: str) -> None:
+    '''
+    Previous import: one insert and commit per line
+    '''
+
+    with open(path, encoding='utf-8') as file_obj:
+        for line in file_obj.readlines():
+            answer, quiz = line.replace('\n', '').split(',')
+            try:
+                storage_manager.insert_item("text", answer, quiz)
+            except StorageManagerException:
+                continue
+
+
+def run(name: str,
+        function,
+        lines: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_file = os.path.join(tmp_dir, 'deck.csv')
+        write_csv(csv_file, lines)
+        storage_manager = StorageManager(
+            database=os.path.join(tmp_dir, 'benchmark.db'))
+
+        start = time.perf_counter()
+        function(storage_manager, csv_file)
+        elapsed = time.perf_counter() - start
+        storage_manager.close_connection()
+
+    print(f"{name:>8} {lines:>10} {elapsed:>10.2f} {lines / elapsed:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--legacy', action='store_true',
+                        help='Also measure the line by line import')
+    args = parser.parse_args()
+
+    quiet_logs()
+
+    def bulk_import(storage_manager, path):
+        with open(path, encoding='utf-8', newline='') as file_obj:
+            import_csv(storage_manager, file_obj, args.batch_size)
+
+    print(f"{'method':>8} {'lines':>10} {'seconds':>10} {'lines/s':>12}")
+    run('bulk', bulk_import, args.lines)
+    if args.legacy:
+        run('legacy', legacy_import, args.lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+'''
+End-to-end load test of flashcard.py against the fake Telegram Bot API.
+
+N simulated users play rounds (/new_round, then the right answer) as
+fast as the bot replies. The bot runs as a subprocess with its API_URL
+pointed to benchmark/fake_telegram.py, and the harness reports the
+handled updates per second, the reply latencies and the CPU and memory
+used by the bot.
+
+With --processes, the bot runs in supervisor mode with that number of
+worker processes, and every user gets a private deck of --deck-size
+items.
+
+Usage: python3 benchmark/load_test.py [--users 10 100] [--duration 30]
+                                      [--deck-size 10000] [--processes 4]
+'''
+
+import argparse
+import json
+import os
+import queue
+import resource
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+
+from common import SRC_PATH, populate, quiet_logs
+from fake_telegram import FakeTelegram
+from sharding import shard_path
+
+CONFIG = '''[Telegram]
+    API_KEY = "load-test"
+    API_URL = "{url}"
+
+[FlashCardBot]
+    Commands = ["/new_item", "/new_round"]
+    SleepTime = 1
+    Database = "{database}"
+    Timeout = 20
+    MaxAttempts = 3
+    PollTimeout = 5
+    Workers = {workers}
+    Scheduler = "{scheduler}"
+
+# The fake Bot API has no rate limits to emulate
+[FlashCardBot.Outbound]
+    GlobalRate = 1000000
+    ChatRate = 1000000
+    ChatBurst = 1000000
+'''
+
+SUPERVISOR_CONFIG = '''
+[FlashCardBot.Storage]
+    Partition = "chat"
+
+[FlashCardBot.Supervisor]
+    Enabled = true
+    Workers = {processes}
+'''
+
+
+class User(threading.Thread):
+    '''
+    Simulated user answering quizzes in a closed loop
+    '''
+    def __init__(self,
+                 telegram: FakeTelegram,
+                 chat_id: int,
+                 deadline: float,
+                 reply_timeout: float) -> None:
+
+        super().__init__(name=f"user-{chat_id}", daemon=True)
+        self.telegram = telegram
+        self.chat_id = chat_id
+        self.deadline = deadline
+        self.reply_timeout = reply_timeout
+        self.inbox = telegram.inbox(chat_id)
+        self.latencies: List[float] = []
+        self.timeouts = 0
+
+    def request(self,
+                text: str):
+        '''
+        Send a message and wait for its reply
+
+        Returns:
+            - dict: Reply parameters or None on timeout
+        '''
+
+        sent = self.telegram.inject(self.chat_id, text)
+        try:
+            received, _, params = self.inbox.get(timeout=self.reply_timeout)
+        except queue.Empty:
+            self.timeouts += 1
+            return None
+        self.latencies.append(received - sent)
+        return params
+
+    def run(self) -> None:
+        while time.perf_counter() < self.deadline:
+            quiz = self.request("/new_round")
+            if quiz is None:
+                continue
+
+            # Synthetic decks store "answerN" as answer of "quizN"
+            text = str(quiz.get("text", ""))
+            answer = text.replace("quiz", "answer", 1) \
+                if text.startswith("quiz") else "?"
+            self.request(answer)
+
+
+def wait_for_polling(telegram: FakeTelegram,
+                     process: subprocess.Popen,
+                     timeout: float = 60) -> None:
+    '''
+    Wait for the first getUpdates call of the bot
+    '''
+
+    deadline = time.monotonic() + timeout
+    while not telegram.requests.get("getUpdates"):
+        if process.poll() is not None:
+            sys.exit(f"flashcard.py exited with status {process.returncode}")
+        if time.monotonic() > deadline:
+            process.kill()
+            sys.exit("flashcard.py did not start polling")
+        time.sleep(0.05)
+
+
+def percentile(values: List[float],
+               fraction: float) -> float:
+    '''
+    Percentile of a sorted list of seconds, in milliseconds
+    '''
+
+    if not values:
+        return None
+    return round(values[min(len(values) - 1,
+                            int(fraction * len(values)))] * 1e3, 3)
+
+
+def run(users: int,
+        args: argparse.Namespace,
+        tmp: str) -> dict:
+    '''
+    Start the bot and drive it with a number of simulated users
+    '''
+
+    chat_ids = [1000 + i for i in range(users)]
+    database = os.path.join(tmp, f'load-{users}.db')
+    if args.processes:
+        # Private decks into the shard of every user
+        for chat_id in chat_ids:
+            populate(shard_path(database, chat_id % args.processes),
+                     args.deck_size, user_id=chat_id)
+    else:
+        shutil.copyfile(os.path.join(tmp, 'deck.db'), database)
+
+    telegram = FakeTelegram().start()
+    config = os.path.join(tmp, 'config.toml')
+    with open(config, 'w', encoding='utf-8') as file_obj:
+        file_obj.write(CONFIG.format(url=telegram.url,
+                                     database=database,
+                                     workers=args.workers,
+                                     scheduler=args.scheduler))
+        if args.processes:
+            file_obj.write(SUPERVISOR_CONFIG.format(
+                processes=args.processes))
+
+    with open(os.path.join(tmp, f'bot-{users}.log'), 'wb') as log:
+        usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(SRC_PATH, 'flashcard.py'), config],
+            stdout=log, stderr=subprocess.STDOUT)
+
+        try:
+            wait_for_polling(telegram, process)
+
+            start = time.perf_counter()
+            clients = [User(telegram, chat_id, start + args.duration,
+                            args.reply_timeout) for chat_id in chat_ids]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            # SIGTERM makes the bot flush pending answers and exit
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            telegram.stop()
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (usage.ru_utime - usage_before.ru_utime +
+           usage.ru_stime - usage_before.ru_stime)
+    latencies = sorted(latency for client in clients
+                       for latency in client.latencies)
+
+    return {
+        'users': users,
+        'deck_size': args.deck_size,
+        'workers': args.workers,
+        'processes': args.processes,
+        'seconds': round(elapsed, 2),
+        'updates': len(latencies),
+        'timeouts': sum(client.timeouts for client in clients),
+        'updates_per_sec': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1e3, 3)
+        if latencies else None,
+        'p50_ms': percentile(latencies, 0.50),
+        'p99_ms': percentile(latencies, 0.99),
+        'cpu_seconds': round(cpu, 2),
+        'cpu_percent': round(cpu / elapsed * 100, 1),
+        # Peak resident memory of all the finished children, in KiB on
+        # Linux
+        'max_rss_kib': usage.ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Seconds of load per number of users')
+    parser.add_argument('--deck-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Worker processes of the supervisor mode. '
+                        '0 runs a single process')
+    parser.add_argument('--scheduler', choices=['random', 'sm2'],
+                        default='sm2')
+    parser.add_argument('--reply-timeout', type=float, default=10)
+    parser.add_argument('--output', help='JSON file with the results')
+    args = parser.parse_args()
+
+    quiet_logs()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.processes:
+            populate(os.path.join(tmp, 'deck.db'), args.deck_size)
+        print(f"{'users':>6} {'updates/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+              f"{'timeouts':>8} {'cpu %':>6} {'rss MiB':>8}")
+        for users in args.users:
+            result = run(users, args, tmp)
+            results.append(result)
+            print(f"{users:>6} {result['updates_per_sec']:>10} "
+                  f"{result['p50_ms']!s:>8} {result['p99_ms']!s:>8} "
+                  f"{result['timeouts']:>8} {result['cpu_percent']:>6} "
+                  f"{result['max_rss_kib'] / 1024:>8.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file_obj:
+            json.dump({'results': results}, file_obj, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+'''
+Benchmark of StorageManager.select_random_row against deck size
+
+Usage: python3 benchmark/select_random_item.py [--sizes 1000 1000000]
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+from common import measure, populate, quiet_logs
+from storage_manager import StorageManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=10000)
+    parser.add_argument('--baseline', action='store_true',
+                        help='Also measure ORDER BY RANDOM() selection')
+    args = parser.parse_args()
+
+    quiet_logs()
+
+    print(f"{'rows':>10} {'startup ms':>12} {'select us':>10}"
+          f"{' ORDER BY RANDOM() us':>22}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            database = os.path.join(tmp_dir, 'benchmark.db')
+            populate(database, size)
+
+            start = time.perf_counter()
+            storage_manager = StorageManager(database=database)
+            startup = (time.perf_counter() - start) * 1e3
+
+            select = measure(storage_manager.select_random_row, args.repeat)
+
+            baseline = ''
+            if args.baseline:
+                query = 'SELECT * FROM items ORDER BY RANDOM() LIMIT 1'
+                baseline = measure(
+                    lambda cursor=storage_manager.cursor, query=query:
+                    cursor.execute(query).fetchone(),
+                    max(1, args.repeat // 100))
+                baseline = f"{baseline:.1f}"
+
+            storage_manager.close_connection()
+        print(f"{size:>10} {startup:>12.1f} {select:>10.1f} {baseline:>21}")
+
+
+if __name__ == '__main__':
+    main()
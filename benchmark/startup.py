@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+'''
+Startup time of the bot, from the interpreter start to a FlashCardBot
+ready to handle messages.
+
+Every run is a new Python process. Cold runs start with an empty
+configuration cache, so the configuration file is parsed and validated
+with pydantic. Warm runs load the configuration validated by the
+previous run.
+
+Usage: python3 benchmark/startup.py [--runs 10] [--deck-size 10000]
+                                    [--budget 300]
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from common import SRC_PATH, populate
+
+CONFIG = '''[Telegram]
+    API_KEY = "startup"
+
+[FlashCardBot]
+    Commands = ["/new_item", "/new_round"]
+    SleepTime = 1
+    Database = "{database}"
+    Timeout = 20
+    MaxAttempts = 3
+'''
+
+# Executed into the measured process. Times are in seconds from the
+# first statement, the interpreter startup is measured by the parent
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {src!r})
+import flashcard
+imported = time.perf_counter()
+config = flashcard.Configuration({config!r}, cache_dir={cache!r}).validate()
+validated = time.perf_counter()
+bot = flashcard.FlashCardBot(config)
+ready = time.perf_counter()
+bot.outbound.close()
+bot.storage_manager.close_connection()
+bot.sessions.close()
+print(json.dumps({{
+    "import": imported - start,
+    "config": validated - imported,
+    "bot": ready - validated,
+    "modules": sorted(name for name in ("pydantic", "tomli", "telegrambot",
+                                        "asyncio", "http.server")
+                      if name in sys.modules),
+}}))
+'''
+
+
+def run(config: str,
+        cache: str) -> Dict[str, float]:
+    '''
+    Start a process and return its phase timings in milliseconds
+    '''
+
+    code = CHILD.format(src=os.path.abspath(SRC_PATH),
+                        config=config, cache=cache)
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True, text=True, check=True)
+    total = time.perf_counter() - start
+
+    result = json.loads(output.stdout.splitlines()[-1])
+    timings = {phase: result[phase] * 1e3
+               for phase in ('import', 'config', 'bot')}
+    timings['total'] = total * 1e3
+    timings['modules'] = result['modules']
+    return timings
+
+
+def summarize(runs: List[Dict[str, float]]) -> dict:
+    '''
+    Median of every phase
+    '''
+
+    summary = {phase: round(statistics.median(run[phase] for run in runs), 1)
+               for phase in ('import', 'config', 'bot', 'total')}
+    summary['modules'] = runs[-1]['modules']
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--deck-size', type=int, default=10000)
+    parser.add_argument('--budget', type=float,
+                        help='Max. median warm startup in milliseconds. '
+                        'Exit with error if exceeded')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'startup.db')
+        populate(database, args.deck_size)
+        config = os.path.join(tmp, 'config.toml')
+        with open(config, 'w', encoding='utf-8') as config_writer:
+            config_writer.write(CONFIG.format(database=database))
+
+        cold = [run(config, os.path.join(tmp, f'cold-{i}'))
+                for i in range(args.runs)]
+        warm_cache = os.path.join(tmp, 'warm')
+        run(config, warm_cache)
+        warm = [run(config, warm_cache) for _ in range(args.runs)]
+
+    report = {'deck_size': args.deck_size,
+              'runs': args.runs,
+              'cold': summarize(cold),
+              'warm': summarize(warm)}
+    print(json.dumps(report, indent=2))
+
+    if args.budget and report['warm']['total'] > args.budget:
+        print(f"Warm startup {report['warm']['total']} ms exceeds the "
+              f"budget of {args.budget} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
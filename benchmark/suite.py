@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+'''
+Offline benchmark suite of the storage and command dispatch hot paths.
+
+Every benchmark runs against decks of several sizes, with the Telegram
+clients mocked, and the results are written as JSON to be compared
+between commits with benchmark/compare.py.
+
+Usage: python3 benchmark/suite.py [--sizes 1000 1000000]
+                                  [--only check_quiz_item]
+                                  [--output results.json]
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+from unittest.mock import patch
+
+from common import populate, quiet_logs
+from storage_manager import StorageManager
+
+# Same storage settings as the default configuration template
+STORAGE_OPTIONS = {
+    'flush_interval': 2.0,
+    'flush_size': 100,
+    'pragmas': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'busy_timeout': 5000,
+    },
+    'read_connections': 2,
+    'answer_index': 'set',
+    'max_distance': 1,
+}
+
+# {name: (function, operations per run)}
+BENCHMARKS: Dict[str, tuple] = {}
+
+
+class SkipBenchmark(Exception):
+    '''
+    Raised when a benchmark cannot run in the current environment
+    '''
+
+
+def benchmark(name: str,
+              repeat: int) -> Callable:
+    '''
+    Register a benchmark. The function receives the database path, the
+    deck size and the number of operations, and returns the latency of
+    every operation in seconds
+    '''
+
+    def register(function: Callable) -> Callable:
+        BENCHMARKS[name] = (function, repeat)
+        return function
+    return register
+
+
+def timings(operation: Callable,
+            repeat: int) -> List[float]:
+    '''
+    Latency in seconds of `repeat` calls of an operation
+    '''
+
+    result = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        operation(i)
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def bot_config(database: str) -> dict:
+    '''
+    Minimal FlashCardBot configuration using a given database
+    '''
+
+    return {
+        'Telegram': {'API_KEY': 'benchmark'},
+        'FlashCardBot': {
+            'Commands': ['/new_item', '/new_round'],
+            'SleepTime': 1,
+            'Database': database,
+            'Timeout': 20,
+            'MaxAttempts': 3,
+        }
+    }
+
+
+def flashcard_bot(database: str):
+    '''
+    Create a FlashCardBot with the Bot API client replaced by a mock
+    '''
+
+    try:
+        import flashcard
+    except ImportError as error:
+        raise SkipBenchmark(str(error)) from error
+
+    with patch.object(flashcard, 'BotAPI'):
+        return flashcard.FlashCardBot(bot_config(database))
+
+
+@benchmark('open', repeat=5)
+def bench_open(database: str,
+               size: int,
+               repeat: int) -> List[float]:
+    '''
+    Startup time, including the load of the in-memory indexes
+    '''
+
+    def operation(_):
+        StorageManager(database=database, **STORAGE_OPTIONS) \
+            .close_connection()
+    return timings(operation, repeat)
+
+
+@benchmark('insert_item', repeat=500)
+def bench_insert_item(database: str,
+                      size: int,
+                      repeat: int) -> List[float]:
+    storage_manager = StorageManager(database=database, **STORAGE_OPTIONS)
+    try:
+        return timings(lambda i: storage_manager.insert_item(
+            "text", f"new answer{i}", f"new quiz{i}"), repeat)
+    finally:
+        storage_manager.close_connection()
+
+
+@benchmark('select_random_item', repeat=5000)
+def bench_select_random_item(database: str,
+                             size: int,
+                             repeat: int) -> List[float]:
+    storage_manager = StorageManager(database=database, **STORAGE_OPTIONS)
+    try:
+        return timings(lambda _: storage_manager.select_random_item(), repeat)
+    finally:
+        storage_manager.close_connection()
+
+
+@benchmark('select_due_row', repeat=5000)
+def bench_select_due_row(database: str,
+                         size: int,
+                         repeat: int) -> List[float]:
+    storage_manager = StorageManager(database=database, **STORAGE_OPTIONS)
+    try:
+        return timings(lambda _: storage_manager.select_due_row(), repeat)
+    finally:
+        storage_manager.close_connection()
+
+
+@benchmark('check_quiz_item', repeat=5000)
+def bench_check_quiz_item(database: str,
+                          size: int,
+                          repeat: int) -> List[float]:
+    '''
+    Mix of right guesses, typos and wrong guesses
+    '''
+
+    guesses = []
+    for i in range(repeat):
+        item = random.randrange(size)
+        guesses.append([f"answer{item}",
+                        f"answr{item}",
+                        f"unknown{item}"][i % 3])
+
+    storage_manager = StorageManager(database=database, **STORAGE_OPTIONS)
+    try:
+        return timings(lambda i: storage_manager.check_quiz_item(
+            guesses[i], random.randrange(1, size + 1)), repeat)
+    finally:
+        storage_manager.close_connection()
+
+
+@benchmark('import_csv_file', repeat=5)
+def bench_import_csv_file(database: str,
+                          size: int,
+                          repeat: int) -> List[float]:
+    '''
+    Import CSV files of 10k lines, a tenth of them already stored
+    '''
+
+    lines = 10000
+    bot = flashcard_bot(database)
+
+    def download(file_path, chunk_size=65536):
+        offset = int(file_path) * lines - lines // 10
+        data = ''.join(f"answer{size + i},quiz{size + i}\n"
+                       for i in range(offset, offset + lines)).encode()
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    bot.bot_api.get_file.side_effect = lambda file_id: {
+        'file_id': file_id, 'file_path': file_id}
+    bot.bot_api.download.side_effect = download
+    try:
+        return timings(lambda i: bot.import_csv_file(str(i)), repeat)
+    finally:
+        bot.storage_manager.close_connection()
+
+
+@benchmark('processing_command', repeat=2000)
+def bench_processing_command(database: str,
+                             size: int,
+                             repeat: int) -> List[float]:
+    '''
+    Dispatch of /new_round commands from several chats
+    '''
+
+    bot = flashcard_bot(database)
+    message = {"text": "/new_round"}
+    try:
+        return timings(lambda i: bot.processing_command(message, i % 100),
+                       repeat)
+    finally:
+        bot.storage_manager.close_connection()
+
+
+@benchmark('batch_round', repeat=200)
+def bench_batch_round(database: str,
+                      size: int,
+                      repeat: int) -> List[float]:
+    '''
+    Rounds of 10 cards answered in a single message, from several
+    chats. Divide by 10 to compare with processing_command
+    '''
+
+    bot = flashcard_bot(database)
+    command = {"text": "/new_round 10"}
+    answers = {"text": "\n".join(f"answer{i}" for i in range(10))}
+
+    def operation(i):
+        bot.handle_message(command, i % 100)
+        bot.handle_message(answers, i % 100)
+    try:
+        return timings(operation, repeat)
+    finally:
+        bot.storage_manager.close_connection()
+
+
+def summarize(name: str,
+              size: int,
+              latencies: List[float]) -> dict:
+    '''
+    Latency statistics of a benchmark run in microseconds
+    '''
+
+    latencies = sorted(latencies)
+    total = sum(latencies)
+
+    def percentile(fraction: float) -> float:
+        position = min(len(latencies) - 1, int(fraction * len(latencies)))
+        return round(latencies[position] * 1e6, 2)
+
+    return {
+        'benchmark': name,
+        'size': size,
+        'operations': len(latencies),
+        'mean_us': round(statistics.mean(latencies) * 1e6, 2),
+        'p50_us': percentile(0.50),
+        'p95_us': percentile(0.95),
+        'p99_us': percentile(0.99),
+        'max_us': round(latencies[-1] * 1e6, 2),
+        'ops_per_sec': round(len(latencies) / total, 1) if total else None,
+    }
+
+
+def metadata(seed: int) -> dict:
+    '''
+    Environment of the run, to know what is being compared
+    '''
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'seed': seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS),
+                        help='Benchmarks to run. All of them by default')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiplier of the operations per benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file. Standard output if '
+                        'not defined')
+    args = parser.parse_args()
+
+    quiet_logs()
+    names = args.only or list(BENCHMARKS)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            deck = os.path.join(tmp, f'deck-{size}.db')
+            populate(deck, size)
+
+            for name in names:
+                function, repeat = BENCHMARKS[name]
+                # Every benchmark starts from the same deck
+                database = os.path.join(tmp, 'benchmark.db')
+                shutil.copyfile(deck, database)
+                random.seed(args.seed)
+                try:
+                    latencies = function(database, size,
+                                         max(1, int(repeat * args.scale)))
+                    result = summarize(name, size, latencies)
+                except SkipBenchmark as error:
+                    result = {'benchmark': name, 'size': size,
+                              'skipped': str(error)}
+                finally:
+                    for suffix in ('', '-wal', '-shm'):
+                        if os.path.exists(database + suffix):
+                            os.remove(database + suffix)
+
+                results.append(result)
+                print(f"{name:>20} {size:>8} "
+                      f"{result.get('p50_us', result.get('skipped'))}",
+                      file=sys.stderr)
+
+    report = json.dumps({'metadata': metadata(args.seed),
+                         'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file_obj:
+            file_obj.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
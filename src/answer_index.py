@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+'''
+In-memory index of stored answers
+'''
+
+import hashlib
+import math
+import sys
+from typing import Iterable, Optional
+
+
+class BloomFilter:
+    '''
+    Probabilistic set: membership tests may return false positives
+    (at most `error_rate` of them) but never false negatives.
+    '''
+    def __init__(self,
+                 capacity: int,
+                 error_rate: float = 0.01) -> None:
+
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.count = 0
+
+        # Optimal number of bits and hash functions
+        self.size = math.ceil(-self.capacity * math.log(error_rate) /
+                              math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self,
+                   value: str):
+        '''
+        Bit positions of a value, using double hashing
+        '''
+
+        digest = hashlib.blake2b(value.encode('utf-8'),
+                                 digest_size=16).digest()
+        hash_a = int.from_bytes(digest[:8], 'little')
+        hash_b = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (hash_a + i * hash_b) % self.size
+
+    def add(self,
+            value: str) -> None:
+        '''
+        Add a value to the filter
+        '''
+
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self,
+                     value: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(value))
+
+    def memory_usage(self) -> int:
+        '''
+        Memory footprint in bytes
+        '''
+        return sys.getsizeof(self.bits)
+
+
+class AnswerIndex:
+    '''
+    Answers stored into the database, used to resolve guesses without
+    queries.
+
+    The "set" kind stores every answer and gives exact results. The
+    "bloom" kind uses a fraction of the memory for very large decks:
+    misses are still exact, but hits must be confirmed by the database.
+    '''
+    KINDS = ("set", "bloom")
+
+    def __init__(self,
+                 kind: str = "set",
+                 answers: Iterable[str] = (),
+                 error_rate: float = 0.01) -> None:
+
+        if kind not in self.KINDS:
+            raise ValueError(f"Unsupported answer index {kind}")
+
+        self.kind = kind
+        self.error_rate = error_rate
+        self.answers = set(answers)
+        self.bloom = None
+        if kind == "bloom":
+            self._build_bloom(self.answers)
+            self.answers = None
+
+    def _build_bloom(self,
+                     answers: Iterable[str]) -> None:
+        '''
+        Create the Bloom filter with room to grow twice the deck
+        '''
+
+        answers = list(answers)
+        self.bloom = BloomFilter(max(1024, 2 * len(answers)),
+                                 self.error_rate)
+        for answer in answers:
+            self.bloom.add(answer)
+
+    @property
+    def needs_rebuild(self) -> bool:
+        '''
+        A full Bloom filter would exceed its false positive rate
+        '''
+        return self.bloom is not None and \
+            self.bloom.count > self.bloom.capacity
+
+    def rebuild(self,
+                answers: Iterable[str]) -> None:
+        '''
+        Reload the index with all stored answers
+        '''
+
+        if self.bloom is not None:
+            self._build_bloom(answers)
+        else:
+            self.answers = set(answers)
+
+    def add(self,
+            answer: str) -> None:
+        '''
+        Add a new stored answer
+        '''
+
+        if self.bloom is not None:
+            self.bloom.add(answer)
+        else:
+            self.answers.add(answer)
+
+    def discard(self,
+                answer: str) -> None:
+        '''
+        Remove a deleted answer. Bloom filters cannot remove values, so
+        the deleted answer becomes a false positive
+        '''
+
+        if self.answers is not None:
+            self.answers.discard(answer)
+
+    def lookup(self,
+               answer: str) -> Optional[bool]:
+        '''
+        Check if an answer is stored
+
+        Returns:
+            - bool: True if stored, False if not stored or None if the
+                database must be queried to know it
+        '''
+
+        if self.bloom is not None:
+            return None if answer in self.bloom else False
+        return answer in self.answers
+
+    def memory_usage(self) -> int:
+        '''
+        Memory footprint in bytes
+        '''
+
+        if self.bloom is not None:
+            return self.bloom.memory_usage()
+        return sys.getsizeof(self.answers) + \
+            sum(sys.getsizeof(answer) for answer in self.answers)
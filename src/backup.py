@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+'''
+Periodic online backups of the database
+'''
+
+import logging
+import os
+import threading
+import time
+
+from metrics import Counter, Gauge
+from storage_manager import StorageManagerException
+
+logger = logging.getLogger(__name__)
+
+BACKUPS = Counter('flashcard_backups_total',
+                  'Database backups',
+                  ['result'])
+LAST_BACKUP = Gauge('flashcard_backup_last_success_timestamp_seconds',
+                    'Time of the last complete backup')
+
+
+class BackupScheduler:
+    '''
+    Copy the database into a backup file from a background thread, with
+    the SQLite online backup API. The bot keeps handling messages
+    meanwhile: writers only wait for the copy of a few pages at a time.
+    '''
+    def __init__(self,
+                 storage_manager,
+                 path: str,
+                 interval: float = 86400,
+                 pages: int = 256,
+                 sleep: float = 0.01) -> None:
+
+        self.storage_manager = storage_manager
+        self.path = path
+        self.interval = interval
+        self.pages = pages
+        self.sleep = sleep
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       name="backup",
+                                       daemon=True)
+
+    def run_once(self) -> bool:
+        '''
+        Back up the database now
+
+        Returns:
+            - bool: True if the backup is complete
+        '''
+
+        directory = os.path.dirname(self.path)
+        start = time.perf_counter()
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.storage_manager.backup(self.path, self.pages, self.sleep)
+        except (OSError, StorageManagerException) as error:
+            BACKUPS.inc(result="error")
+            logger.error("Backup into %s failed: %s", self.path, error)
+            return False
+
+        BACKUPS.inc(result="done")
+        LAST_BACKUP.set(time.time())
+        logger.info("Database backed up into %s in %.1fs",
+                    self.path, time.perf_counter() - start)
+        return True
+
+    def _run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.run_once()
+
+    def start(self) -> "BackupScheduler":
+        '''
+        Back up every interval seconds
+        '''
+
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''
+        Stop the backups, once the one in progress is complete
+        '''
+
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+'''
+Minimal Telegram Bot API client used by the polling engine
+'''
+
+import io
+import logging
+import uuid
+from typing import BinaryIO, Iterator, Optional
+
+import requests
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = Histogram('flashcard_telegram_request_seconds',
+                            'Duration of Telegram Bot API requests',
+                            ['method'])
+REQUEST_ERRORS = Counter('flashcard_telegram_request_errors_total',
+                         'Failed Telegram Bot API requests',
+                         ['method'])
+
+API_URL = "https://api.telegram.org"
+
+# {item type: (Bot API method, payload field)}
+SEND_METHODS = {
+    "text": ("sendMessage", "text"),
+    "photo": ("sendPhoto", "photo"),
+    "audio": ("sendAudio", "audio"),
+    "video": ("sendVideo", "video"),
+}
+
+
+class BotAPIException(Exception):
+    '''
+    Raised when a Telegram Bot API request fails
+    '''
+    def __init__(self,
+                 message,
+                 retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_message(message: dict) -> Optional[dict]:
+    '''
+    Convert a Telegram message object into the {item_type: value}
+    format handled by FlashCardBot
+
+    Parameters:
+        - message (dict): Telegram Bot API message object
+
+    Returns:
+        - dict: Parsed message or None for unsupported formats
+    '''
+
+    if "text" in message:
+        return {"text": message["text"]}
+
+    if "document" in message:
+        return {"document": message["document"]["file_id"]}
+
+    caption = message.get("caption", "")
+    if "photo" in message:
+        # Telegram sends several sizes of the same photo. The last
+        # one is the biggest.
+        return {"photo": (message["photo"][-1]["file_id"], caption)}
+
+    for item_type in ("audio", "video"):
+        if item_type in message:
+            return {item_type: (message[item_type]["file_id"], caption)}
+
+    return None
+
+
+def parse_update(update: dict) -> tuple:
+    '''
+    Extract the chat id and parsed message from a Telegram update
+
+    Parameters:
+        - update (dict): Telegram Bot API update object
+
+    Returns:
+        - tuple: (chat_id, message). Both None if update has no message
+    '''
+
+    message = update.get("message") or update.get("edited_message")
+    if not message:
+        return None, None
+
+    return message["chat"]["id"], parse_message(message)
+
+
+class MultipartUpload:
+    '''
+    multipart/form-data body read while it is sent, so uploaded files
+    are not loaded into memory. Its length is known beforehand, so the
+    request has a Content-Length instead of a chunked body
+    '''
+    def __init__(self,
+                 fields: dict,
+                 name: str,
+                 filename: str,
+                 file: BinaryIO,
+                 size: int) -> None:
+
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = "".join(
+            f"--{boundary}\r\nContent-Disposition: form-data; "
+            f"name=\"{key}\"\r\n\r\n{value}\r\n"
+            for key, value in fields.items())
+        head += (f"--{boundary}\r\nContent-Disposition: form-data; "
+                 f"name=\"{name}\"; filename=\"{filename}\"\r\n"
+                 "Content-Type: application/octet-stream\r\n\r\n")
+        head = head.encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+
+        self.length = len(head) + size + len(tail)
+        self.parts = [io.BytesIO(head), file, io.BytesIO(tail)]
+
+    def __len__(self) -> int:
+        return self.length
+
+    def read(self,
+             size: int = -1) -> bytes:
+        while self.parts:
+            data = self.parts[0].read(size)
+            if data:
+                return data
+            self.parts.pop(0)
+        return b""
+
+
+class BotAPI:
+    '''
+    Thin synchronous wrapper around the Telegram Bot API HTTP interface
+    '''
+    def __init__(self,
+                 config: dict,
+                 timeout: int = 10) -> None:
+
+        self.base_url = config.get("API_URL", API_URL).rstrip('/')
+        self.url = f"{self.base_url}/bot{config['API_KEY']}"
+        self.file_url = f"{self.base_url}/file/bot{config['API_KEY']}"
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def call(self,
+             method: str,
+             request_timeout: Optional[int] = None,
+             **params) -> dict:
+        '''
+        Perform a Bot API request
+
+        Parameters:
+            - method (str): Bot API method name
+            - request_timeout (int): HTTP timeout in seconds
+            - params: Method parameters
+
+        Returns:
+            - dict: The result field of the Bot API response
+        '''
+        return self._request(method, request_timeout, json=params)
+
+    def _request(self,
+                 method: str,
+                 request_timeout: Optional[int] = None,
+                 **body) -> dict:
+        '''
+        Post a request with a JSON or a multipart body and return its
+        result
+        '''
+
+        try:
+            with REQUEST_SECONDS.time(method=method):
+                response = self.session.post(
+                    f"{self.url}/{method}",
+                    timeout=request_timeout or self.timeout,
+                    **body)
+                data = response.json()
+        except (requests.RequestException, ValueError) as exception:
+            REQUEST_ERRORS.inc(method=method)
+            raise BotAPIException(
+                f"{method} request failed: {exception}") from exception
+
+        if not data.get("ok"):
+            REQUEST_ERRORS.inc(method=method)
+            retry_after = data.get("parameters", {}).get("retry_after")
+            raise BotAPIException(
+                f"{method} error: {data.get('description')}",
+                retry_after=retry_after)
+
+        return data["result"]
+
+    def get_updates(self,
+                    offset: Optional[int] = None,
+                    timeout: int = 0) -> list:
+        '''
+        Long-poll pending updates
+
+        Parameters:
+            - offset (int): Identifier of the first update to be returned
+            - timeout (int): Long polling timeout in seconds
+
+        Returns:
+            - list: Telegram update objects
+        '''
+
+        params = {"timeout": timeout}
+        if offset is not None:
+            params["offset"] = offset
+
+        # Give the HTTP request some margin over the long polling timeout
+        return self.call("getUpdates",
+                         request_timeout=timeout + self.timeout,
+                         **params)
+
+    def get_file(self,
+                 file_id: str) -> dict:
+        '''
+        Get the download path of a file
+
+        Parameters:
+            - file_id (str): Telegram file_id
+
+        Returns:
+            - dict: Telegram File object with file_path and file_size
+        '''
+        return self.call("getFile", file_id=file_id)
+
+    def download(self,
+                 file_path: str,
+                 chunk_size: int = 65536) -> Iterator[bytes]:
+        '''
+        Stream the content of a file
+
+        Parameters:
+            - file_path (str): Path returned by get_file
+            - chunk_size (int): Max. size of the returned chunks
+
+        Returns:
+            - iterator: Chunks of bytes. Close it to abort the download
+        '''
+
+        try:
+            with REQUEST_SECONDS.time(method="download"), \
+                    self.session.get(f"{self.file_url}/{file_path}",
+                                     stream=True,
+                                     timeout=self.timeout) as response:
+                response.raise_for_status()
+                yield from response.iter_content(chunk_size)
+        except requests.RequestException as exception:
+            REQUEST_ERRORS.inc(method="download")
+            raise BotAPIException(
+                f"Download failed: {exception}") from exception
+
+    def send(self,
+             item_type: str,
+             chat_id: int,
+             content: str) -> dict:
+        '''
+        Send a text or a media item to a chat
+
+        Parameters:
+            - item_type (str): Type of item (text, photo, audio or video)
+            - chat_id (int): Target chat
+            - content (str): Text or Telegram file_id to be sent
+        '''
+
+        method, field = SEND_METHODS[item_type]
+        return self.call(method, chat_id=chat_id, **{field: str(content)})
+
+    def send_message(self,
+                     chat_id: int,
+                     text: str) -> dict:
+        '''
+        Send a text message to a chat
+        '''
+        return self.send("text", chat_id, text)
+
+    def send_document(self,
+                      chat_id: int,
+                      document: BinaryIO,
+                      size: int,
+                      filename: str) -> dict:
+        '''
+        Upload a file to a chat. The file is streamed from its current
+        position
+
+        Parameters:
+            - chat_id (int): Target chat
+            - document (file): Binary file to be sent
+            - size (int): Size in bytes of the file
+            - filename (str): Name of the file shown in the chat
+        '''
+
+        upload = MultipartUpload({"chat_id": chat_id}, "document", filename,
+                                 document, size)
+        return self._request("sendDocument",
+                             data=upload,
+                             headers={"Content-Type": upload.content_type})
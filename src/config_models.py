@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+'''
+Pydantic models of the TOML configuration file.
+
+Importing pydantic and building the models is the slowest part of the
+startup, so this module is only imported when a configuration file has
+to be validated (see configuration.Configuration).
+'''
+
+from typing import Dict, List, Literal
+
+import pydantic
+from pydantic import BaseModel
+
+class TelegramBotConfig(BaseModel):
+    ''' TelegramBot Configuration Model'''
+    API_KEY: str
+    API_URL: str = "https://api.telegram.org"
+
+class SessionConfig(BaseModel):
+    ''' Per-chat sessions Configuration Model'''
+    MaxSessions: int = 10000
+    TTL: int = 3600
+    Persist: bool = False
+
+class StorageConfig(BaseModel):
+    ''' Storage Configuration Model'''
+    FlushInterval: float = 2.0
+    FlushSize: int = 100
+    JournalMode: Literal["DELETE", "TRUNCATE", "PERSIST",
+                         "MEMORY", "WAL", "OFF"] = "WAL"
+    Synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    CacheSize: int = -2000
+    MmapSize: int = 0
+    BusyTimeout: int = 5000
+    ReadConnections: int = 2
+    AnswerIndex: Literal["none", "set", "bloom"] = "set"
+    Partition: Literal["shared", "chat"] = "shared"
+    Shards: int = 1
+    MaxPartitions: int = 1024
+
+class MatchingConfig(BaseModel):
+    ''' Answer matching Configuration Model'''
+    Normalize: bool = True
+    MaxDistance: int = 1
+
+class MetricsConfig(BaseModel):
+    ''' Prometheus metrics endpoint Configuration Model'''
+    Enabled: bool = False
+    Host: str = "127.0.0.1"
+    Port: int = 9100
+
+class WebhookConfig(BaseModel):
+    ''' Webhook Configuration Model'''
+    Enabled: bool = False
+    URL: str = ""
+    Host: str = "0.0.0.0"
+    Port: int = 8443
+    Path: str = "/webhook"
+    SecretToken: str = ""
+    QueueSize: int = 100
+    MaxConnections: int = 40
+
+    @pydantic.model_validator(mode="after")
+    def check_url(self):
+        ''' Telegram needs a public HTTPS URL to push the updates'''
+        if self.Enabled and not self.URL.startswith("https://"):
+            raise ValueError("Webhook URL must be a https:// URL")
+        return self
+
+class OutboundConfig(BaseModel):
+    ''' Outbound replies Configuration Model'''
+    Workers: int = 2
+    GlobalRate: float = 30
+    ChatRate: float = 1
+    ChatBurst: float = 3
+    MaxRetries: int = 5
+
+class ReloadConfig(BaseModel):
+    ''' Configuration reload Model'''
+    Enabled: bool = True
+    Interval: float = 5.0
+
+class SupervisorConfig(BaseModel):
+    ''' Multi-process mode Configuration Model'''
+    Enabled: bool = False
+    Workers: int = 0
+    HeartbeatTimeout: float = 30
+    QueueSize: int = 1000
+
+class BackupConfig(BaseModel):
+    ''' Online backup Configuration Model'''
+    Enabled: bool = False
+    Path: str = "backup/flashcard.db"
+    Interval: float = 86400
+    Pages: int = 256
+    Sleep: float = 0.01
+
+class ExportConfig(BaseModel):
+    ''' Deck export Configuration Model'''
+    Format: Literal["csv", "jsonl"] = "csv"
+    MaxSize: int = 50 * 1024 * 1024
+
+class PrefetchConfig(BaseModel):
+    ''' Next cards prefetch Configuration Model'''
+    Enabled: bool = True
+    Depth: int = 3
+    MaxChats: int = 10000
+
+class FlashCardBotConfig(BaseModel):
+    ''' FlashCard Bot Configuration Model'''
+    Commands: List[str]
+    SleepTime: int
+    Database: str
+    Timeout: int
+    MaxAttempts: int
+    PollTimeout: int = 30
+    Workers: int = 4
+    Scheduler: Literal["random", "sm2"] = "sm2"
+    ImportBatchSize: int = 1000
+    MaxImportSize: int = 20 * 1024 * 1024
+    MaxRoundSize: int = 20
+    Session: SessionConfig = SessionConfig()
+    Storage: StorageConfig = StorageConfig()
+    Matching: MatchingConfig = MatchingConfig()
+    Metrics: MetricsConfig = MetricsConfig()
+    Webhook: WebhookConfig = WebhookConfig()
+    Outbound: OutboundConfig = OutboundConfig()
+    Reload: ReloadConfig = ReloadConfig()
+    Supervisor: SupervisorConfig = SupervisorConfig()
+    Backup: BackupConfig = BackupConfig()
+    Export: ExportConfig = ExportConfig()
+    Prefetch: PrefetchConfig = PrefetchConfig()
+
+    @pydantic.model_validator(mode="after")
+    def check_supervisor(self):
+        ''' Workers only share data through their storage shards'''
+        if self.Supervisor.Enabled:
+            if self.Storage.Partition != "chat":
+                raise ValueError("Supervisor mode requires "
+                                 "Storage.Partition = \"chat\"")
+            if self.Webhook.Enabled:
+                raise ValueError("Supervisor mode only supports polling")
+        return self
+
+LogLevel = Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+class LoggingConfig(BaseModel):
+    ''' Logging Configuration Model'''
+    Level: LogLevel = "INFO"
+    Format: Literal["text", "json"] = "text"
+    File: str = ""
+    QueueSize: int = 10000
+    Levels: Dict[str, LogLevel] = {}
+    Sampling: Dict[str, float] = {}
+
+class TOMLConfig(BaseModel):
+    ''' Configuration model '''
+    Telegram: TelegramBotConfig
+    FlashCardBot: FlashCardBotConfig
+    Logging: LoggingConfig = LoggingConfig()
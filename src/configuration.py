@@ -3,35 +3,23 @@
 Configuration Handler
 '''
 
+import hashlib
+import json
 import logging
-from typing import List
+import os
+import tempfile
+from typing import Optional
 
-import pydantic
-from pydantic import BaseModel
-
-import tomli
-
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-class TelegramBotConfig(BaseModel):
-    ''' TelegramBot Configuration Model'''
-    API_KEY: str
+# Validated configurations, to skip parsing and validation on startups
+# with unchanged configuration files
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'flashcardbot')
 
-class FlashCardBotConfig(BaseModel):
-    ''' FlashCard Bot Configuration Model'''
-    Commands: List[str]
-    SleepTime: int
-    Database: str
-    Timeout: int
-    MaxAttempts: int
-
-class TOMLConfig(BaseModel):
-    ''' Configuration model '''
-    Telegram: TelegramBotConfig
-    FlashCardBot: FlashCardBotConfig
+MODELS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'config_models.py')
 
 
 class ConfigurationException(Exception):
@@ -45,12 +33,18 @@ class ConfigurationException(Exception):
 
 class Configuration:
     '''
-    Class to manage TOML configuration file
+    Class to manage TOML configuration file.
+
+    Validated configurations are cached as JSON, keyed on the hash of
+    the configuration file and of the models. Unchanged configurations
+    are loaded from the cache without importing tomli nor pydantic.
     '''
     def __init__(self,
-                 configuration_file: str):
+                 configuration_file: str,
+                 cache_dir: Optional[str] = DEFAULT_CACHE_DIR):
 
         self.configuration_file = configuration_file
+        self.cache_dir = cache_dir
 
     def validate(self) -> dict:
         '''
@@ -60,25 +54,116 @@ class Configuration:
             - dict: TOML configuration file data
         '''
 
+        content = self.read_bytes()
+        cache_file = self.cache_file(content)
+        data = self.read_cache(cache_file)
+        if data is not None:
+            return data
+
         # Read configuration file data and try to validate it
         # against pydantic model
-        data = self.read()
+        import pydantic
+        from config_models import TOMLConfig
+
+        data = self.parse(content)
         try:
             TOMLConfig(**data)
         except pydantic.ValidationError as exception:
             raise ConfigurationException(
                 f"Configuration file validation error: {exception}") \
                     from exception
+        self.write_cache(cache_file, data)
         return data
 
 
-    def read(self):
+    def read(self) -> dict:
         '''
         Read TOML configuration file
         '''
+        return self.parse(self.read_bytes())
+
+    def read_bytes(self) -> bytes:
+        '''
+        Raw content of the configuration file
+        '''
         try:
             with open(self.configuration_file, 'rb') as config_reader:
-                return tomli.load(config_reader)
+                return config_reader.read()
         except FileNotFoundError as exception:
             raise ConfigurationException(
                 f'{self.configuration_file} not found') from exception
+
+    def parse(self,
+              content: bytes) -> dict:
+        '''
+        Parse the TOML content of the configuration file
+        '''
+        import tomli
+
+        try:
+            return tomli.loads(content.decode('utf-8'))
+        except (UnicodeDecodeError, tomli.TOMLDecodeError) as exception:
+            raise ConfigurationException(
+                f'{self.configuration_file} is not a valid TOML file: '
+                f'{exception}') from exception
+
+    def cache_file(self,
+                   content: bytes) -> Optional[str]:
+        '''
+        Cache file of a configuration. A change of the models
+        invalidates the cache too
+
+        Returns:
+            - str: Path of the cache file. None if caching is disabled
+        '''
+        if self.cache_dir is None:
+            return None
+
+        digest = hashlib.sha256(content)
+        try:
+            with open(MODELS_FILE, 'rb') as models:
+                digest.update(models.read())
+        except OSError:
+            return None
+        return os.path.join(self.cache_dir, f'{digest.hexdigest()}.json')
+
+    @staticmethod
+    def read_cache(cache_file: Optional[str]) -> Optional[dict]:
+        '''
+        Validated configuration from the cache. None on a cache miss
+        '''
+        if cache_file is None:
+            return None
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as cache_reader:
+                return json.load(cache_reader)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def write_cache(cache_file: Optional[str],
+                    data: dict) -> None:
+        '''
+        Store a validated configuration. The file is replaced
+        atomically, so concurrent startups never read a partial file.
+        Errors are ignored: the cache is only an optimization
+        '''
+        if cache_file is None:
+            return
+        try:
+            # TOML dates are not valid JSON: do not cache them
+            content = json.dumps(data)
+            cache_dir = os.path.dirname(cache_file)
+            os.makedirs(cache_dir, exist_ok=True)
+            file_descriptor, tmp_file = tempfile.mkstemp(dir=cache_dir,
+                                                         suffix='.tmp')
+            try:
+                with os.fdopen(file_descriptor, 'w',
+                               encoding='utf-8') as cache_writer:
+                    cache_writer.write(content)
+                os.replace(tmp_file, cache_file)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+        except (OSError, TypeError, ValueError) as exception:
+            logger.debug("Configuration not cached: %s", exception)
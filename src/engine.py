@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+'''
+Asyncio polling engine
+'''
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from typing import Callable, Dict, Optional
+
+from bot_api import BotAPIException, parse_update
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+PENDING_MESSAGES = Gauge('flashcard_engine_pending_messages',
+                         'Messages received and not handled yet')
+ACTIVE_CHATS = Gauge('flashcard_engine_active_chats',
+                     'Chats with messages being handled')
+
+
+class PollingEngine:
+    '''
+    Long-poll the Telegram Bot API and dispatch incoming messages
+    concurrently.
+
+    Messages of the same chat are handled in arrival order, while
+    different chats are processed in parallel into a thread pool, so
+    blocking handlers (SQLite queries, media sends, CSV imports) do not
+    stall other users.
+    '''
+    def __init__(self,
+                 handler: Callable[[dict, int], object],
+                 api,
+                 poll_timeout: int = 30,
+                 workers: int = 4,
+                 retry_delay: int = 1) -> None:
+
+        self.handler = handler
+        self.api = api
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.offset: Optional[int] = None
+
+        # Handlers and Bot API polling run into different executors
+        # to avoid a busy pool delaying the next getUpdates call
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="handler")
+        self._poller = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix="poller")
+
+        # Pending messages per chat: {chat_id: queue}
+        self._chats: Dict[int, asyncio.Queue] = {}
+        self._tasks = set()
+        self._running = False
+
+    def dispatch(self,
+                 chat_id: int,
+                 message: dict) -> None:
+        '''
+        Queue a message to be handled into its chat worker
+
+        Parameters:
+            - chat_id (int): Chat which sent the message
+            - message (dict): Parsed incoming message
+        '''
+
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = asyncio.Queue()
+            task = asyncio.ensure_future(self._drain(chat_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            ACTIVE_CHATS.set(len(self._chats))
+        queue.put_nowait(message)
+        PENDING_MESSAGES.inc()
+
+    async def _drain(self,
+                     chat_id: int,
+                     queue: asyncio.Queue) -> None:
+        '''
+        Handle all pending messages of a chat sequentially
+        '''
+
+        loop = asyncio.get_running_loop()
+        try:
+            while not queue.empty():
+                message = queue.get_nowait()
+                try:
+                    await loop.run_in_executor(self.executor,
+                                               self.handler,
+                                               message,
+                                               chat_id)
+                except Exception:
+                    logger.exception("Error handling message from chat %s",
+                                     chat_id)
+                finally:
+                    PENDING_MESSAGES.dec()
+        finally:
+            # No await between the empty check and this point, so no
+            # message can be lost into a detached queue
+            del self._chats[chat_id]
+            ACTIVE_CHATS.set(len(self._chats))
+
+    async def poll_once(self) -> int:
+        '''
+        Fetch a batch of updates and dispatch them
+
+        Returns:
+            - int: Number of received updates
+        '''
+
+        loop = asyncio.get_running_loop()
+        updates = await loop.run_in_executor(self._poller,
+                                             self.api.get_updates,
+                                             self.offset,
+                                             self.poll_timeout)
+        for update in updates:
+            # Confirm the update to the Bot API on the next request
+            self.offset = update["update_id"] + 1
+
+            # Updates without a message of a supported format are not
+            # handled: pending commands expect one
+            chat_id, message = parse_update(update)
+            if chat_id is None or message is None:
+                logger.debug("Skipping update %s", update["update_id"])
+                continue
+            self.dispatch(chat_id, message)
+
+        return len(updates)
+
+    async def run(self) -> None:
+        '''
+        Poll the Bot API until stop() is called
+        '''
+
+        self._running = True
+        try:
+            while self._running:
+                try:
+                    await self.poll_once()
+                except BotAPIException as error:
+                    logger.error("Polling error: %s", error)
+                    await asyncio.sleep(error.retry_after or
+                                        self.retry_delay)
+            await self.join()
+        finally:
+            self.executor.shutdown(wait=False)
+            self._poller.shutdown(wait=False)
+
+    async def join(self) -> None:
+        '''
+        Wait until all dispatched messages have been handled
+        '''
+
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    def stop(self) -> None:
+        '''
+        Stop polling after the current getUpdates request
+        '''
+        self._running = False
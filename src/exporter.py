@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+'''
+Streaming export of the items of a deck
+'''
+
+import csv
+import io
+import json
+from typing import BinaryIO, Iterable, Iterator, Tuple
+
+# Export formats: the text items of CSV files can be imported back with
+# /new_item. Only JSONL files keep the type of the media items
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+class ExportException(Exception):
+    '''
+    Raised when an export is too large to be sent
+    '''
+    def __init__(self,
+                 message):
+        super().__init__(message)
+
+
+def csv_lines(items: Iterable[Tuple[str, str, str, int, int]]
+              ) -> Iterator[str]:
+    '''
+    Two columns "answer,quiz" CSV lines, the format of the imports. The
+    quiz of media items is their Telegram file ID, imported as text
+    '''
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for _, answer, quiz, _, _ in items:
+        writer.writerow((answer, quiz))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def jsonl_lines(items: Iterable[Tuple[str, str, str, int, int]]
+                ) -> Iterator[str]:
+    '''
+    One JSON object per item, with its type and answer counters
+    '''
+
+    for item_type, answer, quiz, correct, wrong in items:
+        yield json.dumps({"type": item_type, "answer": answer, "quiz": quiz,
+                          "correct": correct, "wrong": wrong},
+                         ensure_ascii=False) + "\n"
+
+
+def write_export(items: Iterable[Tuple[str, str, str, int, int]],
+                 output: BinaryIO,
+                 export_format: str = "csv",
+                 max_size: int = 50 * 1024 * 1024) -> int:
+    '''
+    Write the items of a deck into a binary file, one line at a time
+
+    Parameters:
+        - items (iterable): Rows of StorageManager.export_items
+        - output (file): Binary file receiving the export
+        - export_format (str): "csv" or "jsonl"
+        - max_size (int): Max. size in bytes of the export
+
+    Returns:
+        - int: Size in bytes of the export
+    '''
+
+    if export_format not in EXPORT_FORMATS:
+        raise ExportException(f"Unknown export format {export_format}")
+    lines = csv_lines(items) if export_format == "csv" \
+        else jsonl_lines(items)
+
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        size += len(data)
+        if size > max_size:
+            raise ExportException(
+                f"Export too large. Max. size is {max_size} bytes")
+        output.write(data)
+    return size
@@ -3,23 +3,73 @@
 A TelegramBot to learn new words
 '''
 
-from datetime import datetime, timezone
-
+import functools
 import logging
-import os
+import signal
 import sys
+import tempfile
 import time
+from types import MappingProxyType
+from typing import Iterable, List, Mapping, NamedTuple, Optional
 
-from telegrambot import TelegramBot
-
+from bot_api import BotAPI, BotAPIException
 from configuration import Configuration, ConfigurationException
+from importer import ImportException, ImportSummary, import_csv, stream_lines
+from log_config import setup_logging
+from metrics import Counter, Histogram, MetricsServer
+from outbound import OutboundDispatcher
+from session import Round, SessionStore
 from storage_manager import StorageManager, StorageManagerException
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.DEBUG)
+# Worker processes of the supervisor mode run this file as __mp_main__.
+# Reuse it when they import flashcard instead of loading it twice
+if __name__ == '__mp_main__':  # pragma: no cover
+    sys.modules['flashcard'] = sys.modules[__name__]
+
 logger = logging.getLogger(__name__)
 
+HANDLER_SECONDS = Histogram('flashcard_handler_seconds',
+                            'Duration of incoming message handling',
+                            ['command'])
+HANDLER_ERRORS = Counter('flashcard_handler_errors_total',
+                         'Incoming messages answered with an error',
+                         ['error'])
+
+# FlashCardBot options applied by a reload. Other changes need a restart
+RELOADABLE = frozenset(('Commands', 'SleepTime', 'MaxAttempts', 'Scheduler',
+                        'ImportBatchSize', 'MaxImportSize', 'MaxRoundSize',
+                        'Export'))
+
+# Max. typos allowed by /tolerance
+MAX_TOLERANCE = 3
+
+# Max. characters of a Telegram text message
+MAX_MESSAGE_LENGTH = 4096
+
+
+def split_message(lines: Iterable[str],
+                  limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    '''
+    Join lines into as few messages as possible, each one within the
+    length limit of Telegram. Longer lines are sent alone
+
+    Parameters:
+        - lines (iterable): Lines of the messages
+        - limit (int): Max. characters of a message
+
+    Returns:
+        - list: Texts of the messages
+    '''
+
+    messages: List[str] = []
+    for line in lines:
+        if messages and len(messages[-1]) + 1 + len(line) <= limit:
+            messages[-1] += "\n" + line
+        else:
+            messages.append(line)
+    return messages
+
+
 class CommandException(Exception):
     '''
     Raised when try to use a non-text value as command
@@ -28,6 +78,54 @@ class CommandException(Exception):
                  message):
         super().__init__(message)
 
+class Settings(NamedTuple):
+    '''
+    Immutable snapshot of the reloadable options, replaced as a whole
+    on reload so a message is handled with a consistent configuration
+    '''
+    commands: Mapping[str, str]
+    available: str
+    max_attempts: int
+    sleep_time: int
+    scheduler: str
+    import_batch_size: int
+    max_import_size: int
+    max_round_size: int
+    export_format: str
+    max_export_size: int
+
+    @classmethod
+    def from_config(cls,
+                    config: dict) -> "Settings":
+        '''
+        Compile the options of a validated configuration
+
+        Parameters:
+            - config (dict): Configuration data
+
+        Returns:
+            - Settings: Options with the command table ready for lookups
+        '''
+
+        bot_config = config['FlashCardBot']
+        commands = bot_config['Commands']
+        export_config = bot_config.get('Export', {})
+        return cls(
+            # {command text: command name}
+            commands=MappingProxyType({command: command.replace('/', '')
+                                       for command in commands}),
+            available=', '.join(commands),
+            max_attempts=bot_config['MaxAttempts'],
+            sleep_time=bot_config['SleepTime'],
+            scheduler=bot_config.get('Scheduler', 'sm2'),
+            import_batch_size=bot_config.get('ImportBatchSize', 1000),
+            max_import_size=bot_config.get('MaxImportSize',
+                                           20 * 1024 * 1024),
+            max_round_size=bot_config.get('MaxRoundSize', 20),
+            export_format=export_config.get('Format', 'csv'),
+            max_export_size=export_config.get('MaxSize', 50 * 1024 * 1024))
+
+
 class FlashCardBot:
     '''
     FlashCard class object
@@ -41,14 +139,195 @@ class FlashCardBot:
 
         # Store configuration data as attribute
         self.config = config
+        self.settings = Settings.from_config(config)
 
-        # Init Telegram Bot
-        self.telegrambot = TelegramBot(self.config['Telegram'])
+        # {command name: function} to execute a pending command
+        self.handlers = MappingProxyType({
+            "new_item": self.new_item,
+            "new_round": self.new_round
+        })
+
+        # Polling engine, once started
+        self.engine = None
+
+        # Periodic database backups, once started
+        self.backups = None
+
+        # Bot API client used to reply to a given chat
+        self.bot_api = BotAPI(self.config['Telegram'])
+
+        # Replies are sent from background threads within the Telegram
+        # rate limits
+        outbound_config = self.config['FlashCardBot'].get('Outbound', {})
+        self.outbound = OutboundDispatcher(
+            self.bot_api,
+            workers=outbound_config.get('Workers', 2),
+            global_rate=outbound_config.get('GlobalRate', 30),
+            chat_rate=outbound_config.get('ChatRate', 1),
+            chat_burst=outbound_config.get('ChatBurst', 3),
+            max_retries=outbound_config.get('MaxRetries', 5))
+
+        # Init per-chat sessions
+        session_config = self.config['FlashCardBot'].get('Session', {})
+        persist = session_config.get('Persist', False)
+        self.sessions = SessionStore(
+            max_sessions=session_config.get('MaxSessions', 10000),
+            ttl=session_config.get('TTL', 3600),
+            database=self.config['FlashCardBot']['Database'] if persist
+            else None,
+            timeout=self.config['FlashCardBot']['Timeout'])
 
         # Init StorageManager
-        self.storage_manager = StorageManager(
-            database=self.config['FlashCardBot']['Database'],
-            timeout=self.config['FlashCardBot']['Timeout'])
+        storage_config = self.config['FlashCardBot'].get('Storage', {})
+        answer_index = storage_config.get('AnswerIndex', 'set')
+        matching_config = self.config['FlashCardBot'].get('Matching', {})
+        storage_options = dict(
+            timeout=self.config['FlashCardBot']['Timeout'],
+            flush_interval=storage_config.get('FlushInterval', 2.0),
+            flush_size=storage_config.get('FlushSize', 100),
+            pragmas={
+                'journal_mode': storage_config.get('JournalMode', 'WAL'),
+                'synchronous': storage_config.get('Synchronous', 'NORMAL'),
+                'cache_size': storage_config.get('CacheSize', -2000),
+                'mmap_size': storage_config.get('MmapSize', 0),
+                'busy_timeout': storage_config.get('BusyTimeout', 5000),
+            },
+            read_connections=storage_config.get('ReadConnections', 2),
+            answer_index=answer_index if answer_index != 'none' else None,
+            max_distance=matching_config.get('MaxDistance', 1)
+            if matching_config.get('Normalize', True) else None,
+            max_partitions=storage_config.get('MaxPartitions', 1024))
+
+        # Every chat has its own deck, or all of them share one
+        self.private_decks = storage_config.get('Partition',
+                                                'shared') == 'chat'
+        shards = storage_config.get('Shards', 1)
+        if shards > 1:
+            from sharding import ShardedStorage
+            self.storage_manager = ShardedStorage(
+                self.config['FlashCardBot']['Database'], shards,
+                **storage_options)
+        else:
+            self.storage_manager = StorageManager(
+                database=self.config['FlashCardBot']['Database'],
+                **storage_options)
+
+        # Next cards of every chat, selected while the current one is
+        # answered
+        self.prefetch = None
+        prefetch_config = self.config['FlashCardBot'].get('Prefetch', {})
+        if prefetch_config.get('Enabled', True):
+            from prefetch import PrefetchBuffer
+            self.prefetch = PrefetchBuffer(
+                self.select_items,
+                self.storage_manager.generation,
+                depth=prefetch_config.get('Depth', 3),
+                max_chats=prefetch_config.get('MaxChats', 10000))
+
+    def select_items(self,
+                     count: int,
+                     exclude: Iterable[int] = (),
+                     user_id: int = 0,
+                     deck_id: int = 0) -> List[tuple]:
+        '''
+        Select the next cards of a deck with the configured scheduler
+
+        Parameters:
+            - count (int): Max. number of cards
+            - exclude (iterable): IDs of cards to be skipped by the
+                review queue
+            - user_id (int): Owner of the deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - list: Database rows of the selected cards
+        '''
+
+        if self.settings.scheduler == 'sm2':
+            return self.storage_manager.select_due_rows(count, user_id,
+                                                        deck_id, exclude)
+        return self.storage_manager.select_random_rows(count, user_id,
+                                                       deck_id)
+
+    def scope(self,
+              chat_id: Optional[int]) -> dict:
+        '''
+        Storage partition of a chat
+
+        Returns:
+            - dict: user_id and deck_id arguments of the StorageManager
+        '''
+
+        if self.private_decks and chat_id is not None:
+            return {"user_id": chat_id, "deck_id": 0}
+        return {"user_id": 0, "deck_id": 0}
+
+    def reload(self,
+               config: dict) -> None:
+        '''
+        Apply a new configuration to the running bot. Messages being
+        handled finish with the previous options and pending commands
+        are kept
+
+        Parameters:
+            - config (dict): Validated configuration data
+        '''
+
+        settings = Settings.from_config(config)
+
+        old, new = self.config['FlashCardBot'], config['FlashCardBot']
+        restart = [f"FlashCardBot.{key}" for key in set(old) | set(new)
+                   if key not in RELOADABLE and old.get(key) != new.get(key)]
+        restart += [section for section in set(self.config) | set(config)
+                    if section != 'FlashCardBot' and
+                    self.config.get(section) != config.get(section)]
+        if restart:
+            logger.warning("Restart to apply the changes of %s",
+                           ', '.join(sorted(restart)))
+
+        # Attribute assignments are atomic: no lock is needed by the
+        # handlers, which read self.settings once
+        self.settings = settings
+        self.config = config
+        if self.engine is not None:
+            self.engine.retry_delay = settings.sleep_time
+
+    @functools.cached_property
+    def telegrambot(self):
+        '''
+        TelegramBot client, only created when a reply has no target
+        chat. Importing it is left out of the startup
+        '''
+
+        from telegrambot import TelegramBot
+        return TelegramBot(self.config['Telegram'])
+
+    def reply(self,
+              content: str,
+              item_type: str = "text",
+              chat_id: Optional[int] = None) -> None:
+        '''
+        Send a text or a media item to the user
+
+        Parameters:
+            - content (str): Text or Telegram file_id to be sent
+            - item_type (str): Type of item (text, photo, audio or video)
+            - chat_id (int): Target chat. If None, the TelegramBot
+                package selects the chat of the last incoming message.
+                Otherwise the reply is queued and sent in background
+        '''
+
+        if chat_id is None:
+            send_switcher = {
+                "text": self.telegrambot.send_message,
+                "photo": self.telegrambot.send_photo,
+                "audio": self.telegrambot.send_audio,
+                "video": self.telegrambot.send_video
+            }
+            send_switcher[item_type](content)
+            return
+
+        self.outbound.send(item_type, chat_id, content)
 
     def check_command(self,
                       message: dict) -> str:
@@ -61,9 +340,11 @@ class FlashCardBot:
         Returns:
             - str: Detected command name into message
         '''
-        logger.info("Checking message %s into %s commands",
+        settings = self.settings
+        logger.debug("Checking message %s into %s commands",
                      message,
-                     self.config['FlashCardBot']['Commands'])
+                     settings.available,
+                     extra={"event": "command"})
 
         # In case of unsupported format, the TelegramBot package
         # returns a None object. To check this case
@@ -74,16 +355,20 @@ class FlashCardBot:
         if "text" not in message.keys():
             raise CommandException("Non-text tried to use as command")
 
-        # Check if message text contains a valid command
+        # Check if message text contains a valid command. Arguments may
+        # follow it, e.g. "/new_round 10"
         command = list(message.values())[0]
-        if command not in self.config['FlashCardBot']['Commands']:
-            commands = ', '.join(self.config['FlashCardBot']['Commands'])
-            raise CommandException(f"Invalid command {command}.\nAvailable commands: {commands}")
+        words = command.split(maxsplit=1) if isinstance(command, str) else []
+        name = settings.commands.get(words[0]) if words else None
+        if name is None:
+            raise CommandException(f"Invalid command {command}.\nAvailable commands: {settings.available}")
 
-        return command.replace('/', '')
+        return name
 
     def import_csv_file(self,
-                        file_id: str) -> bool:
+                        file_id: str,
+                        chat_id: Optional[int] = None
+                        ) -> Optional[ImportSummary]:
         '''
         Import a CSV file and insert its contents
         into the database
@@ -91,55 +376,96 @@ class FlashCardBot:
         Parameters:
             -  file_id (str): Telegram Bot API File ID of the file to be
                 downloaded
+            - chat_id (int): Chat whose deck receives the items
 
         Returns:
-            - bool: Flag to report method status
+            - ImportSummary: Number of inserted, duplicated and malformed
+                items. None if the file could not be downloaded. Items
+                imported before a download error are kept
         '''
 
-        download_path = self.config["FlashCardBot"]["DownloadPath"]
+        settings = self.settings
+        max_size = settings.max_import_size
+        try:
+            file_info = self.bot_api.get_file(file_id)
+        except BotAPIException as error:
+            logger.warning("Unable to get file %s: %s", file_id, error)
+            return None
+
+        if file_info.get("file_size", 0) > max_size:
+            raise ImportException(
+                f"File too large. Max. size is {max_size} bytes")
+
+        # Parse the file while it is downloaded, without storing it
+        chunks = self.bot_api.download(file_info["file_path"])
+        try:
+            with stream_lines(chunks, max_size) as lines:
+                return import_csv(self.storage_manager,
+                                  lines,
+                                  settings.import_batch_size,
+                                  **self.scope(chat_id))
+        except BotAPIException as error:
+            logger.warning("Unable to download file %s: %s", file_id, error)
+            return None
+        finally:
+            # Abort the download on errors
+            chunks.close()
+
+    def export_deck(self,
+                    chat_id: Optional[int]) -> bool:
+        '''
+        Send the items of the deck of a chat as a file. Items are
+        streamed from the database into a temporary file, so memory use
+        does not depend on the deck size
 
-        # Try to download incoming file
-        self.telegrambot.download_file(
-            file_id,
-            download_path
-        )
+        Parameters:
+            - chat_id (int): Chat receiving its deck
 
-        download_files = os.listdir(download_path)
-        if not download_files:
-            logger.warning("None detected file into %s", download_path)
-            return False
+        Returns:
+            - bool: True if the file was sent
+        '''
 
-        # Concatenate path and read downloaded file
-        download_file = os.path.join(download_path, download_files[0])
-        logger.info(download_file)
-        with open(download_file, encoding='utf-8') as file_obj:
-            lines = file_obj.readlines()
+        if chat_id is None:
+            raise CommandException("Export is only available into a chat")
 
-        # Remove break line characters
-        lines = [line.replace('\n', '') for line in lines]
+        from exporter import ExportException, write_export
 
-        # Insert all items into database
-        for line in lines:
-            answer, quiz = line.split(',')
+        settings = self.settings
+        items = self.storage_manager.export_items(**self.scope(chat_id))
+        with tempfile.TemporaryFile() as output:
             try:
-                self.storage_manager.insert_item("text",
-                                                answer,
-                                                quiz)
-            except StorageManagerException:
-                logger.warning("Item %s already stored", answer)
-                continue
-
-        # Remove downloaded file
-        os.remove(download_file)
+                size = write_export(items, output,
+                                    settings.export_format,
+                                    settings.max_export_size)
+            except ExportException as error:
+                logger.error("Export error: %s", error)
+                HANDLER_ERRORS.inc(error="export")
+                self.reply(str(error), chat_id=chat_id)
+                return False
+            output.seek(0)
+            try:
+                self.bot_api.send_document(
+                    chat_id, output, size,
+                    f"flashcards.{settings.export_format}")
+            except BotAPIException as error:
+                logger.warning("Unable to send export to chat %s: %s",
+                               chat_id, error)
+                self.reply("Unable to send the export. Please try again",
+                           chat_id=chat_id)
+                return False
 
+        logger.info("Exported %s bytes to chat %s", size, chat_id)
         return True
 
-    def new_item(self, message) -> bool:
+    def new_item(self,
+                 message: dict,
+                 chat_id: Optional[int] = None) -> bool:
         '''
         Method to add a new element based on message
 
         Parameters:
             - message (dictionary): Incoming message with item data
+            - chat_id (int): Chat which sent the message
         '''
         logger.info("Adding new item %s", message)
 
@@ -159,8 +485,12 @@ class FlashCardBot:
             quiz = quiz.strip()
         elif item_type == "document":
             file_id = message[item_type]
-            if not self.import_csv_file(file_id):
+            summary = self.import_csv_file(file_id, chat_id)
+            if not summary:
                 return False
+
+            self.reply(f"Successfully imported {summary}", chat_id=chat_id)
+            return True
         else:
             # Use the file_id field as quiz and caption as answer
             quiz, answer = message[item_type]
@@ -168,134 +498,460 @@ class FlashCardBot:
         # Insert into StorageManager
         self.storage_manager.insert_item(item_type,
                                          answer,
-                                         quiz)
+                                         quiz,
+                                         **self.scope(chat_id))
 
         # Report to user
         msg = f"Successfully added new answer {answer}"
-        self.telegrambot.send_message(msg)
-        logging.info(msg)
+        self.reply(msg, chat_id=chat_id)
+        logger.info(msg)
+        return True
+
+    def round_size(self,
+                   message: dict) -> int:
+        '''
+        Number of cards requested by a "/new_round [N]" command
+
+        Parameters:
+            - message (dict): Incoming command
+
+        Returns:
+            - int: Number of cards. 1 without argument
+        '''
+
+        words = message["text"].split()
+        if len(words) == 1:
+            return 1
+
+        max_size = self.settings.max_round_size
+        size = int(words[1]) if len(words) == 2 and words[1].isdigit() \
+            else 0
+        if not 1 <= size <= max_size:
+            raise CommandException(f"Usage: /new_round [N], with N from 1 "
+                                   f"to {max_size}")
+        return size
+
+    def tolerance(self,
+                  message: dict,
+                  chat_id: Optional[int] = None) -> None:
+        '''
+        Show, or change with "/tolerance N", the typos allowed into the
+        answers of the deck of a chat
+
+        Parameters:
+            - message (dict): Incoming command
+            - chat_id (int): Chat owning the deck
+        '''
+
+        scope = self.scope(chat_id)
+        words = message["text"].split()
+        if len(words) > 1:
+            if len(words) != 2 or not words[1].isdigit() \
+                    or int(words[1]) > MAX_TOLERANCE:
+                raise CommandException(f"Usage: /tolerance [N], with N "
+                                       f"from 0 to {MAX_TOLERANCE}")
+            # The shared deck follows the configuration
+            if scope["user_id"] == 0:
+                raise CommandException("The tolerance of the shared deck "
+                                       "is set by the configuration")
+            self.storage_manager.set_max_distance(int(words[1]), **scope)
+
+        max_distance = self.storage_manager.deck_max_distance(**scope)
+        self.reply(f"Typos allowed per answer: {max_distance or 0}",
+                   chat_id=chat_id)
+
+    def start_round(self,
+                    size: int,
+                    chat_id: Optional[int] = None) -> None:
+        '''
+        Start a batch round: select its cards with a single query and
+        send all the quizzes at once, to be answered in order
+
+        Parameters:
+            - size (int): Number of cards
+            - chat_id (int): Chat playing the round
+        '''
+
+        # Replies are rate limited per chat: the text quizzes are sent
+        # as a single numbered message, followed by the media ones
+        items = sorted(self.select_items(size, **self.scope(chat_id)),
+                       key=lambda item: item[6] != "text")
+
+        # Its prefetched cards may be into the round
+        if self.prefetch is not None:
+            self.prefetch.discard(chat_id)
+
+        session = self.sessions.get(chat_id)
+        session.round = Round([(item[0], item[2]) for item in items])
+        session.item_id = items[0][0]
+
+        lines = [f"Round of {len(items)} cards. Answer them in order, "
+                 f"one per message or line"]
+        lines.extend(f"{number}. {item[3]}"
+                     for number, item in enumerate(items, 1)
+                     if item[6] == "text")
+        for text in split_message(lines):
+            self.reply(text, chat_id=chat_id)
+        for item in items:
+            if item[6] != "text":
+                self.reply(item[3], item[6], chat_id)
+
+    def answer_round(self,
+                     message: dict,
+                     chat_id: Optional[int] = None) -> Optional[bool]:
+        '''
+        Check the answers of a batch round, one per line, against its
+        cards. The results of the whole round are written at the end
+        into a single transaction
+
+        Parameters:
+            - message (dict): Incoming answers
+            - chat_id (int): Chat playing the round
+
+        Returns:
+            - bool: True once every card is answered. None while cards
+                are waiting for an answer
+        '''
+
+        session = self.sessions.get(chat_id)
+        current = session.round
+        scope = self.scope(chat_id)
+
+        results = []
+        for attempt in message.get("text", "").splitlines():
+            attempt = attempt.strip()
+            if not attempt:
+                continue
+            if current.done:
+                break
+            _, answer = current.current
+            match = self.storage_manager.match_answer(attempt, answer,
+                                                      **scope)
+            current.answer(match)
+            results.append("Correct!🎉" if match
+                           else f"Wrong answer 🥲 It was {answer}")
+
+        if not results:
+            self.reply("Please, answer with text", chat_id=chat_id)
+            return None
+
+        if not current.done:
+            session.item_id = current.current[0]
+            self.reply("\n".join(results), chat_id=chat_id)
+            return None
+
+        self.storage_manager.record_reviews(current.reviews, **scope)
+        if self.prefetch is not None:
+            self.prefetch.reviewed(scope, current.reviews)
+            self.prefetch.discard(chat_id)
+        results.append(f"Round complete: {current.correct}/"
+                       f"{len(current.cards)} right")
+        self.reply("\n".join(results), chat_id=chat_id)
         return True
 
-    def new_round(self, message):
+    def new_round(self,
+                  message: dict,
+                  chat_id: Optional[int] = None) -> Optional[bool]:
         '''
         Method to start a new round
         '''
+        session = self.sessions.get(chat_id)
+        if session.round is not None:
+            return self.answer_round(message, chat_id)
+
         attempt = message["text"]
-        match = self.storage_manager.check_quiz_item(attempt)
-        logger.info("Matched? %s", match)
+        scope = self.scope(chat_id)
+        match = self.storage_manager.check_quiz_item(attempt,
+                                                     session.item_id,
+                                                     **scope)
+        # Rescheduled: other chats of the deck may have it prefetched
+        if self.prefetch is not None:
+            self.prefetch.reviewed(scope, (session.item_id,))
+        logger.debug("Matched? %s", match, extra={"event": "guess"})
         if match:
-            self.telegrambot.send_message("Correct!🎉")
+            self.reply("Correct!🎉", chat_id=chat_id)
         else:
-            self.telegrambot.send_message("Wrong answer 🥲")
+            self.reply("Wrong answer 🥲", chat_id=chat_id)
         return match
 
-    def processing_command(self, message: str) -> str:
+    def processing_command(self,
+                           message: dict,
+                           chat_id: Optional[int] = None) -> str:
         '''
         Processing command in based on message
 
         Parameters:
-            - message (str): Incoming message to decode command
+            - message (dict): Incoming message to decode command
+            - chat_id (int): Chat which sent the message
 
         Returns:
             str: Detected command
         '''
 
-        send_quiz_switcher = {
-            "text": self.telegrambot.send_message,
-            "photo": self.telegrambot.send_photo,
-            "audio": self.telegrambot.send_audio,
-            "video": self.telegrambot.send_video
-        }
         command = self.check_command(message)
 
         if command == "new_item":
             msg = "Please, add the new item 😊"
-            self.telegrambot.send_message(msg)
+            self.reply(msg, chat_id=chat_id)
         elif command == "new_round":
-            quiz, item_type = \
-                self.storage_manager.select_random_item()
-
-            # Select the properly function to send the quiz
-            # to the user depending on item type
-            send_quiz_switcher.get(item_type)(quiz)
+            size = self.round_size(message)
+            if size > 1:
+                self.start_round(size, chat_id)
+                return command
+
+            scope = self.scope(chat_id)
+            item = self.prefetch.pop(chat_id, scope) if self.prefetch \
+                else None
+            if item is None and self.settings.scheduler == 'sm2':
+                item = self.storage_manager.select_due_row(**scope)
+            elif item is None:
+                item = self.storage_manager.select_random_row(**scope)
+            item_id, quiz, item_type = item[0], item[3], item[6]
+
+            # Keep the selected item as the quiz of this chat
+            self.sessions.get(chat_id).item_id = item_id
+
+            # Send the quiz to the user depending on item type
+            self.reply(quiz, item_type, chat_id)
+
+            # Select the next cards while this one is answered
+            if self.prefetch is not None:
+                self.prefetch.refill(chat_id, scope, exclude=(item_id,))
+        elif command == "stats":
+            stats = self.storage_manager.stats(**self.scope(chat_id))
+            self.reply(str(stats), chat_id=chat_id)
+        elif command == "export":
+            self.export_deck(chat_id)
+        elif command == "tolerance":
+            self.tolerance(message, chat_id)
 
         return command
 
+    def handle_message(self,
+                       message: dict,
+                       chat_id: Optional[int] = None) -> None:
+        '''
+        Process an incoming message: start a new command or continue
+        with the pending one
+
+        Parameters:
+            - message (dict): Incoming message
+            - chat_id (int): Chat which sent the message
+        '''
+
+        max_attempts = self.settings.max_attempts
+        session = self.sessions.get(chat_id)
+
+        # Pending command handler, or the command dispatch
+        command = session.command or "processing_command"
+        start = time.perf_counter()
+        try:
+            # None pending command, waiting to receive a new one
+            if not session.command:
+                name = self.processing_command(message, chat_id)
+                # Commands answered at once leave nothing pending
+                if name in self.handlers:
+                    session.command = name
+                return
+
+            # Select the command function in based on pending command
+            result = self.handlers[session.command](message, chat_id)
+
+            # Batch rounds wait for the answers of their next cards
+            if result is None:
+                return
+
+            if not result:
+                if session.attempt_count == max_attempts:
+                    msg = "Reached max. attempts."
+                    logger.error(msg)
+                    self.reply(msg, chat_id=chat_id)
+                    # Reset command and attempt_count values
+                    session.reset()
+                    return
+
+                session.attempt_count += 1
+                logger.warning("Number of attempts: %s",
+                               session.attempt_count)
+                return
+
+            # Incoming message processed
+            session.reset()
+
+        except CommandException as error:
+            logger.error("Command error: %s", error)
+            HANDLER_ERRORS.inc(error="command")
+            self.reply(str(error), chat_id=chat_id)
+
+        except StorageManagerException as error:
+            logger.error("Storage Manager error: %s", error)
+            HANDLER_ERRORS.inc(error="storage")
+            self.reply(str(error), chat_id=chat_id)
+
+        except ImportException as error:
+            logger.error("Import error: %s", error)
+            HANDLER_ERRORS.inc(error="import")
+            self.reply(str(error), chat_id=chat_id)
+
+        except ValueError as error:
+            logger.error("ValueError: %s", error)
+            HANDLER_ERRORS.inc(error="value")
+            msg = "🧐 Something went wrong. Please try again"
+            self.reply(msg, chat_id=chat_id)
+
+        finally:
+            self.sessions.save(session)
+            HANDLER_SECONDS.observe(time.perf_counter() - start,
+                                    command=command)
+
+    def start_backups(self) -> None:
+        '''
+        Back up the database periodically, if enabled
+        '''
+
+        backup_config = self.config['FlashCardBot'].get('Backup', {})
+        if not backup_config.get('Enabled', False):
+            return
+
+        from backup import BackupScheduler
+        self.backups = BackupScheduler(
+            self.storage_manager,
+            backup_config.get('Path', 'backup/flashcard.db'),
+            interval=backup_config.get('Interval', 86400),
+            pages=backup_config.get('Pages', 256),
+            sleep=backup_config.get('Sleep', 0.01)).start()
+
+    def start_metrics(self) -> None:  # pragma: no cover
+        '''
+        Expose metrics to Prometheus, if enabled
+        '''
+
+        metrics_config = self.config['FlashCardBot'].get('Metrics', {})
+        if metrics_config.get('Enabled', False):
+            MetricsServer(metrics_config.get('Host', '127.0.0.1'),
+                          metrics_config.get('Port', 9100)).start()
+
+    def shutdown(self) -> None:  # pragma: no cover
+        '''
+        Write pending data and exit
+        '''
+
+        logger.error("Detected Keyboard Interrupt. Bye!")
+        self.close()
+        sys.exit(1)
+
+    def close(self,
+              timeout: float = 30) -> None:
+        '''
+        Stop the background threads, send the queued replies and close
+        the databases
+
+        Parameters:
+            - timeout (float): Max. seconds to send the queued replies
+        '''
+
+        if self.backups is not None:
+            self.backups.stop()
+        if self.prefetch is not None:
+            self.prefetch.close()
+        self.outbound.close(timeout)
+        self.storage_manager.close_connection()
+        self.sessions.close()
+
     def polling(self) -> None:  # pragma: no cover
         '''
-        Check incoming message from TelegramBot API
-        through  a polling mechanism
+        Long-poll incoming messages from TelegramBot API and
+        handle them concurrently
         '''
 
-        # Define a {command: function} dictionary to execute a determine
-        # function based on incoming command
-        switcher = {
-            "new_item": self.new_item,
-            "new_round": self.new_round
-        }
+        # Only one of the engines is used: import it when started
+        import asyncio
+        from engine import PollingEngine
+
+        engine = PollingEngine(
+            self.handle_message,
+            self.bot_api,
+            poll_timeout=self.config['FlashCardBot'].get('PollTimeout', 30),
+            workers=self.config['FlashCardBot'].get('Workers', 4),
+            retry_delay=self.settings.sleep_time)
+        self.engine = engine
+        self.start_metrics()
+
+        # getUpdates is refused while a webhook is set
+        try:
+            self.bot_api.call("deleteWebhook")
+        except BotAPIException as error:
+            logger.warning("Unable to delete webhook: %s", error)
+
+        try:
+            asyncio.run(engine.run())
+        except KeyboardInterrupt:
+            self.shutdown()
+
+    def webhook(self) -> None:  # pragma: no cover
+        '''
+        Receive the messages pushed by Telegram and handle them into a
+        bounded pool of workers
+        '''
 
-        # Initialize variables
-        command = ''
-        attempt_count = 0
-        reference_time = datetime.now(timezone.utc)
-        max_attempts = self.config['FlashCardBot']['MaxAttempts']
+        from webhook import WebhookServer
+
+        webhook_config = self.config['FlashCardBot']['Webhook']
+        server = WebhookServer(
+            self.handle_message,
+            self.bot_api,
+            url=webhook_config['URL'],
+            host=webhook_config.get('Host', '0.0.0.0'),
+            port=webhook_config.get('Port', 8443),
+            path=webhook_config.get('Path', '/webhook'),
+            secret_token=webhook_config.get('SecretToken', ''),
+            workers=self.config['FlashCardBot'].get('Workers', 4),
+            queue_size=webhook_config.get('QueueSize', 100),
+            max_connections=webhook_config.get('MaxConnections', 40))
+        self.start_metrics()
+
+        try:
+            server.run()
+        except KeyboardInterrupt:
+            self.shutdown()
+
+
+def supervise(config: dict) -> None:  # pragma: no cover
+    '''
+    Poll from this process and handle the messages into worker
+    processes, one per storage shard
+    '''
 
-        # Start polling mechanism
-        while True:
-            try:
-                # Check if there is a new message
-                if self.telegrambot.check_new_message(reference_time):
-                    # Extract raw incoming message
-                    message = self.telegrambot.check_message_type()
-
-                    # None pending command, waiting to receive a new one
-                    if not command:
-                        command = self.processing_command(message)
-                        continue
-
-                    # Select the command function in based on pending command
-                    result = switcher.get(command)(message)
-                    if not result:
-                        if attempt_count == max_attempts:
-                            msg = "Reached max. attempts."
-                            logger.error(msg)
-                            self.telegrambot.send_message(msg)
-                            # Reset command and attempt_count values
-                            command = ''
-                            attempt_count = 0
-                            continue
-
-                        attempt_count += 1
-                        logger.warning("Number of attempts: %s",
-                                        attempt_count)
-                        continue
-
-                    # Incoming message processed
-                    command = ''
-                    attempt_count = 0
-
-                time.sleep(self.config['FlashCardBot']['SleepTime'])
-
-            except CommandException as error:
-                logger.error("Command error: %s", error)
-                self.telegrambot.send_message(error)
-                continue
+    import os
+    from supervisor import Supervisor
 
-            except StorageManagerException as error:
-                logger.error("Storage Manager error: %s", error)
-                self.telegrambot.send_message(error)
-                continue
+    bot_config = config['FlashCardBot']
+    supervisor_config = bot_config['Supervisor']
+    api = BotAPI(config['Telegram'])
 
-            except ValueError as error:
-                logger.error("ValueError: %s", error)
-                msg = "🧐 Something went wrong. Please try again"
-                self.telegrambot.send_message(msg)
-                continue
+    metrics_config = bot_config.get('Metrics', {})
+    if metrics_config.get('Enabled', False):
+        MetricsServer(metrics_config.get('Host', '127.0.0.1'),
+                      metrics_config.get('Port', 9100)).start()
 
-            except KeyboardInterrupt:
-                logger.error("Detected Keyboard Interrupt. Bye!")
-                self.storage_manager.close_connection()
-                sys.exit(1)
+    # getUpdates is refused while a webhook is set
+    try:
+        api.call("deleteWebhook")
+    except BotAPIException as error:
+        logger.warning("Unable to delete webhook: %s", error)
+
+    supervisor = Supervisor(
+        config,
+        api,
+        workers=supervisor_config.get('Workers', 0) or os.cpu_count() or 1,
+        heartbeat_timeout=supervisor_config.get('HeartbeatTimeout', 30),
+        queue_size=supervisor_config.get('QueueSize', 1000),
+        poll_timeout=bot_config.get('PollTimeout', 30),
+        retry_delay=bot_config['SleepTime'])
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        logger.error("Detected Keyboard Interrupt. Bye!")
 
 
 def main():  # pragma: no cover
@@ -309,17 +965,45 @@ def main():  # pragma: no cover
         sys.exit(1)
 
     # Validate configuration file and extract configuration data
+    configuration = Configuration(sys.argv[1])
     try:
-        config = Configuration(sys.argv[1]).validate()
+        config = configuration.validate()
     except ConfigurationException as exception:
         logger.error("Configuration error: %s", exception)
         sys.exit(1)
 
+    # Records are written by a background thread from now on
+    setup_logging(config.get('Logging'))
+
+    # Handle `docker stop` as a keyboard interrupt, so pending
+    # answers are written before exit
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    if config['FlashCardBot'].get('Supervisor', {}).get('Enabled', False):
+        supervise(config)
+        return
+
     # Built FlashCard Bot object
     bot = FlashCardBot(config)
 
-    # Start polling mechanism
-    bot.polling()
+    bot.start_backups()
+
+    # Apply configuration changes without restarting, when the file
+    # changes or on `kill -HUP`
+    reload_config = config['FlashCardBot'].get('Reload', {})
+    if reload_config.get('Enabled', True):
+        from reloader import ConfigReloader
+        reloader = ConfigReloader(configuration,
+                                  bot.reload,
+                                  reload_config.get('Interval', 5.0)).start()
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda *_: reloader.request())
+
+    # Start receiving messages
+    if config['FlashCardBot'].get('Webhook', {}).get('Enabled', False):
+        bot.webhook()
+    else:
+        bot.polling()
 
 
 if __name__ == '__main__':  # pragma: no cover
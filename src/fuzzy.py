@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+'''
+Typo tolerant answer matching
+'''
+
+import sys
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+
+def normalize(text: str) -> str:
+    '''
+    Normalize a text to compare answers ignoring case, accents and
+    repeated whitespaces
+
+    Parameters:
+        - text (str): Text to be normalized
+
+    Returns:
+        - str: Normalized text
+    '''
+
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(char for char in decomposed
+                       if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def levenshtein(source: str,
+                target: str,
+                max_distance: int) -> int:
+    '''
+    Edit distance (insertions, deletions and substitutions) between
+    two strings, bounded to max_distance. Only the diagonal band of
+    width 2 * max_distance + 1 of the distance matrix is computed.
+
+    Returns:
+        - int: Distance, or max_distance + 1 if it is greater
+    '''
+
+    limit = max_distance + 1
+    if abs(len(source) - len(target)) > max_distance:
+        return limit
+
+    previous = {j: j for j in range(min(len(target), max_distance) + 1)}
+    for i, source_char in enumerate(source, 1):
+        low = max(0, i - max_distance)
+        high = min(len(target), i + max_distance)
+        current = {}
+        if low == 0:
+            current[0] = i
+        for j in range(max(1, low), high + 1):
+            current[j] = min(previous.get(j, limit) + 1,
+                             current.get(j - 1, limit) + 1,
+                             previous.get(j - 1, limit) +
+                             (source_char != target[j - 1]))
+        # The distance never decreases along the rows
+        if min(current.values()) >= limit:
+            return limit
+        previous = current
+    return min(previous.get(len(target), limit), limit)
+
+
+def segments(length: int,
+             parts: int) -> List[tuple]:
+    '''
+    Split a length into `parts` contiguous (start, length) segments
+    '''
+
+    size, extra = divmod(length, parts)
+    result = []
+    start = 0
+    for part in range(parts):
+        part_length = size + (part < extra)
+        result.append((start, part_length))
+        start += part_length
+    return result
+
+
+class SegmentIndex:
+    '''
+    Pigeonhole index for bounded edit distance searches.
+
+    A word tolerating k edits is split into k + 1 segments. A query
+    within k edits of the word keeps at least one segment intact,
+    shifted by at most k positions. Searches are then a few exact
+    dictionary lookups plus the verification of the candidates,
+    independently of the number of words.
+
+    The tolerance of a word grows with its length: one edit every
+    `chars_per_edit` characters, up to max_distance. So "cat" never
+    matches "car", and short words do not flood the index with tiny
+    segments.
+    '''
+    def __init__(self,
+                 max_distance: int,
+                 chars_per_edit: int = 4) -> None:
+
+        self.max_distance = max_distance
+        self.chars_per_edit = chars_per_edit
+
+        # {(length, part, segment): word or set of words}
+        self.postings: Dict[tuple, object] = {}
+
+    def tolerance(self,
+                  length: int) -> int:
+        '''
+        Edits allowed for a word of a given length
+        '''
+        return min(self.max_distance, length // self.chars_per_edit)
+
+    def add(self,
+            word: str) -> None:
+        '''
+        Index a word
+        '''
+
+        # Words without tolerance only match exactly
+        parts = self.tolerance(len(word)) + 1
+        if parts == 1:
+            return
+
+        for part, (start, length) in enumerate(segments(len(word), parts)):
+            key = (len(word), part, word[start:start + length])
+            words = self.postings.get(key)
+            # Most segments belong to a single word: store it unwrapped
+            if words is None:
+                self.postings[key] = word
+            elif isinstance(words, str):
+                if words != word:
+                    self.postings[key] = {words, word}
+            else:
+                words.add(word)
+
+    def search(self,
+               query: str,
+               max_distance: Optional[int] = None) -> List[str]:
+        '''
+        Find the indexed words within their tolerance of a query,
+        sorted by distance
+
+        Parameters:
+            - query (str): Searched word
+            - max_distance (int): Additional bound of the tolerance
+        '''
+
+        if max_distance is None:
+            max_distance = self.max_distance
+
+        candidates = {}
+        widest = min(max_distance, self.max_distance)
+        for length in range(max(1, len(query) - widest),
+                            len(query) + widest + 1):
+            word_tolerance = self.tolerance(length)
+            allowed = min(word_tolerance, max_distance)
+            if allowed < abs(length - len(query)) or allowed == 0:
+                continue
+
+            parts = segments(length, word_tolerance + 1)
+            for part, (start, size) in enumerate(parts):
+                for shift in range(-allowed, allowed + 1):
+                    begin = start + shift
+                    if begin < 0 or begin + size > len(query):
+                        continue
+                    words = self.postings.get(
+                        (length, part, query[begin:begin + size]))
+                    if words is None:
+                        continue
+                    if isinstance(words, str):
+                        candidates[words] = allowed
+                    else:
+                        candidates.update((word, allowed) for word in words)
+
+        results = []
+        for candidate, allowed in candidates.items():
+            distance = levenshtein(query, candidate, allowed)
+            if distance <= allowed:
+                results.append((distance, candidate))
+        return [word for _, word in sorted(results)]
+
+    def memory_usage(self) -> int:
+        '''
+        Approximate memory footprint in bytes. Words are shared with
+        the matcher and not accounted
+        '''
+
+        return sys.getsizeof(self.postings) + sum(
+            sys.getsizeof(key) + sys.getsizeof(key[2]) +
+            (0 if isinstance(words, str) else sys.getsizeof(words))
+            for key, words in self.postings.items())
+
+
+class FuzzyMatcher:
+    '''
+    Match guesses against stored answers after normalization (case,
+    accents and whitespaces) and within a bounded edit distance
+    '''
+    def __init__(self,
+                 answers: Iterable[str] = (),
+                 max_distance: int = 1,
+                 chars_per_edit: int = 4) -> None:
+
+        self.max_distance = max_distance
+
+        # {normalized answer: stored answers}
+        self.answers: Dict[str, List[str]] = {}
+        self.index = SegmentIndex(max_distance, chars_per_edit)
+        for answer in answers:
+            self.add(answer)
+
+    def add(self,
+            answer: str) -> None:
+        '''
+        Index a stored answer
+        '''
+
+        key = normalize(answer)
+        answers = self.answers.get(key)
+        if answers is None:
+            self.answers[key] = [answer]
+            self.index.add(key)
+        elif answer not in answers:
+            answers.append(answer)
+
+    def discard(self,
+                answer: str) -> None:
+        '''
+        Remove a deleted answer. Its postings are kept and skipped by
+        the searches
+        '''
+
+        key = normalize(answer)
+        answers = self.answers.get(key)
+        if answers is None or answer not in answers:
+            return
+        answers.remove(answer)
+        if not answers:
+            del self.answers[key]
+
+    def match(self,
+              attempt: str,
+              max_distance: Optional[int] = None) -> Optional[str]:
+        '''
+        Find the stored answer closest to a guess
+
+        Parameters:
+            - attempt (str): User guess
+            - max_distance (int): Tolerance. Matcher default if None
+
+        Returns:
+            - str: Matched stored answer or None
+        '''
+
+        key = normalize(attempt)
+        if key in self.answers:
+            return self.answers[key][0]
+
+        if max_distance is None:
+            max_distance = self.max_distance
+        if max_distance <= 0:
+            return None
+
+        for candidate in self.index.search(key, max_distance):
+            if candidate in self.answers:
+                return self.answers[candidate][0]
+        return None
+
+    def matches(self,
+                attempt: str,
+                answer: str) -> bool:
+        '''
+        Check a guess against a single answer, with the tolerance the
+        answer has into the index
+
+        Parameters:
+            - attempt (str): User guess
+            - answer (str): Expected answer
+
+        Returns:
+            - bool: True if the guess matches the answer
+        '''
+
+        key, target = normalize(attempt), normalize(answer)
+        if key == target:
+            return True
+        allowed = self.index.tolerance(len(target))
+        return allowed > 0 and levenshtein(key, target, allowed) <= allowed
+
+    def memory_usage(self) -> int:
+        '''
+        Approximate memory footprint in bytes
+        '''
+
+        return sys.getsizeof(self.answers) + self.index.memory_usage() + sum(
+            sys.getsizeof(key) + sys.getsizeof(answers)
+            for key, answers in self.answers.items())
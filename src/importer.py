@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''
+Bulk import of items from CSV files
+'''
+
+import csv
+import io
+import logging
+from typing import Iterable, Iterator, NamedTuple, TextIO, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ImportException(Exception):
+    '''
+    Raised when an imported file is too large or is not a valid CSV file
+    '''
+    def __init__(self,
+                 message):
+        super().__init__(message)
+
+
+class ImportSummary(NamedTuple):
+    ''' Result of an import '''
+    inserted: int
+    duplicates: int
+    malformed: int
+
+    def __str__(self) -> str:
+        return (f"{self.inserted} new items, {self.duplicates} already "
+                f"stored and {self.malformed} malformed lines")
+
+
+class CSVItems:
+    '''
+    Stream (answer, quiz) pairs from the lines of a two columns CSV
+    file, counting the malformed ones
+    '''
+    def __init__(self,
+                 lines: Iterable[str]) -> None:
+
+        self.lines = lines
+        self.malformed = 0
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        for row in csv.reader(self.lines):
+            # Skip empty lines
+            if not row:
+                continue
+
+            if len(row) != 2 or not all(field.strip() for field in row):
+                self.malformed += 1
+                logger.debug("Malformed CSV row %s", row)
+                continue
+
+            yield row[0].strip(), row[1].strip()
+
+
+class ChunkReader(io.RawIOBase):
+    '''
+    Read-only binary stream over an iterable of byte chunks, such as a
+    download in progress. Only the current chunk is kept in memory.
+    '''
+    def __init__(self,
+                 chunks: Iterable[bytes],
+                 max_size: int) -> None:
+
+        super().__init__()
+        self.chunks = iter(chunks)
+        self.chunk = memoryview(b'')
+        self.max_size = max_size
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self.chunk:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.size += len(chunk)
+            if self.size > self.max_size:
+                raise ImportException(
+                    f"File too large. Max. size is {self.max_size} bytes")
+            self.chunk = memoryview(chunk)
+
+        length = min(len(buffer), len(self.chunk))
+        buffer[:length] = self.chunk[:length]
+        self.chunk = self.chunk[length:]
+        return length
+
+
+def stream_lines(chunks: Iterable[bytes],
+                 max_size: int) -> TextIO:
+    '''
+    Decode the lines of a UTF-8 file while it is being downloaded
+
+    Parameters:
+        - chunks (iterable): Bytes of the file
+        - max_size (int): Max. accepted file size in bytes
+
+    Returns:
+        - TextIO: Text stream, equivalent to a file opened with
+            newline='' as required by the csv module
+    '''
+
+    # An optional byte order mark is skipped by utf-8-sig
+    return io.TextIOWrapper(io.BufferedReader(ChunkReader(chunks, max_size)),
+                            encoding='utf-8-sig',
+                            newline='')
+
+
+def import_csv(storage_manager,
+               lines: Iterable[str],
+               batch_size: int = 1000,
+               user_id: int = 0,
+               deck_id: int = 0) -> ImportSummary:
+    '''
+    Import the items of a CSV file into the database
+
+    Parameters:
+        - storage_manager (StorageManager): Target storage
+        - lines (iterable): CSV lines, e.g. a file object opened with
+            newline=''
+        - batch_size (int): Number of items per transaction
+        - user_id (int): Owner of the deck. 0 for the shared deck
+        - deck_id (int): Deck of the user
+
+    Returns:
+        - ImportSummary: Number of inserted, duplicated and malformed items
+    '''
+
+    items = CSVItems(lines)
+    try:
+        inserted, duplicates = storage_manager.insert_items(
+            items, batch_size=batch_size, user_id=user_id, deck_id=deck_id)
+    except (UnicodeDecodeError, csv.Error) as error:
+        raise ImportException(f"Invalid CSV file: {error}") from error
+    summary = ImportSummary(inserted, duplicates, items.malformed)
+    logger.info("Imported CSV file: %s", summary)
+    return summary
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+'''
+Logging setup: records are queued by the application threads and
+formatted and written by a background listener
+'''
+
+import atexit
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from typing import Dict, Optional
+
+from metrics import Counter
+
+DROPPED_RECORDS = Counter('flashcard_log_dropped_total',
+                          'Log records dropped because the queue was full')
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class JSONFormatter(logging.Formatter):
+    '''
+    Format records as JSON objects, one per line
+    '''
+
+    def format(self,
+               record: logging.LogRecord) -> str:
+
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        event = getattr(record, "event", None)
+        if event:
+            data["event"] = event
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Keep a fraction of the high volume records.
+
+    Records are sampled by event, given with
+    `logger.debug(..., extra={"event": "guess"})`. Records without
+    event, or with an event without rate, are always kept.
+    '''
+    def __init__(self,
+                 rates: Dict[str, float]) -> None:
+
+        super().__init__()
+        self.rates = rates
+
+    def filter(self,
+               record: logging.LogRecord) -> bool:
+
+        rate = self.rates.get(getattr(record, "event", None))
+        return rate is None or random.random() < rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    '''
+    Queue records without formatting them and drop them when the queue
+    is full, so logging never blocks nor slows down the callers
+    '''
+
+    def prepare(self,
+                record: logging.LogRecord) -> logging.LogRecord:
+        # The listener runs into the same process: the record does not
+        # need to be formatted or pickled here
+        return record
+
+    def enqueue(self,
+                record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_RECORDS.inc()
+
+
+def setup_logging(config: Optional[dict] = None
+                  ) -> logging.handlers.QueueListener:
+    '''
+    Configure the root logger from the [Logging] configuration section
+
+    Parameters:
+        - config (dict): Logging configuration. Defaults if None
+
+    Returns:
+        - QueueListener: Background listener, already started and
+            stopped at exit
+    '''
+
+    config = config or {}
+
+    if config.get("File"):
+        handler = logging.FileHandler(config["File"], encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    if config.get("Format", "text") == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    records = queue.Queue(maxsize=config.get("QueueSize", 10000))
+    queue_handler = NonBlockingQueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(config.get("Sampling", {})))
+
+    root = logging.getLogger()
+    for previous in root.handlers[:]:
+        root.removeHandler(previous)
+    root.addHandler(queue_handler)
+    root.setLevel(config.get("Level", "INFO"))
+
+    # Levels are set on the loggers, so disabled records are not even
+    # created
+    for name, level in config.get("Levels", {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+'''
+Runtime metrics exposed in Prometheus text format
+'''
+
+import bisect
+from contextlib import contextmanager
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from SQLite lookups to Telegram requests
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    '''
+    Escape a label value for the text exposition format
+    '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str],
+                   values: Sequence,
+                   extra: str = '') -> str:
+    '''
+    Render a {name="value",...} label set
+    '''
+
+    pairs = [f'{name}="{_escape(value)}"'
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    '''
+    Base class of the metrics: a value per combination of label values
+    '''
+    TYPE = ''
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labels: Sequence[str] = (),
+                 registry: Optional["Registry"] = None) -> None:
+
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _key(self,
+             labels: dict) -> Tuple:
+        '''
+        Label values in declaration order
+        '''
+
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(labels[name] for name in self.label_names)
+
+    def samples(self) -> List[str]:
+        '''
+        Lines of the text exposition format
+        '''
+        raise NotImplementedError
+
+    def render(self) -> str:
+        '''
+        Metric in the text exposition format
+        '''
+
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    '''
+    Monotonically increasing value, such as a number of errors
+    '''
+    TYPE = 'counter'
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self,
+            amount: float = 1,
+            **labels) -> None:
+        '''
+        Increase the counter of a label set
+        '''
+
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        '''
+        Current value of a label set
+        '''
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}"
+                for key, value in values]
+
+
+class Gauge(Counter):
+    '''
+    Value that goes up and down, such as a queue depth
+    '''
+    TYPE = 'gauge'
+
+    def dec(self,
+            amount: float = 1,
+            **labels) -> None:
+        '''
+        Decrease the gauge of a label set
+        '''
+        self.inc(-amount, **labels)
+
+    def set(self,
+            value: float,
+            **labels) -> None:
+        '''
+        Set the gauge of a label set
+        '''
+
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    '''
+    Distribution of observed values into cumulative buckets
+    '''
+    TYPE = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 registry: Optional["Registry"] = None) -> None:
+
+        super().__init__(name, documentation, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+        # {label values: [count per bucket (+Inf last), sum]}
+        self.values: Dict[Tuple, list] = {}
+
+    def labels(self, **labels) -> "BoundHistogram":
+        '''
+        Histogram of a label set, to observe values without resolving
+        the labels every time
+        '''
+
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) \
+                    + [0.0]
+        return BoundHistogram(self, counts)
+
+    def observe(self,
+                value: float,
+                **labels) -> None:
+        '''
+        Record an observation, usually a duration in seconds
+        '''
+        self.labels(**labels).observe(value)
+
+    def time(self, **labels):
+        '''
+        Observe the duration of a block
+        '''
+        return self.labels(**labels).time()
+
+    def count(self, **labels) -> int:
+        '''
+        Number of observations of a label set
+        '''
+
+        counts = self.values.get(self._key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = [(key, list(counts))
+                      for key, counts in self.values.items()]
+
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key,
+                                        f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class BoundHistogram:
+    '''
+    Observations of a histogram label set
+    '''
+    def __init__(self,
+                 histogram: Histogram,
+                 counts: list) -> None:
+
+        self.buckets = histogram.buckets
+        self.lock = histogram.lock
+        self.counts = counts
+
+    def observe(self,
+                value: float) -> None:
+        '''
+        Record an observation
+        '''
+
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[position] += 1
+            self.counts[-1] += value
+
+    @contextmanager
+    def time(self):
+        '''
+        Observe the duration of a block
+        '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+def timed(histogram: Histogram,
+          **labels) -> Callable:
+    '''
+    Decorator observing the duration of every call of a function
+    '''
+
+    bound = histogram.labels(**labels)
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                bound.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class Registry:
+    '''
+    Collection of metrics rendered together
+    '''
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self,
+                 metric: Metric) -> None:
+        '''
+        Add a metric. Names must be unique
+        '''
+
+        if metric.name in self.metrics:
+            raise ValueError(f"Duplicated metric {metric.name}")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        '''
+        All metrics in the Prometheus text exposition format
+        '''
+
+        return ''.join(metric.render() + '\n'
+                       for metric in self.metrics.values())
+
+
+REGISTRY = Registry()
+
+
+class MetricsServer:
+    '''
+    HTTP server exposing a registry on /metrics into a background
+    thread
+    '''
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 9100,
+                 registry: Registry = REGISTRY) -> None:
+
+        # http.server is slow to import and metrics are optional
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                # Scrapes are too frequent to be logged
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name="metrics",
+                                       daemon=True)
+
+    @property
+    def port(self) -> int:
+        '''
+        Listening port, useful when binding to port 0
+        '''
+        return self.server.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        '''
+        Start serving requests
+        '''
+
+        self.thread.start()
+        logger.info("Serving metrics on port %s", self.port)
+        return self
+
+    def stop(self) -> None:
+        '''
+        Stop the server
+        '''
+
+        self.server.shutdown()
+        self.server.server_close()
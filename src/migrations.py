@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+'''
+Versioned schema migrations of the SQLite databases.
+
+The schema version is kept into `PRAGMA user_version`: a database at
+version N has the first N migrations applied. Migrations are only
+appended, never edited. Every step can be applied again, so databases
+created before the versioning (version 0) are brought up to date too.
+
+Usage: python3 src/migrations.py <DATABASE> [--dry-run]
+                                 [--batch-size 1000] [--pause 0.01]
+'''
+
+import argparse
+import logging
+import math
+import sqlite3
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationException(Exception):
+    '''
+    Raised when a database cannot be migrated
+    '''
+    def __init__(self,
+                 message):
+        super().__init__(message)
+
+
+class Estimate(NamedTuple):
+    ''' Cost of a pending step '''
+    version: int
+    step: str
+    rows: int
+    batches: int
+
+    def __str__(self) -> str:
+        if not self.rows:
+            return f"{self.version:>4} {self.step}"
+        cost = f"~{self.rows} rows"
+        if self.batches:
+            cost += f" in {self.batches} batches"
+        return f"{self.version:>4} {self.step} ({cost})"
+
+
+def table_exists(conn: sqlite3.Connection,
+                 table: str) -> bool:
+    '''
+    Check if a table exists
+    '''
+    return conn.execute('''SELECT 1 FROM sqlite_master
+                        WHERE type = 'table' AND name = ?''',
+                        (table,)).fetchone() is not None
+
+
+def rowid_range(conn: sqlite3.Connection,
+                table: str) -> Tuple[Optional[int], Optional[int]]:
+    '''
+    (first, last) rowid of a table, read from its primary key. (None,
+    None) if the table is empty or does not exist yet
+    '''
+
+    if not table_exists(conn, table):
+        return None, None
+    return conn.execute(
+        f'SELECT MIN(rowid), MAX(rowid) FROM {table}').fetchone()
+
+
+def estimate_rows(conn: sqlite3.Connection,
+                  table: str) -> int:
+    '''
+    Rows of a table estimated from its rowid range, without a scan
+    '''
+
+    first, last = rowid_range(conn, table)
+    return 0 if first is None else last - first + 1
+
+
+class CreateTable:
+    '''
+    Create a table if it does not exist
+    '''
+    def __init__(self,
+                 table: str,
+                 definition: str) -> None:
+
+        self.table = table
+        self.definition = definition
+
+    def __str__(self) -> str:
+        return f"Create table {self.table}"
+
+    def estimate(self,
+                 conn: sqlite3.Connection,
+                 batch_size: int) -> Tuple[int, int]:
+        return 0, 0
+
+    def apply(self,
+              migrator: "Migrator",
+              version: int,
+              step: int) -> None:
+        migrator.conn.execute(f'''CREATE TABLE IF NOT EXISTS {self.table}
+                              ({self.definition})''')
+
+
+class AddColumn:
+    '''
+    Add a column if the table does not have it. SQLite only updates the
+    schema, whatever the table size, so the definition needs a constant
+    default
+    '''
+    def __init__(self,
+                 table: str,
+                 column: str,
+                 definition: str) -> None:
+
+        self.table = table
+        self.column = column
+        self.definition = definition
+
+    def __str__(self) -> str:
+        return f"Add column {self.table}.{self.column}"
+
+    def estimate(self,
+                 conn: sqlite3.Connection,
+                 batch_size: int) -> Tuple[int, int]:
+        return 0, 0
+
+    def apply(self,
+              migrator: "Migrator",
+              version: int,
+              step: int) -> None:
+        columns = {row[1] for row in migrator.conn.execute(
+            f'PRAGMA table_info({self.table})')}
+        if self.column not in columns:
+            migrator.conn.execute(f'''ALTER TABLE {self.table} ADD COLUMN
+                                  {self.column} {self.definition}''')
+
+
+class CreateIndex:
+    '''
+    Create an index if it does not exist. Its build reads the whole
+    table into a single transaction
+    '''
+    def __init__(self,
+                 name: str,
+                 table: str,
+                 columns: str,
+                 unique: bool = False) -> None:
+
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.unique = unique
+
+    def __str__(self) -> str:
+        return f"Create index {self.name}"
+
+    def estimate(self,
+                 conn: sqlite3.Connection,
+                 batch_size: int) -> Tuple[int, int]:
+        exists = conn.execute('''SELECT 1 FROM sqlite_master
+                              WHERE type = 'index' AND name = ?''',
+                              (self.name,)).fetchone()
+        return (0 if exists else estimate_rows(conn, self.table)), 0
+
+    def apply(self,
+              migrator: "Migrator",
+              version: int,
+              step: int) -> None:
+        unique = "UNIQUE " if self.unique else ""
+        migrator.conn.execute(f'''CREATE {unique}INDEX IF NOT EXISTS
+                              {self.name} ON {self.table}
+                              ({self.columns})''')
+
+
+class DropIndex:
+    '''
+    Drop an index if it exists
+    '''
+    def __init__(self,
+                 name: str) -> None:
+        self.name = name
+
+    def __str__(self) -> str:
+        return f"Drop index {self.name}"
+
+    def estimate(self,
+                 conn: sqlite3.Connection,
+                 batch_size: int) -> Tuple[int, int]:
+        return 0, 0
+
+    def apply(self,
+              migrator: "Migrator",
+              version: int,
+              step: int) -> None:
+        migrator.conn.execute(f'DROP INDEX IF EXISTS {self.name}')
+
+
+class Backfill:
+    '''
+    Run a statement over a table in batches of rowids, committing after
+    each one, so other connections can write between the batches. The
+    statement gets the range of a batch as the :start and :end named
+    parameters.
+
+    The position is committed with every batch: an interrupted backfill
+    goes on from the last batch. `skip_if` is a query checked before the
+    first batch, whose true result means there is nothing to fill.
+    '''
+    def __init__(self,
+                 description: str,
+                 table: str,
+                 statement: str,
+                 skip_if: Optional[str] = None) -> None:
+
+        self.description = description
+        self.table = table
+        self.statement = statement
+        self.skip_if = skip_if
+
+    def __str__(self) -> str:
+        return f"Backfill {self.description}"
+
+    def estimate(self,
+                 conn: sqlite3.Connection,
+                 batch_size: int) -> Tuple[int, int]:
+        if self.skip_if and table_exists(conn, self.table):
+            try:
+                if conn.execute(self.skip_if).fetchone()[0]:
+                    return 0, 0
+            except sqlite3.OperationalError:
+                # Checked tables created by a previous step
+                pass
+        rows = estimate_rows(conn, self.table)
+        return rows, math.ceil(rows / batch_size)
+
+    def apply(self,
+              migrator: "Migrator",
+              version: int,
+              step: int) -> None:
+        conn = migrator.conn
+        position = migrator.position(version, step)
+        if position is None and self.skip_if and \
+                conn.execute(self.skip_if).fetchone()[0]:
+            return
+
+        first, last = rowid_range(conn, self.table)
+        if first is None:
+            return
+        start = first if position is None else position
+        while start <= last:
+            end = start + migrator.batch_size - 1
+            conn.execute(self.statement, {"start": start, "end": end})
+            migrator.save_position(version, step, end + 1)
+            conn.commit()
+            logger.debug("Backfilled %s up to rowid %s of %s",
+                         self.table, end, last)
+            start = end + 1
+            if migrator.pause and start <= last:
+                time.sleep(migrator.pause)
+
+
+class Migration(NamedTuple):
+    ''' Schema changes of a version '''
+    description: str
+    steps: Sequence
+
+
+class Migrator:
+    '''
+    Apply the pending migrations of a database, in order and each one
+    step by step
+    '''
+    def __init__(self,
+                 conn: sqlite3.Connection,
+                 migrations: Sequence[Migration],
+                 batch_size: int = 1000,
+                 pause: float = 0) -> None:
+
+        self.conn = conn
+        self.migrations = migrations
+        self.batch_size = batch_size
+        self.pause = pause
+
+    @property
+    def version(self) -> int:
+        '''
+        Current schema version of the database
+        '''
+        return self.conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def check(self) -> int:
+        '''
+        Current version, refusing databases of a newer schema
+        '''
+
+        version = self.version
+        if version > len(self.migrations):
+            raise MigrationException(
+                f"Database schema version {version} is newer than the "
+                f"supported {len(self.migrations)}")
+        return version
+
+    def position(self,
+                 version: int,
+                 step: int) -> Optional[int]:
+        '''
+        Next rowid of an interrupted backfill
+        '''
+
+        if not table_exists(self.conn, 'migration_progress'):
+            return None
+        row = self.conn.execute('''SELECT position FROM migration_progress
+                                WHERE version = ? AND step = ?''',
+                                (version, step)).fetchone()
+        return row[0] if row else None
+
+    def save_position(self,
+                      version: int,
+                      step: int,
+                      position: int) -> None:
+        '''
+        Record the progress of a backfill into the current transaction
+        '''
+
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS migration_progress
+                          (version INTEGER, step INTEGER, position INTEGER,
+                          PRIMARY KEY (version, step))''')
+        self.conn.execute('''INSERT OR REPLACE INTO migration_progress
+                          VALUES (?, ?, ?)''', (version, step, position))
+
+    def plan(self) -> List[Estimate]:
+        '''
+        Estimate the cost of the pending steps without changing the
+        database
+
+        Returns:
+            - list: Estimate of every pending step
+        '''
+
+        estimates = []
+        for version in range(self.check() + 1, len(self.migrations) + 1):
+            for step in self.migrations[version - 1].steps:
+                rows, batches = step.estimate(self.conn, self.batch_size)
+                estimates.append(Estimate(version, str(step), rows, batches))
+        return estimates
+
+    def run(self) -> int:
+        '''
+        Apply the pending migrations
+
+        Returns:
+            - int: Number of applied migrations
+        '''
+
+        start = self.check()
+        for version in range(start + 1, len(self.migrations) + 1):
+            migration = self.migrations[version - 1]
+            logger.info("Migrating database to version %s: %s",
+                        version, migration.description)
+            for step, change in enumerate(migration.steps):
+                change.apply(self, version, step)
+                self.conn.commit()
+
+            self.conn.execute(f'PRAGMA user_version = {version}')
+            self.conn.commit()
+
+        # Backfills are complete
+        self.conn.execute('DROP TABLE IF EXISTS migration_progress')
+        return len(self.migrations) - start
+
+
+def main():  # pragma: no cover
+    parser = argparse.ArgumentParser(
+        description="Migrate a FlashCardBot database to the current "
+                    "schema. It can run while the bot is using it")
+    parser.add_argument('database')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report the pending steps and their cost')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Rows written per backfill transaction')
+    parser.add_argument('--pause', type=float, default=0.01,
+                        help='Seconds between backfill batches')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from storage_manager import MIGRATIONS
+
+    conn = sqlite3.connect(args.database, timeout=30)
+    migrator = Migrator(conn, MIGRATIONS, args.batch_size, args.pause)
+    print(f"Database {args.database} at version {migrator.version} of "
+          f"{len(MIGRATIONS)}")
+    for estimate in migrator.plan():
+        print(estimate)
+    if not args.dry_run:
+        migrator.run()
+        print(f"Database at version {migrator.version}")
+    conn.close()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+'''
+Rate limited background sending of replies
+'''
+
+from collections import deque
+import heapq
+import logging
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from bot_api import BotAPIException
+from metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+PENDING_REPLIES = Gauge('flashcard_outbound_pending_replies',
+                        'Replies waiting to be sent')
+RETRIED_REPLIES = Counter('flashcard_outbound_retries_total',
+                          'Replies sent again after an error',
+                          ['reason'])
+DROPPED_REPLIES = Counter('flashcard_outbound_dropped_total',
+                          'Replies given up after all the retries')
+REPLY_DELAY = Histogram('flashcard_outbound_delay_seconds',
+                        'Time from a reply being queued to being sent')
+
+# (item_type, content, queued timestamp, attempts)
+Reply = Tuple[str, str, float, int]
+
+
+class TokenBucket:
+    '''
+    Token bucket rate limiter: `rate` tokens per second, bursts up to
+    `capacity` tokens. Not thread safe, callers must hold a lock.
+    '''
+    def __init__(self,
+                 rate: float,
+                 capacity: float = 1,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        '''
+        Seconds until a token is available. 0 if one is available now
+        '''
+
+        self._refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        '''
+        Take a token. Check delay() before
+        '''
+        self.tokens -= 1
+
+    def idle(self) -> bool:
+        '''
+        The bucket is full, so it is equivalent to a new one
+        '''
+
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class OutboundDispatcher:
+    '''
+    Queue replies per chat and send them from background threads.
+
+    Telegram allows around 30 messages per second overall and one per
+    second into the same chat. Both limits are enforced with token
+    buckets, so the bot is not throttled with 429 errors. Replies of a
+    chat are sent in order, one at a time. Failed sends are retried
+    after the retry_after delay returned by Telegram or with an
+    exponential backoff.
+    '''
+    def __init__(self,
+                 api,
+                 workers: int = 2,
+                 global_rate: float = 30,
+                 chat_rate: float = 1,
+                 chat_burst: float = 3,
+                 max_retries: int = 5,
+                 backoff: float = 1.0) -> None:
+
+        self.api = api
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.condition = threading.Condition()
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.pending: Dict[int, Deque[Reply]] = {}
+        self.count = 0
+
+        # Chats ready to send their next reply: heap of (time, chat_id).
+        # A chat is either into the heap or being sent, never both
+        self.ready: List[Tuple[float, int]] = []
+        self.sending = set()
+        self._closed = False
+
+        self.threads = [threading.Thread(target=self._run,
+                                         name=f"outbound-{i}",
+                                         daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def send(self,
+             item_type: str,
+             chat_id: int,
+             content: str) -> None:
+        '''
+        Queue a reply. Returns immediately
+
+        Parameters:
+            - item_type (str): Type of item (text, photo, audio or video)
+            - chat_id (int): Target chat
+            - content (str): Text or Telegram file_id to be sent
+        '''
+
+        with self.condition:
+            replies = self.pending.get(chat_id)
+            if replies is None:
+                replies = self.pending[chat_id] = deque()
+            replies.append((item_type, content, time.monotonic(), 0))
+            self.count += 1
+            PENDING_REPLIES.set(self.count)
+
+            # Idle chat: schedule it now
+            if len(replies) == 1 and chat_id not in self.sending:
+                heapq.heappush(self.ready, (time.monotonic(), chat_id))
+                self.condition.notify()
+
+    def _next(self) -> Tuple[int, Reply]:
+        '''
+        Wait for a reply allowed by the rate limits
+
+        Returns:
+            - tuple: (chat_id, reply) or (None, None) when closed
+        '''
+
+        with self.condition:
+            while True:
+                if not self.ready:
+                    if self._closed:
+                        return None, None
+                    self.condition.wait()
+                    continue
+
+                ready_time, chat_id = self.ready[0]
+                wait = ready_time - time.monotonic()
+                if wait <= 0:
+                    bucket = self.chat_buckets.get(chat_id)
+                    if bucket is None:
+                        bucket = self.chat_buckets[chat_id] = TokenBucket(
+                            self.chat_rate, self.chat_burst)
+                    wait = max(bucket.delay(), self.global_bucket.delay())
+                    if wait <= 0:
+                        heapq.heappop(self.ready)
+                        bucket.consume()
+                        self.global_bucket.consume()
+                        self.sending.add(chat_id)
+                        return chat_id, self.pending[chat_id].popleft()
+
+                    # Not allowed yet: try again when it is
+                    heapq.heapreplace(self.ready,
+                                      (time.monotonic() + wait, chat_id))
+                self.condition.wait(wait)
+
+    def _done(self,
+              chat_id: int,
+              retry: Reply = None,
+              delay: float = 0) -> None:
+        '''
+        Finish a send and schedule the next reply of the chat
+        '''
+
+        with self.condition:
+            self.sending.discard(chat_id)
+            replies = self.pending[chat_id]
+            if retry is not None:
+                replies.appendleft(retry)
+            else:
+                self.count -= 1
+                PENDING_REPLIES.set(self.count)
+
+            if replies:
+                heapq.heappush(self.ready, (time.monotonic() + delay,
+                                            chat_id))
+            else:
+                del self.pending[chat_id]
+                self._sweep()
+            self.condition.notify_all()
+
+    def _sweep(self) -> None:
+        '''
+        Forget the full buckets of idle chats to bound memory. Amortized
+        O(1): only runs once the buckets double the active chats
+        '''
+
+        if len(self.chat_buckets) < 1024 + 2 * len(self.pending):
+            return
+        self.chat_buckets = {
+            chat_id: bucket for chat_id, bucket in self.chat_buckets.items()
+            if chat_id in self.pending or chat_id in self.sending or
+            not bucket.idle()}
+
+    def _run(self) -> None:
+        '''
+        Send replies until closed and all of them are sent
+        '''
+
+        while True:
+            chat_id, reply = self._next()
+            if chat_id is None:
+                return
+
+            item_type, content, queued, attempts = reply
+            try:
+                self.api.send(item_type, chat_id, content)
+            except BotAPIException as error:
+                if attempts >= self.max_retries:
+                    logger.error("Dropping reply to chat %s: %s",
+                                 chat_id, error)
+                    DROPPED_REPLIES.inc()
+                    self._done(chat_id)
+                    continue
+
+                if error.retry_after:
+                    RETRIED_REPLIES.inc(reason="throttled")
+                    delay = error.retry_after
+                else:
+                    RETRIED_REPLIES.inc(reason="error")
+                    delay = self.backoff * 2 ** attempts
+                logger.warning("Retrying reply to chat %s in %ss: %s",
+                               chat_id, delay, error)
+                self._done(chat_id,
+                           (item_type, content, queued, attempts + 1),
+                           delay)
+                continue
+            except Exception:
+                logger.exception("Error sending reply to chat %s", chat_id)
+                DROPPED_REPLIES.inc()
+                self._done(chat_id)
+                continue
+
+            REPLY_DELAY.observe(time.monotonic() - queued)
+            self._done(chat_id)
+
+    def flush(self,
+              timeout: Optional[float] = None) -> bool:
+        '''
+        Wait until every queued reply is sent or dropped
+
+        Returns:
+            - bool: False if the timeout expired before
+        '''
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.count:
+                remaining = None if deadline is None \
+                    else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self,
+              timeout: float = 30) -> None:
+        '''
+        Send the queued replies and stop the threads
+        '''
+
+        if not self.flush(timeout):
+            logger.error("Closing with %s replies not sent", self.count)
+        with self.condition:
+            self._closed = True
+            self.ready.clear()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
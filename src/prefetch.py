@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+'''
+Cards selected ahead of the next round of every chat
+'''
+
+from collections import OrderedDict, deque
+import logging
+import threading
+from typing import Callable, Deque, Hashable, Iterable, List, Optional
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_REQUESTS = Counter('flashcard_prefetch_requests_total',
+                            'Cards requested from the prefetch buffers',
+                            ['result'])
+
+
+class Buffer:
+    '''
+    Cards prefetched for a chat, with the version of the deck and the
+    last review they were selected after
+    '''
+    def __init__(self,
+                 scope: dict,
+                 generation: int,
+                 sequence: int,
+                 items: List[tuple]) -> None:
+
+        self.scope = scope
+        self.generation = generation
+        self.sequence = sequence
+        self.items: Deque[tuple] = deque(items)
+
+
+class PrefetchBuffer:
+    '''
+    Per-chat buffers of the next cards, refilled by a background thread
+    while the user answers the current one, so a new round takes its
+    card from memory instead of querying the database.
+
+    Buffers are tagged with the generation of their deck (see
+    StorageManager.generation). Inserts and deletes increase it, so the
+    buffers of the deck are dropped when used instead of being walked
+    on every write. Reviews reschedule a single card, so they are
+    numbered instead, and cards reviewed after the refill of a buffer
+    are skipped. At most `max_chats` buffers are kept, least recently
+    used first out.
+    '''
+    def __init__(self,
+                 fetch: Callable[..., List[tuple]],
+                 generation: Callable[..., int],
+                 depth: int = 3,
+                 max_chats: int = 10000) -> None:
+
+        # fetch(count, exclude, user_id=, deck_id=) selects the cards
+        self.fetch = fetch
+        self.generation = generation
+        self.depth = depth
+        self.max_chats = max_chats
+
+        self.buffers: OrderedDict = OrderedDict()
+        # {(user_id, deck_id, item_id): number of its last review}. The
+        # oldest are forgotten, and buffers refilled before the last
+        # forgotten review are dropped
+        self.reviews: OrderedDict = OrderedDict()
+        self.max_reviews = max_chats * depth
+        self.sequence = 0
+        self.forgotten = 0
+        # {chat_id: (scope, exclude)} waiting for a refill, oldest first
+        self.requests: OrderedDict = OrderedDict()
+        self.condition = threading.Condition()
+        self.refilling = False
+        self._closed = False
+        self.thread = threading.Thread(target=self._run,
+                                       name="prefetch",
+                                       daemon=True)
+        self.thread.start()
+
+    def pop(self,
+            chat_id: Hashable,
+            scope: dict) -> Optional[tuple]:
+        '''
+        Take the next card of a chat
+
+        Parameters:
+            - chat_id: Chat starting a round
+            - scope (dict): user_id and deck_id of the deck of the chat
+
+        Returns:
+            - tuple: Database row of the card. None if there is no
+                valid card in the buffer
+        '''
+
+        generation = self.generation(**scope)
+        with self.condition:
+            buffer = self.buffers.get(chat_id)
+            if buffer is None or not buffer.items:
+                PREFETCH_REQUESTS.inc(result="miss")
+                return None
+            if buffer.generation == generation and buffer.scope == scope \
+                    and buffer.sequence >= self.forgotten:
+                while buffer.items:
+                    item = buffer.items.popleft()
+                    key = (scope["user_id"], scope["deck_id"], item[0])
+                    if self.reviews.get(key, 0) <= buffer.sequence:
+                        self.buffers.move_to_end(chat_id)
+                        PREFETCH_REQUESTS.inc(result="hit")
+                        return item
+
+            del self.buffers[chat_id]
+            PREFETCH_REQUESTS.inc(result="stale")
+            return None
+
+    def reviewed(self,
+                 scope: dict,
+                 item_ids: Iterable[int]) -> None:
+        '''
+        Keep reviewed cards out of the buffers refilled before, so they
+        are not asked again before their new due date
+
+        Parameters:
+            - scope (dict): user_id and deck_id of the deck of the cards
+            - item_ids (iterable): IDs of the reviewed cards
+        '''
+
+        with self.condition:
+            for item_id in item_ids:
+                self.sequence += 1
+                key = (scope["user_id"], scope["deck_id"], item_id)
+                self.reviews[key] = self.sequence
+                self.reviews.move_to_end(key)
+            while len(self.reviews) > self.max_reviews:
+                _, sequence = self.reviews.popitem(last=False)
+                self.forgotten = max(self.forgotten, sequence)
+
+    def discard(self,
+                chat_id: Hashable) -> None:
+        '''
+        Drop the buffer of a chat and its pending refill
+        '''
+
+        with self.condition:
+            self.buffers.pop(chat_id, None)
+            self.requests.pop(chat_id, None)
+
+    def refill(self,
+               chat_id: Hashable,
+               scope: dict,
+               exclude: Iterable[int] = ()) -> None:
+        '''
+        Select the next cards of a chat in background. Returns
+        immediately
+
+        Parameters:
+            - chat_id: Chat answering a card
+            - scope (dict): user_id and deck_id of the deck of the chat
+            - exclude (iterable): IDs of cards not to be prefetched, such
+                as the one being answered
+        '''
+
+        with self.condition:
+            if self._closed:
+                return
+            self.requests[chat_id] = (scope, tuple(exclude))
+            self.requests.move_to_end(chat_id)
+            # Chats with older requests are refilled again later
+            while len(self.requests) > self.max_chats:
+                self.requests.popitem(last=False)
+            self.condition.notify_all()
+
+    def _refill(self,
+                chat_id: Hashable,
+                scope: dict,
+                exclude: tuple) -> None:
+        '''
+        Replace the buffer of a chat with newly selected cards
+        '''
+
+        # Read before the selection: a change made meanwhile leaves the
+        # buffer stale rather than hiding it
+        generation = self.generation(**scope)
+        with self.condition:
+            sequence = self.sequence
+        try:
+            items = self.fetch(self.depth, exclude, **scope)
+        except Exception as error:
+            logger.debug("Unable to prefetch cards of chat %s: %s",
+                         chat_id, error)
+            return
+
+        with self.condition:
+            self.buffers[chat_id] = Buffer(scope, generation, sequence,
+                                           items)
+            self.buffers.move_to_end(chat_id)
+            while len(self.buffers) > self.max_chats:
+                self.buffers.popitem(last=False)
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                self.refilling = False
+                self.condition.notify_all()
+                while not self.requests and not self._closed:
+                    self.condition.wait()
+                if self._closed:
+                    return
+                chat_id, (scope, exclude) = self.requests.popitem(last=False)
+                self.refilling = True
+            self._refill(chat_id, scope, exclude)
+
+    def flush(self,
+              timeout: Optional[float] = None) -> bool:
+        '''
+        Wait for the pending refills
+
+        Returns:
+            - bool: False if the timeout expired before
+        '''
+
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not self.requests and not self.refilling, timeout)
+
+    def close(self) -> None:
+        '''
+        Stop the refills
+        '''
+
+        with self.condition:
+            self._closed = True
+            self.requests.clear()
+            self.condition.notify_all()
+        self.thread.join()
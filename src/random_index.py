@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+'''
+Constant time uniform sampling of item IDs
+'''
+
+from array import array
+import random
+from typing import Iterable, List, Optional
+
+
+class RandomIndex:
+    '''
+    Set of item IDs supporting O(1) insertion, deletion and uniform
+    random selection.
+
+    IDs are packed into an array (8 bytes per item). Deletions are lazy:
+    deleted IDs are rejected when sampled and the array is compacted
+    once they represent a quarter of it, so every operation is O(1)
+    amortized.
+    '''
+    def __init__(self,
+                 ids: Iterable[int] = ()) -> None:
+
+        self.ids = array('q', ids)
+        self.deleted = set()
+
+    def __len__(self) -> int:
+        return len(self.ids) - len(self.deleted)
+
+    def add(self,
+            item_id: int) -> None:
+        '''
+        Add an item ID to the index
+
+        Parameters:
+            - item_id (int): ID of the new item
+        '''
+
+        # SQLite can reuse the rowid of a deleted item, which is still
+        # stored into the array
+        if item_id in self.deleted:
+            self.deleted.discard(item_id)
+            return
+        self.ids.append(item_id)
+
+    def discard(self,
+                item_id: int) -> None:
+        '''
+        Remove an item ID from the index
+
+        Parameters:
+            - item_id (int): ID of the removed item
+        '''
+
+        self.deleted.add(item_id)
+        if len(self.deleted) * 4 > len(self.ids):
+            self.compact()
+
+    def compact(self) -> None:
+        '''
+        Drop deleted IDs from the array
+        '''
+
+        self.ids = array('q', (item_id for item_id in self.ids
+                               if item_id not in self.deleted))
+        self.deleted = set()
+
+    def choice(self) -> Optional[int]:
+        '''
+        Select a random item ID uniformly
+
+        Returns:
+            - int: Selected ID or None if the index is empty
+        '''
+
+        if not len(self):
+            return None
+
+        while True:
+            item_id = self.ids[random.randrange(len(self.ids))]
+            if item_id not in self.deleted:
+                return item_id
+
+    def sample(self,
+               count: int) -> List[int]:
+        '''
+        Select distinct random item IDs uniformly
+
+        Parameters:
+            - count (int): Number of IDs
+
+        Returns:
+            - list: Selected IDs, all of them if there are not enough
+        '''
+
+        # Rejection sampling is O(count) while count is small compared
+        # to the index. Otherwise, sample the live IDs
+        if count * 2 > len(self):
+            live = [item_id for item_id in self.ids
+                    if item_id not in self.deleted]
+            return random.sample(live, min(count, len(live)))
+
+        selected = {}
+        while len(selected) < count:
+            selected[self.choice()] = None
+        return list(selected)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+'''
+Reload of the configuration file without restarting the bot
+'''
+
+import logging
+import os
+import threading
+from typing import Callable, Optional, Tuple
+
+from configuration import Configuration, ConfigurationException
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+RELOADS = Counter('flashcard_config_reloads_total',
+                  'Configuration reload attempts',
+                  ['result'])
+
+
+class ConfigReloader:
+    '''
+    Watch the configuration file from a background thread and apply it
+    again when it changes or when requested, e.g. on SIGHUP.
+
+    New configurations are validated before being applied, so an
+    invalid file is reported and the running configuration is kept.
+    Validation runs out of the message handling threads: the callback
+    only has to swap the new state in.
+    '''
+    def __init__(self,
+                 configuration: Configuration,
+                 on_reload: Callable[[dict], None],
+                 interval: float = 5.0) -> None:
+
+        self.configuration = configuration
+        self.on_reload = on_reload
+        self.interval = interval
+        self.requested = threading.Event()
+        self.stamp = self._stamp()
+        self._stopped = False
+        self.thread = threading.Thread(target=self._run,
+                                       name="reloader",
+                                       daemon=True)
+
+    def _stamp(self) -> Optional[Tuple[int, int, int]]:
+        '''
+        Identity of the current version of the file. Files replaced by
+        a rename are detected by their inode
+        '''
+
+        try:
+            stat = os.stat(self.configuration.configuration_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def request(self) -> None:
+        '''
+        Reload even if the file did not change. Safe to call from a
+        signal handler
+        '''
+        self.requested.set()
+
+    def check(self) -> bool:
+        '''
+        Reload the configuration if the file changed or a reload was
+        requested
+
+        Returns:
+            - bool: True if a new configuration was applied
+        '''
+
+        stamp = self._stamp()
+        if not self.requested.is_set() and stamp == self.stamp:
+            return False
+        self.requested.clear()
+        self.stamp = stamp
+
+        try:
+            config = self.configuration.validate()
+        except ConfigurationException as error:
+            RELOADS.inc(result="invalid")
+            logger.error("Configuration not reloaded: %s", error)
+            return False
+
+        try:
+            self.on_reload(config)
+        except Exception:
+            RELOADS.inc(result="error")
+            logger.exception("Error applying the new configuration")
+            return False
+
+        RELOADS.inc(result="applied")
+        logger.info("Configuration reloaded from %s",
+                    self.configuration.configuration_file)
+        return True
+
+    def _run(self) -> None:
+        while True:
+            # Without interval, only requested reloads are done
+            self.requested.wait(self.interval or None)
+            if self._stopped:
+                return
+            self.check()
+
+    def start(self) -> "ConfigReloader":
+        '''
+        Start watching the file
+        '''
+
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''
+        Stop watching the file
+        '''
+
+        self._stopped = True
+        self.requested.set()
+        self.thread.join()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+'''
+Write-behind buffer of answer results
+'''
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Set, Tuple
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+PENDING_REVIEWS = Gauge('flashcard_pending_reviews',
+                        'Answer results waiting to be written')
+
+# {item_id: [(correct, timestamp), ...]}
+Reviews = Dict[int, List[Tuple[bool, float]]]
+
+
+class ReviewWriter:
+    '''
+    Accumulate answer results in memory and write them with a single
+    transaction (group commit).
+
+    Pending reviews are flushed by a background thread every
+    `flush_interval` seconds, as soon as `flush_size` reviews are
+    pending, and on close().
+    '''
+    def __init__(self,
+                 apply: Callable[[Reviews], None],
+                 flush_interval: float = 2.0,
+                 flush_size: int = 100) -> None:
+
+        self.apply = apply
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self.pending: Reviews = {}
+        self.count = 0
+        self.lock = threading.Lock()
+
+        # Serialize flushes, so reviews of the same item are applied
+        # in order
+        self._flush_lock = threading.Lock()
+
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name="review-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def record(self,
+               item_id: int,
+               correct: bool) -> None:
+        '''
+        Queue the result of an answer
+
+        Parameters:
+            - item_id (int): ID of the answered item
+            - correct (bool): Result of the answer
+        '''
+
+        with self.lock:
+            self.pending.setdefault(item_id, []).append((correct,
+                                                         time.time()))
+            self.count += 1
+            PENDING_REVIEWS.set(self.count)
+            if self.count >= self.flush_size:
+                self._wakeup.set()
+
+    def record_many(self,
+                    reviews: Reviews) -> None:
+        '''
+        Queue the results of several answers. They are written into the
+        same transaction
+
+        Parameters:
+            - reviews (dict): {item_id: [(correct, timestamp), ...]}
+        '''
+
+        with self.lock:
+            for item_id, results in reviews.items():
+                self.pending.setdefault(item_id, []).extend(results)
+                self.count += len(results)
+            PENDING_REVIEWS.set(self.count)
+            if self.count >= self.flush_size:
+                self._wakeup.set()
+
+    def pending_ids(self) -> Set[int]:
+        '''
+        IDs of items with reviews not written yet
+        '''
+
+        with self.lock:
+            return set(self.pending)
+
+    def flush(self) -> int:
+        '''
+        Write all pending reviews into a single transaction
+
+        Returns:
+            - int: Number of written reviews
+        '''
+
+        with self._flush_lock:
+            with self.lock:
+                reviews, self.pending = self.pending, {}
+                count, self.count = self.count, 0
+                PENDING_REVIEWS.set(0)
+
+            if reviews:
+                try:
+                    self.apply(reviews)
+                except Exception:
+                    # Keep the reviews for the next flush
+                    with self.lock:
+                        for item_id, results in self.pending.items():
+                            reviews.setdefault(item_id, []).extend(results)
+                        self.pending = reviews
+                        self.count += count
+                        PENDING_REVIEWS.set(self.count)
+                    raise
+                logger.debug("Flushed %s reviews", count)
+        return count
+
+    def _run(self) -> None:
+        '''
+        Background flush loop
+        '''
+
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error flushing reviews")
+
+    def close(self) -> None:
+        '''
+        Stop the background thread and flush pending reviews
+        '''
+
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+'''
+SM-2 spaced repetition scheduler
+'''
+
+from typing import Tuple
+
+DAY = 86400
+
+# Initial and minimum ease factor defined by SM-2
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+
+# Seconds before a wrong answered card is shown again
+RELEARN_DELAY = 600
+
+# Answer quality (0-5 SM-2 scale) of right and wrong answers
+CORRECT_QUALITY = 4
+WRONG_QUALITY = 1
+
+
+def sm2(interval: float,
+        ease: float,
+        repetitions: int,
+        quality: int) -> Tuple[float, float, int]:
+    '''
+    Compute the next review interval using the SM-2 algorithm
+
+    Parameters:
+        - interval (float): Current interval in days
+        - ease (float): Current ease factor
+        - repetitions (int): Number of consecutive right answers
+        - quality (int): Answer quality from 0 (blackout) to 5 (perfect)
+
+    Returns:
+        - tuple: (interval, ease, repetitions) after the review
+    '''
+
+    if quality < 3:
+        # Start over the card, keeping its ease
+        return 0, ease, 0
+
+    repetitions += 1
+    if repetitions == 1:
+        interval = 1
+    elif repetitions == 2:
+        interval = 6
+    else:
+        interval = round(interval * ease)
+
+    ease += 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+    return interval, max(MIN_EASE, ease), repetitions
+
+
+def review(schedule: Tuple[float, float, int],
+           correct: bool,
+           now: float) -> Tuple[float, float, float, int]:
+    '''
+    Schedule the next review of a card after an answer
+
+    Parameters:
+        - schedule (tuple): Current (interval, ease, repetitions)
+        - correct (bool): Result of the answer
+        - now (float): Answer timestamp
+
+    Returns:
+        - tuple: (due, interval, ease, repetitions) after the review
+    '''
+
+    quality = CORRECT_QUALITY if correct else WRONG_QUALITY
+    interval, ease, repetitions = sm2(*schedule, quality)
+    due = now + (interval * DAY if interval else RELEARN_DELAY)
+    return due, interval, ease, repetitions
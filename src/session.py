@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+'''
+Per-chat session state
+'''
+
+from collections import OrderedDict
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Round:
+    '''
+    Cards of a batch round, asked in order, and the answers collected
+    until the round is complete
+    '''
+    def __init__(self,
+                 cards: List[Tuple[int, str]]) -> None:
+
+        # (item_id, answer) of every card
+        self.cards = cards
+        self.position = 0
+        self.correct = 0
+
+        # {item_id: [(correct, timestamp)]}, written at the end
+        self.reviews: Dict[int, List[Tuple[bool, float]]] = {}
+
+    @property
+    def current(self) -> Tuple[int, str]:
+        '''
+        Card waiting for an answer
+        '''
+        return self.cards[self.position]
+
+    @property
+    def done(self) -> bool:
+        '''
+        Every card is answered
+        '''
+        return self.position >= len(self.cards)
+
+    def answer(self,
+               correct: bool) -> None:
+        '''
+        Record the answer of the current card and move to the next one
+        '''
+
+        item_id, _ = self.current
+        self.reviews[item_id] = [(correct, time.time())]
+        self.correct += correct
+        self.position += 1
+
+
+class Session:
+    '''
+    State of the conversation with a single chat
+    '''
+    def __init__(self,
+                 chat_id: Hashable,
+                 command: str = '',
+                 attempt_count: int = 0,
+                 item_id: Optional[int] = None,
+                 updated: Optional[float] = None) -> None:
+
+        self.chat_id = chat_id
+
+        # Pending command and number of failed attempts
+        self.command = command
+        self.attempt_count = attempt_count
+
+        # Database ID of the current quiz item
+        self.item_id = item_id
+
+        # Batch round in progress. Only kept in memory
+        self.round: Optional[Round] = None
+
+        # Last access time, used by the TTL eviction
+        self.updated = updated if updated is not None else time.monotonic()
+
+    def reset(self) -> None:
+        '''
+        Clear the pending command
+        '''
+        self.command = ''
+        self.attempt_count = 0
+        self.round = None
+
+
+class SessionStore:
+    '''
+    Sessions keyed by chat id with LRU and TTL eviction.
+
+    The store keeps at most `max_sessions` sessions in memory. When a
+    database is provided, sessions are also persisted so in-flight
+    rounds survive a restart and evicted sessions can be restored.
+    '''
+    def __init__(self,
+                 max_sessions: int = 10000,
+                 ttl: int = 3600,
+                 database: Optional[str] = None,
+                 timeout: int = 20) -> None:
+
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Number of saves between purges of expired persisted sessions
+        self.purge_interval = 1000
+        self._saves = 0
+
+        self.conn = None
+        if database:
+            self.conn = sqlite3.connect(database=database,
+                                        timeout=timeout,
+                                        check_same_thread=False)
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS sessions
+                              (chat_id INTEGER PRIMARY KEY,
+                              command TEXT,
+                              attempt_count INTEGER,
+                              item_id INTEGER,
+                              updated REAL)''')
+            self.conn.commit()
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self,
+            chat_id: Hashable) -> Session:
+        '''
+        Get the session of a chat, creating it if needed
+
+        Parameters:
+            - chat_id: Chat identifier
+
+        Returns:
+            - Session: Session of the chat
+        '''
+
+        now = time.monotonic()
+        with self.lock:
+            session = self.sessions.get(chat_id)
+            if session is not None and now - session.updated > self.ttl:
+                logger.debug("Session %s expired", chat_id)
+                self._delete(chat_id)
+                session = None
+
+            if session is None:
+                session = self._load(chat_id) or Session(chat_id)
+                self.sessions[chat_id] = session
+
+            session.updated = now
+            self.sessions.move_to_end(chat_id)
+            self._evict()
+        return session
+
+    def save(self,
+             session: Session) -> None:
+        '''
+        Persist session state. Only required when a database is used
+
+        Parameters:
+            - session (Session): Session to be stored
+        '''
+
+        if self.conn is None or session.chat_id is None:
+            return
+
+        with self.lock:
+            self.conn.execute('''INSERT OR REPLACE INTO sessions
+                              VALUES (?, ?, ?, ?, ?)''',
+                              (session.chat_id,
+                               session.command,
+                               session.attempt_count,
+                               session.item_id,
+                               time.time()))
+            self.conn.commit()
+
+            self._saves += 1
+            if self._saves % self.purge_interval == 0:
+                self._purge()
+
+    def _purge(self) -> None:
+        '''
+        Remove expired sessions from database
+        '''
+
+        self.conn.execute('DELETE FROM sessions WHERE updated < ?',
+                          (time.time() - self.ttl,))
+        self.conn.commit()
+
+    def _load(self,
+              chat_id: Hashable) -> Optional[Session]:
+        '''
+        Restore a non-expired session from database
+        '''
+
+        if self.conn is None:
+            return None
+
+        row = self.conn.execute('''SELECT command, attempt_count, item_id,
+                                updated FROM sessions WHERE chat_id = ?''',
+                                (chat_id,)).fetchone()
+        if not row or time.time() - row[3] > self.ttl:
+            return None
+
+        command, attempt_count, item_id, _ = row
+        return Session(chat_id, command, attempt_count, item_id)
+
+    def _delete(self,
+                chat_id: Hashable) -> None:
+        '''
+        Remove a session from memory and database
+        '''
+
+        self.sessions.pop(chat_id, None)
+        if self.conn is not None:
+            self.conn.execute('DELETE FROM sessions WHERE chat_id = ?',
+                              (chat_id,))
+            self.conn.commit()
+
+    def _evict(self) -> None:
+        '''
+        Drop expired and least recently used sessions from memory.
+        Persisted sessions can be restored later with _load
+        '''
+
+        now = time.monotonic()
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if len(self.sessions) <= self.max_sessions and \
+                    now - session.updated <= self.ttl:
+                break
+            self.sessions.popitem(last=False)
+
+    def close(self) -> None:
+        '''
+        Close connection to database
+        '''
+
+        if self.conn is not None:
+            with self.lock:
+                self.conn.close()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+'''
+Storage split into several SQLite files by user
+'''
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from stats import DeckStats
+from storage_manager import StorageManager
+
+
+def shard_path(database: str,
+               shard: int) -> str:
+    '''
+    File of a shard: "flashcard.db" is split into "flashcard.0.db",
+    "flashcard.1.db"...
+    '''
+
+    path = Path(database)
+    return str(path.with_name(f"{path.stem}.{shard}{path.suffix}"))
+
+
+class ShardedStorage:
+    '''
+    StorageManager interface over one database file per shard. Every
+    user lives into a single shard, so each file keeps its own writer
+    lock, WAL and in-memory indexes, and writes of users of different
+    shards do not wait for each other.
+
+    Item IDs are only unique into a shard: they must be used together
+    with the user_id they were selected for.
+    '''
+    def __init__(self,
+                 database: str,
+                 shards: int,
+                 **options) -> None:
+
+        if shards < 1:
+            raise ValueError("At least one shard is required")
+        self.shards: List[StorageManager] = [
+            StorageManager(database=shard_path(database, shard), **options)
+            for shard in range(shards)]
+
+    def shard(self,
+              user_id: int) -> StorageManager:
+        '''
+        Storage of a user
+        '''
+        return self.shards[user_id % len(self.shards)]
+
+    def insert_item(self,
+                    item_type: str,
+                    answer: str,
+                    quiz: str,
+                    user_id: int = 0,
+                    deck_id: int = 0) -> None:
+        self.shard(user_id).insert_item(item_type, answer, quiz,
+                                        user_id, deck_id)
+
+    def insert_items(self,
+                     items: Iterable[Tuple[str, str]],
+                     item_type: str = "text",
+                     batch_size: int = 1000,
+                     user_id: int = 0,
+                     deck_id: int = 0) -> Tuple[int, int]:
+        return self.shard(user_id).insert_items(items, item_type, batch_size,
+                                                user_id, deck_id)
+
+    def delete_item(self,
+                    answer: str,
+                    user_id: int = 0,
+                    deck_id: int = 0) -> bool:
+        return self.shard(user_id).delete_item(answer, user_id, deck_id)
+
+    def select_random_row(self,
+                          user_id: int = 0,
+                          deck_id: int = 0) -> tuple:
+        return self.shard(user_id).select_random_row(user_id, deck_id)
+
+    def select_due_row(self,
+                       user_id: int = 0,
+                       deck_id: int = 0) -> tuple:
+        return self.shard(user_id).select_due_row(user_id, deck_id)
+
+    def select_random_rows(self,
+                           count: int,
+                           user_id: int = 0,
+                           deck_id: int = 0) -> List[tuple]:
+        return self.shard(user_id).select_random_rows(count, user_id,
+                                                      deck_id)
+
+    def select_due_rows(self,
+                        count: int,
+                        user_id: int = 0,
+                        deck_id: int = 0,
+                        exclude: Iterable[int] = ()) -> List[tuple]:
+        return self.shard(user_id).select_due_rows(count, user_id, deck_id,
+                                                   exclude)
+
+    def generation(self,
+                   user_id: int = 0,
+                   deck_id: int = 0) -> int:
+        return self.shard(user_id).generation(user_id, deck_id)
+
+    def match_answer(self,
+                     attempt: str,
+                     answer: str,
+                     user_id: int = 0,
+                     deck_id: int = 0) -> bool:
+        return self.shard(user_id).match_answer(attempt, answer, user_id,
+                                                deck_id)
+
+    def record_reviews(self,
+                       reviews: Dict[int, List[Tuple[bool, float]]],
+                       user_id: int = 0,
+                       deck_id: int = 0) -> None:
+        self.shard(user_id).record_reviews(reviews, user_id, deck_id)
+
+    def check_quiz_item(self,
+                        attempt: str,
+                        item_id: Optional[int] = None,
+                        user_id: int = 0,
+                        deck_id: int = 0) -> bool:
+        return self.shard(user_id).check_quiz_item(attempt, item_id,
+                                                   user_id, deck_id)
+
+    def deck_max_distance(self,
+                          user_id: int = 0,
+                          deck_id: int = 0) -> Optional[int]:
+        return self.shard(user_id).deck_max_distance(user_id, deck_id)
+
+    def set_max_distance(self,
+                         max_distance: Optional[int],
+                         user_id: int = 0,
+                         deck_id: int = 0) -> None:
+        self.shard(user_id).set_max_distance(max_distance, user_id,
+                                             deck_id)
+
+    def stats(self,
+              user_id: int = 0,
+              deck_id: int = 0,
+              hardest: int = 3) -> DeckStats:
+        return self.shard(user_id).stats(user_id, deck_id, hardest)
+
+    def export_items(self,
+                     user_id: int = 0,
+                     deck_id: int = 0,
+                     batch_size: int = 1000
+                     ) -> Iterator[Tuple[str, str, str, int, int]]:
+        return self.shard(user_id).export_items(user_id, deck_id,
+                                                batch_size)
+
+    def backup(self,
+               target: str,
+               pages: int = 256,
+               sleep: float = 0.01) -> None:
+        '''
+        Back up every shard, into the shard files of the target
+        '''
+
+        for shard, storage_manager in enumerate(self.shards):
+            storage_manager.backup(shard_path(target, shard), pages, sleep)
+
+    def close_connection(self) -> None:
+        '''
+        Close the connections of every shard
+        '''
+
+        for storage_manager in self.shards:
+            storage_manager.close_connection()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+'''
+Progress statistics of a deck
+'''
+
+from datetime import date
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Streak(NamedTuple):
+    ''' Consecutive days with answers, as stored by day ordinal '''
+    last_day: Optional[int]
+    current: int
+    best: int
+
+
+def extend_streak(streak: Streak,
+                  days: Iterable[int]) -> Streak:
+    '''
+    Add days with answers to a streak
+
+    Parameters:
+        - streak (Streak): Stored streak
+        - days (iterable): Ordinals (date.toordinal) of the answers
+
+    Returns:
+        - Streak: Updated streak
+    '''
+
+    last_day, current, best = streak
+    for day in sorted(set(days)):
+        if last_day is not None and day <= last_day:
+            continue
+        current = current + 1 if last_day == day - 1 else 1
+        best = max(best, current)
+        last_day = day
+    return Streak(last_day, current, best)
+
+
+class DeckStats(NamedTuple):
+    ''' Summary of the items and answers of a deck '''
+    items: int
+    correct: int
+    wrong: int
+    streak: Streak
+    # (answer, quiz, wrong answers, right answers) of the cards with
+    # most wrong answers over right ones
+    hardest: List[Tuple[str, str, int, int]]
+
+    @property
+    def accuracy(self) -> Optional[float]:
+        '''
+        Fraction of right answers. None without answers
+        '''
+
+        answers = self.correct + self.wrong
+        return self.correct / answers if answers else None
+
+    def current_streak(self,
+                       today: Optional[date] = None) -> int:
+        '''
+        Days in a row with answers, up to today. A streak is kept until
+        a full day without answers
+        '''
+
+        today = (today or date.today()).toordinal()
+        if self.streak.last_day is None or \
+                today - self.streak.last_day > 1:
+            return 0
+        return self.streak.current
+
+    def __str__(self) -> str:
+        lines = [f"Items: {self.items}"]
+        if self.accuracy is None:
+            lines.append("No answers yet")
+        else:
+            lines.append(f"Answers: {self.correct} right, {self.wrong} "
+                         f"wrong ({self.accuracy:.0%})")
+        lines.append(f"Streak: {self.current_streak()} days "
+                     f"(best {self.streak.best})")
+        if self.hardest:
+            lines.append("Hardest: " + ", ".join(
+                f"{answer} ({wrong}✗ {correct}✓)"
+                for answer, _, wrong, correct in self.hardest))
+        return "\n".join(lines)
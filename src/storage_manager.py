@@ -3,17 +3,136 @@
 StorageManager definition
 '''
 
-from datetime import datetime
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime
 import logging
+import os
+from pathlib import Path
+import queue
 import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from answer_index import AnswerIndex
+from fuzzy import FuzzyMatcher
+from metrics import Histogram, timed
+from migrations import (AddColumn, Backfill, CreateIndex, CreateTable,
+                        DropIndex, Migration, MigrationException, Migrator)
+from random_index import RandomIndex
+from review_writer import ReviewWriter
+import scheduler
+from stats import DeckStats, Streak, extend_streak
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+STORAGE_SECONDS = Histogram('flashcard_storage_seconds',
+                            'Duration of StorageManager operations',
+                            ['method'])
+
 DATE_FMT = '%Y/%m/%dT%H:%M:%S'
 
+# Supported pragmas: {name: allowed values or type}
+PRAGMAS = {
+    'journal_mode': ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'),
+    'synchronous': ('OFF', 'NORMAL', 'FULL', 'EXTRA'),
+    'cache_size': int,
+    'mmap_size': int,
+    'busy_timeout': int,
+}
+
+# Current time in seconds since the epoch, computed by SQLite
+NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+# Schema versions of the database. Append new versions, never edit the
+# released ones: a database at version N has the first N applied
+MIGRATIONS = [
+    Migration("Items and review schedule", [
+        CreateTable('items', '''id INTEGER PRIMARY KEY,
+                    inserted_date TEXT,
+                    answer TEXT,
+                    quiz TEXT,
+                    answer_correct_count INTEGER,
+                    answer_wrong_count INTEGER,
+                    item_type TEXT'''),
+        # Spaced repetition state of each item
+        CreateTable('schedule', '''item_id INTEGER PRIMARY KEY,
+                    due REAL,
+                    interval REAL,
+                    ease REAL,
+                    repetitions INTEGER'''),
+    ]),
+    # Items belong to a deck of a user. Old items go to the shared deck
+    Migration("Decks per user", [
+        AddColumn('items', 'user_id', 'INTEGER NOT NULL DEFAULT 0'),
+        AddColumn('items', 'deck_id', 'INTEGER NOT NULL DEFAULT 0'),
+        # The partition is copied from the item, so the review queue of
+        # a deck is read from a single index
+        AddColumn('schedule', 'user_id', 'INTEGER NOT NULL DEFAULT 0'),
+        AddColumn('schedule', 'deck_id', 'INTEGER NOT NULL DEFAULT 0'),
+        # Replaced by the partition indexes
+        DropIndex('idx_answer_unique'),
+        DropIndex('idx_schedule_due'),
+        # Answers are unique into a deck. The index also serves the
+        # answer checks and the load of a partition
+        CreateIndex('idx_items_partition_answer', 'items',
+                    'user_id, deck_id, answer', unique=True),
+        # The due index keeps the review queue of every deck sorted, so
+        # the next card is found in O(log n)
+        CreateIndex('idx_schedule_partition_due', 'schedule',
+                    'user_id, deck_id, due'),
+        # Items stored before the scheduler existed are due right now
+        Backfill("review schedule of the items", 'items', f'''
+                 INSERT INTO schedule (item_id, due, interval, ease,
+                 repetitions, user_id, deck_id)
+                 SELECT items.id, {NOW}, 0, {scheduler.INITIAL_EASE}, 0,
+                 items.user_id, items.deck_id FROM items
+                 LEFT JOIN schedule ON schedule.item_id = items.id
+                 WHERE items.id BETWEEN :start AND :end
+                 AND schedule.item_id IS NULL'''),
+    ]),
+    Migration("Deck statistics", [
+        # Cards with more wrong than right answers first, so the
+        # hardest ones of a deck are read from the index
+        CreateIndex('idx_items_hardest', 'items',
+                    'user_id, deck_id, '
+                    'answer_wrong_count - answer_correct_count'),
+        # Totals per deck, updated by every write, so statistics need
+        # no scan of the items
+        CreateTable('deck_stats', '''user_id INTEGER NOT NULL,
+                    deck_id INTEGER NOT NULL,
+                    items INTEGER NOT NULL DEFAULT 0,
+                    correct INTEGER NOT NULL DEFAULT 0,
+                    wrong INTEGER NOT NULL DEFAULT 0,
+                    last_day INTEGER,
+                    streak INTEGER NOT NULL DEFAULT 0,
+                    best_streak INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, deck_id)'''),
+        # Totals kept by the writes of databases already counting them
+        Backfill("totals of the decks", 'items', '''
+                 INSERT INTO deck_stats (user_id, deck_id, items, correct,
+                 wrong)
+                 SELECT user_id, deck_id, COUNT(*),
+                 IFNULL(SUM(answer_correct_count), 0),
+                 IFNULL(SUM(answer_wrong_count), 0) FROM items
+                 WHERE id BETWEEN :start AND :end
+                 GROUP BY user_id, deck_id
+                 ON CONFLICT (user_id, deck_id) DO UPDATE SET
+                 items = items + excluded.items,
+                 correct = correct + excluded.correct,
+                 wrong = wrong + excluded.wrong''',
+                 skip_if="SELECT EXISTS (SELECT 1 FROM deck_stats)"),
+    ]),
+    # Options of a deck. NULL values take the default of the bot
+    Migration("Deck settings", [
+        CreateTable('deck_settings', '''user_id INTEGER NOT NULL,
+                    deck_id INTEGER NOT NULL,
+                    max_distance INTEGER,
+                    PRIMARY KEY (user_id, deck_id)'''),
+    ]),
+]
+
 class StorageManagerException(Exception):
     '''
     Raised when there is a integrity error into database
@@ -23,39 +142,400 @@ class StorageManagerException(Exception):
         super().__init__(message)
 
 
+class Partition:
+    '''
+    In-memory indexes of the items of a user deck
+    '''
+    def __init__(self,
+                 items: Iterable[Tuple[int, str]],
+                 answer_index: Optional[str] = None,
+                 max_distance: Optional[int] = None) -> None:
+
+        items = list(items)
+
+        # Item IDs used for random selection
+        self.random_index = RandomIndex(item_id for item_id, _ in items)
+
+        # Answers used to check guesses
+        self.answer_index = None
+        if answer_index:
+            self.answer_index = AnswerIndex(
+                answer_index, (answer for _, answer in items))
+
+        # Typo tolerant matching of guesses. None keeps exact matching
+        self.matcher = None
+        if max_distance is not None:
+            self.matcher = FuzzyMatcher((answer for _, answer in items),
+                                        max_distance)
+
+    def discard(self,
+                item_id: int,
+                answer: str) -> None:
+        '''
+        Remove a deleted item
+        '''
+
+        self.random_index.discard(item_id)
+        if self.answer_index is not None:
+            self.answer_index.discard(answer)
+        if self.matcher is not None:
+            self.matcher.discard(answer)
+
+
 class StorageManager:
     '''
-    Class to manage all databases
+    Class to manage all databases.
+
+    Items belong to a deck of a user, i.e. a partition identified by
+    (user_id, deck_id). Answers are unique into a partition, and quizzes
+    are selected and guesses checked against the partition of the
+    player. The default partition (0, 0) is a deck shared by everyone.
     '''
     def __init__(self,
                  database: str = 'flashcard.db',
-                 timeout: int = 20) -> None:
+                 timeout: int = 20,
+                 flush_interval: float = 0,
+                 flush_size: int = 100,
+                 pragmas: Optional[dict] = None,
+                 read_connections: int = 0,
+                 answer_index: Optional[str] = None,
+                 max_distance: Optional[int] = None,
+                 max_partitions: int = 1024) -> None:
 
         # Store selected item
         self.item = ()
 
+        # Handlers run into a thread pool, so the writer connection is
+        # shared between threads and guarded by a lock
+        self.lock = threading.RLock()
+
+        # Guard of the in-memory indexes, which are also used by readers
+        self.index_lock = threading.Lock()
+
+        # {(user_id, deck_id): number of committed inserts and deletes}
+        self.generations: Dict[Tuple[int, int], int] = {}
+
         # Create table
         self.conn = sqlite3.connect(database=database,
-                                    timeout=timeout)
+                                    timeout=timeout,
+                                    check_same_thread=False)
+        self.pragmas = self._validate_pragmas(pragmas or {})
+        self._apply_pragmas(self.conn, self.pragmas)
         self.cursor = self.conn.cursor()
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS items
-                            (id INTEGER PRIMARY KEY,
-                            inserted_date TEXT,
-                            answer TEXT,
-                            quiz TEXT,
-                            answer_correct_count INTEGER,
-                            answer_wrong_count INTEGER,
-                            item_type TEXT)''')
-
-        # Add unique constraint to the answer column
-        self.cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS
-                            idx_answer_unique
-                            ON items (answer)''')
+        try:
+            Migrator(self.conn, MIGRATIONS).run()
+        except MigrationException as error:
+            self.conn.close()
+            raise StorageManagerException(str(error)) from error
+
+        # In-memory indexes of the recently used partitions, loaded on
+        # demand: {(user_id, deck_id): Partition}
+        self.answer_index_kind = answer_index
+        self.max_distance = max_distance
+        self.max_partitions = max_partitions
+        self.partitions: 'OrderedDict[Tuple[int, int], Partition]' = \
+            OrderedDict()
+
+        # The shared deck is loaded at startup, not by the first quiz
+        self._partition(0, 0)
+
+        # Pool of read-only connections, so queries do not wait for
+        # the writer. It requires WAL mode to read while writing
+        self.readers = None
+        if read_connections > 0 and database != ':memory:':
+            uri = f"{Path(database).resolve().as_uri()}?mode=ro"
+            self.readers = queue.Queue()
+            for _ in range(read_connections):
+                reader = sqlite3.connect(database=uri,
+                                         uri=True,
+                                         timeout=timeout,
+                                         check_same_thread=False)
+                self._apply_pragmas(reader, self.pragmas, read_only=True)
+                self.readers.put(reader)
+
+        # Answer results are written behind the replies when a flush
+        # interval is configured
+        self.writer = None
+        if flush_interval > 0:
+            self.writer = ReviewWriter(self.apply_reviews,
+                                       flush_interval=flush_interval,
+                                       flush_size=flush_size)
+
+    def _items(self,
+               user_id: int,
+               deck_id: int) -> List[Tuple[int, str]]:
+        '''
+        (id, answer) of the items of a partition
+        '''
+
+        with self.lock:
+            return self.conn.execute('''SELECT id, answer FROM items
+                                     WHERE user_id = ? AND deck_id = ?''',
+                                     (user_id, deck_id)).fetchall()
+
+    def _partition(self,
+                   user_id: int,
+                   deck_id: int) -> Partition:
+        '''
+        In-memory indexes of a partition, loaded on first use. The least
+        recently used partitions are dropped to bound the memory
+        '''
+
+        key = (user_id, deck_id)
+        with self.index_lock:
+            partition = self.partitions.get(key)
+            if partition is not None:
+                self.partitions.move_to_end(key)
+                return partition
+
+        # Writes update the loaded partitions holding the writer lock,
+        # so none of them is missed while loading
+        with self.lock:
+            partition = Partition(self._items(user_id, deck_id),
+                                  self.answer_index_kind,
+                                  self.deck_max_distance(user_id, deck_id))
+            with self.index_lock:
+                self.partitions[key] = partition
+                while len(self.partitions) > self.max_partitions:
+                    self.partitions.popitem(last=False)
+        logger.debug("Loaded partition %s with %s items",
+                     key, len(partition.random_index))
+        return partition
+
+    def deck_max_distance(self,
+                          user_id: int = 0,
+                          deck_id: int = 0) -> Optional[int]:
+        '''
+        Typos allowed into the guesses of a deck
+
+        Parameters:
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - int: Max. edit distance. None for exact matching
+        '''
+
+        with self.lock:
+            row = self.conn.execute('''SELECT max_distance FROM deck_settings
+                                    WHERE user_id = ? AND deck_id = ?''',
+                                    (user_id, deck_id)).fetchone()
+        if row is None or row[0] is None:
+            return self.max_distance
+        return row[0]
+
+    @timed(STORAGE_SECONDS, method="set_max_distance")
+    def set_max_distance(self,
+                         max_distance: Optional[int],
+                         user_id: int = 0,
+                         deck_id: int = 0) -> None:
+        '''
+        Set the typos allowed into the guesses of a deck
+
+        Parameters:
+            - max_distance (int): Max. edit distance. 0 only accepts
+                normalized matches. None restores the default
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+        '''
+
+        with self.lock:
+            with self._transaction() as cursor:
+                cursor.execute('''INSERT INTO deck_settings
+                               (user_id, deck_id, max_distance)
+                               VALUES (?, ?, ?)
+                               ON CONFLICT (user_id, deck_id)
+                               DO UPDATE SET
+                               max_distance = excluded.max_distance''',
+                               (user_id, deck_id, max_distance))
+            # Loaded again with the new matcher on next use
+            with self.index_lock:
+                self.partitions.pop((user_id, deck_id), None)
+        logger.info("Deck %s of user %s allows %s typos",
+                    deck_id, user_id, max_distance)
+
+    def _loaded_partition(self,
+                          user_id: int,
+                          deck_id: int) -> Optional[Partition]:
+        '''
+        Partition indexes, if loaded. Caller must hold the index lock
+        '''
+        return self.partitions.get((user_id, deck_id))
+
+    def _count_items(self,
+                     count: int,
+                     user_id: int,
+                     deck_id: int) -> None:
+        '''
+        Add new (or remove deleted) items to the deck totals into the
+        current transaction
+        '''
+
+        self.cursor.execute('''INSERT OR IGNORE INTO deck_stats
+                            (user_id, deck_id) VALUES (?, ?)''',
+                            (user_id, deck_id))
+        self.cursor.execute('''UPDATE deck_stats SET items = items + ?
+                            WHERE user_id = ? AND deck_id = ?''',
+                            (count, user_id, deck_id))
+
+    @property
+    def random_index(self) -> RandomIndex:
+        ''' Random selection index of the shared deck '''
+        return self._partition(0, 0).random_index
+
+    @property
+    def answer_index(self) -> Optional[AnswerIndex]:
+        ''' Answer index of the shared deck '''
+        return self._partition(0, 0).answer_index
+
+    @property
+    def matcher(self) -> Optional[FuzzyMatcher]:
+        ''' Fuzzy matcher of the shared deck '''
+        return self._partition(0, 0).matcher
+
+    def _index_items(self,
+                     items: List[Tuple[int, str]],
+                     user_id: int,
+                     deck_id: int) -> None:
+        '''
+        Keep the indexes of a loaded partition coherent with new items.
+        Caller must hold the writer lock
+        '''
+
+        with self.index_lock:
+            self._bump_generation(user_id, deck_id)
+            partition = self._loaded_partition(user_id, deck_id)
+            if partition is None:
+                return
+            for item_id, answer in items:
+                partition.random_index.add(item_id)
+                if partition.matcher is not None:
+                    partition.matcher.add(answer)
+                if partition.answer_index is not None:
+                    partition.answer_index.add(answer)
+            rebuild = partition.answer_index is not None and \
+                partition.answer_index.needs_rebuild
+
+        if rebuild:
+            answers = [answer for _, answer in self._items(user_id, deck_id)]
+            with self.index_lock:
+                partition.answer_index.rebuild(answers)
+
+    def _bump_generation(self,
+                         user_id: int,
+                         deck_id: int) -> None:
+        '''
+        Record a committed change of the items of a partition. Caller
+        must hold the index lock
+        '''
+
+        key = (user_id, deck_id)
+        self.generations[key] = self.generations.get(key, 0) + 1
+
+    def generation(self,
+                   user_id: int = 0,
+                   deck_id: int = 0) -> int:
+        '''
+        Version of the items of a deck, increased after every insert
+        and delete, so copies of the deck can tell they are outdated
+
+        Parameters:
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - int: Current version
+        '''
+        return self.generations.get((user_id, deck_id), 0)
+
+    @staticmethod
+    def _validate_pragmas(pragmas: dict) -> dict:
+        '''
+        Check pragma names and values, as they cannot be passed as
+        query parameters
+
+        Parameters:
+            - pragmas (dict): {pragma name: value}
+
+        Returns:
+            - dict: Validated pragmas
+        '''
+
+        validated = {}
+        for name, value in pragmas.items():
+            allowed = PRAGMAS.get(name)
+            if allowed is None:
+                raise StorageManagerException(f"Unsupported pragma {name}")
+
+            if allowed is int:
+                validated[name] = int(value)
+            elif str(value).upper() in allowed:
+                validated[name] = str(value).upper()
+            else:
+                raise StorageManagerException(
+                    f"Invalid {name} value {value}")
+        return validated
+
+    @staticmethod
+    def _apply_pragmas(conn: sqlite3.Connection,
+                       pragmas: dict,
+                       read_only: bool = False) -> None:
+        '''
+        Configure a connection
+
+        Parameters:
+            - conn (Connection): Target connection
+            - pragmas (dict): Validated pragmas
+            - read_only (bool): Skip the pragmas which modify the database
+        '''
+
+        for name, value in pragmas.items():
+            if read_only and name == 'journal_mode':
+                continue
+            conn.execute(f"PRAGMA {name} = {value}")
+
+    @contextmanager
+    def _reader(self):
+        '''
+        Borrow a connection to run read-only queries. The writer
+        connection is used if there is no pool
+        '''
+
+        if self.readers is None:
+            with self.lock:
+                yield self.conn
+            return
+
+        conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+
+    @contextmanager
+    def _transaction(self):
+        '''
+        Write into a single transaction of the writer connection. It is
+        rolled back on errors, so the next commit on the connection does
+        not write a part of it
+        '''
+
+        with self.lock:
+            try:
+                yield self.cursor
+                self.conn.commit()
+            except sqlite3.Error:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                raise
 
+    @timed(STORAGE_SECONDS, method="insert_item")
     def insert_item(self,
                     item_type: str,
                     answer: str,
-                    quiz: str) -> None:
+                    quiz: str,
+                    user_id: int = 0,
+                    deck_id: int = 0) -> None:
         '''
         Add a new item to the database
 
@@ -63,20 +543,36 @@ class StorageManager:
             - item_type (str): Type of item (text, photo, audio or video)
             - answer (str): Field that will be shown into a round
             - quiz (str): Field that must be to guessed into a round
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
         '''
         try:
             now = datetime.strftime(datetime.now(), DATE_FMT)
-            self.cursor.execute('''INSERT INTO items (
-                                    inserted_date,
-                                    answer,
-                                    quiz,
-                                    answer_correct_count,
-                                    answer_wrong_count,
-                                    item_type)
-                                    VALUES (?, ?, ?, ?, ?, ?)''',
-                                    (now, answer, quiz,
-                                    0, 0, item_type))
-            self.conn.commit()
+            with self.lock:
+                with self._transaction() as cursor:
+                    cursor.execute('''INSERT INTO items (
+                                   inserted_date,
+                                   answer,
+                                   quiz,
+                                   answer_correct_count,
+                                   answer_wrong_count,
+                                   item_type,
+                                   user_id,
+                                   deck_id)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                                   (now, answer, quiz,
+                                    0, 0, item_type,
+                                    user_id, deck_id))
+                    item_id = cursor.lastrowid
+                    cursor.execute('''INSERT INTO schedule (item_id,
+                                   due, interval, ease, repetitions,
+                                   user_id, deck_id)
+                                   VALUES (?, ?, 0, ?, 0, ?, ?)''',
+                                   (item_id, time.time(),
+                                    scheduler.INITIAL_EASE,
+                                    user_id, deck_id))
+                    self._count_items(1, user_id, deck_id)
+                self._index_items([(item_id, answer)], user_id, deck_id)
             logger.info("Successfully store new item %s: %s - %s",
                         item_type, answer, quiz)
         except sqlite3.IntegrityError as exception:
@@ -88,72 +584,666 @@ class StorageManager:
                 "Connection to DB is already closed"
             ) from exception
 
-    def _update_db_numeric_field(self,
-                                field: str,
-                                item_id: int) -> None:
+    @timed(STORAGE_SECONDS, method="insert_items")
+    def insert_items(self,
+                     items: Iterable[Tuple[str, str]],
+                     item_type: str = "text",
+                     batch_size: int = 1000,
+                     user_id: int = 0,
+                     deck_id: int = 0) -> Tuple[int, int]:
         '''
-        Update a numeric field into database
+        Add a stream of items to the database in batches. Each batch is
+        written with a single statement and transaction, and answers
+        already stored are skipped.
 
-        Parameters
-         - field (str): Numeric field to be incremented
-         - item_id (int): ID of item to be modified
+        Parameters:
+            - items (iterable): (answer, quiz) pairs
+            - item_type (str): Type of the items
+            - batch_size (int): Number of items per transaction
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - tuple: Number of inserted and duplicated items
         '''
 
-        query = f'''UPDATE items
-                    set {field} = {field} + 1
-                    WHERE id = {item_id}'''
-        self.cursor.execute(query)
-        self.conn.commit()
-        logger.info("Successfully updated %s", field)
+        inserted = 0
+        duplicates = 0
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) < batch_size:
+                continue
+            count = self._insert_batch(batch, item_type, user_id, deck_id)
+            inserted += count
+            duplicates += len(batch) - count
+            batch = []
 
-    def select_random_item(self) -> str:
+        if batch:
+            count = self._insert_batch(batch, item_type, user_id, deck_id)
+            inserted += count
+            duplicates += len(batch) - count
+
+        logger.info("Successfully store %s new items (%s duplicated)",
+                    inserted, duplicates)
+        return inserted, duplicates
+
+    def _insert_batch(self,
+                      batch: list,
+                      item_type: str,
+                      user_id: int,
+                      deck_id: int) -> int:
         '''
-        Extract a random item from database
+        Insert a batch of (answer, quiz) pairs into one transaction
 
         Returns:
-            - item: The quiz string of randomly selected item
+            - int: Number of inserted items
         '''
 
-        # Extract the length of the database
-        self.item = self.cursor.execute('''SELECT * FROM items
-                                  ORDER BY RANDOM() LIMIT 1''').fetchone()
-        self.conn.commit()
+        now = datetime.strftime(datetime.now(), DATE_FMT)
+        try:
+            with self.lock:
+                with self._transaction() as cursor:
+                    last_id = cursor.execute(
+                        'SELECT IFNULL(MAX(id), 0) FROM items').fetchone()[0]
+                    changes = self.conn.total_changes
+
+                    # Duplicated answers are skipped by
+                    # idx_items_partition_answer
+                    cursor.executemany('''INSERT OR IGNORE INTO items (
+                                       inserted_date,
+                                       answer,
+                                       quiz,
+                                       answer_correct_count,
+                                       answer_wrong_count,
+                                       item_type,
+                                       user_id,
+                                       deck_id)
+                                       VALUES (?, ?, ?, 0, 0, ?, ?, ?)''',
+                                       ((now, answer, quiz, item_type,
+                                         user_id, deck_id)
+                                        for answer, quiz in batch))
+                    inserted = self.conn.total_changes - changes
+
+                    # New rows get IDs greater than the previous maximum
+                    cursor.execute('''INSERT INTO schedule (item_id,
+                                   due, interval, ease, repetitions,
+                                   user_id, deck_id)
+                                   SELECT id, ?, 0, ?, 0, user_id, deck_id
+                                   FROM items WHERE id > ?''',
+                                   (time.time(), scheduler.INITIAL_EASE,
+                                    last_id))
+                    self._count_items(inserted, user_id, deck_id)
+
+                new_items = self.cursor.execute(
+                    'SELECT id, answer FROM items WHERE id > ?',
+                    (last_id,)).fetchall()
+                self._index_items(new_items, user_id, deck_id)
+        except sqlite3.ProgrammingError as exception:
+            raise StorageManagerException(
+                "Connection to DB is already closed"
+            ) from exception
+
+        logger.debug("Stored batch of %s items", inserted)
+        return inserted
+
+    @timed(STORAGE_SECONDS, method="delete_item")
+    def delete_item(self,
+                    answer: str,
+                    user_id: int = 0,
+                    deck_id: int = 0) -> bool:
+        '''
+        Remove an item from the database
+
+        Parameters:
+            - answer (str): Answer of the item to be removed
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - bool: True if the item existed. False otherwise
+        '''
 
-        if not self.item:
+        with self.lock:
+            row = self.cursor.execute('''SELECT id FROM items
+                                      WHERE user_id = ? AND deck_id = ?
+                                      AND answer = ?''',
+                                      (user_id, deck_id, answer)).fetchone()
+            if not row:
+                return False
+
+            with self._transaction() as cursor:
+                cursor.execute('DELETE FROM items WHERE id = ?', row)
+                cursor.execute('DELETE FROM schedule WHERE item_id = ?', row)
+                self._count_items(-1, user_id, deck_id)
+            with self.index_lock:
+                self._bump_generation(user_id, deck_id)
+                partition = self._loaded_partition(user_id, deck_id)
+                if partition is not None:
+                    partition.discard(row[0], answer)
+
+        logger.info("Successfully removed item %s", answer)
+        return True
+
+    @timed(STORAGE_SECONDS, method="select_random_row")
+    def select_random_row(self,
+                          user_id: int = 0,
+                          deck_id: int = 0) -> tuple:
+        '''
+        Extract a random item from database.
+
+        The item ID is sampled from the in-memory index, so the
+        selection costs a primary key lookup whatever the deck size.
+
+        Parameters:
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - tuple: Database row of randomly selected item
+        '''
+
+        random_index = self._partition(user_id, deck_id).random_index
+        with self._reader() as conn:
+            while True:
+                with self.index_lock:
+                    item_id = random_index.choice()
+                if item_id is None:
+                    raise StorageManagerException(
+                        "None item detected into database")
+
+                item = conn.execute('SELECT * FROM items WHERE id = ?',
+                                    (item_id,)).fetchone()
+                if item:
+                    break
+
+                # Item removed by another connection
+                with self.index_lock:
+                    random_index.discard(item_id)
+
+        logger.debug("Result: %s", item, extra={"event": "quiz"})
+        return item
+
+    @timed(STORAGE_SECONDS, method="select_random_rows")
+    def select_random_rows(self,
+                           count: int,
+                           user_id: int = 0,
+                           deck_id: int = 0) -> List[tuple]:
+        '''
+        Extract distinct random items with a single query
+
+        Parameters:
+            - count (int): Max. number of items
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - list: Database rows of the selected items
+        '''
+
+        random_index = self._partition(user_id, deck_id).random_index
+        with self.index_lock:
+            item_ids = random_index.sample(count)
+        if not item_ids:
+            raise StorageManagerException("None item detected into database")
+
+        placeholders = ', '.join('?' * len(item_ids))
+        with self._reader() as conn:
+            rows = {row[0]: row for row in conn.execute(
+                f'SELECT * FROM items WHERE id IN ({placeholders})',
+                item_ids)}
+
+        # Items removed by another connection are left out
+        missing = [item_id for item_id in item_ids if item_id not in rows]
+        if missing:
+            with self.index_lock:
+                for item_id in missing:
+                    random_index.discard(item_id)
+            if len(missing) == len(item_ids):
+                return self.select_random_rows(count, user_id, deck_id)
+
+        items = [rows[item_id] for item_id in item_ids if item_id in rows]
+        logger.debug("Result: %s", items, extra={"event": "quiz"})
+        return items
+
+    @timed(STORAGE_SECONDS, method="select_due_row")
+    def select_due_row(self,
+                       user_id: int = 0,
+                       deck_id: int = 0) -> tuple:
+        '''
+        Extract the item at the head of the review queue, i.e. the
+        most overdue one
+
+        Parameters:
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - tuple: Database row of the selected item
+        '''
+
+        # Items answered but not written yet are still at the head of
+        # the queue. Skip them to avoid asking the same card twice
+        item = self._due_items(1, user_id, deck_id)[0]
+        logger.debug("Result: %s", item, extra={"event": "quiz"})
+        return item
+
+    @timed(STORAGE_SECONDS, method="select_due_rows")
+    def select_due_rows(self,
+                        count: int,
+                        user_id: int = 0,
+                        deck_id: int = 0,
+                        exclude: Iterable[int] = ()) -> List[tuple]:
+        '''
+        Extract the items at the head of the review queue with a single
+        query, most overdue first
+
+        Parameters:
+            - count (int): Max. number of items
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+            - exclude (iterable): IDs of items to be skipped, such as
+                the quiz being answered
+
+        Returns:
+            - list: Database rows of the selected items
+        '''
+
+        items = self._due_items(count, user_id, deck_id, set(exclude))
+        logger.debug("Result: %s", items, extra={"event": "quiz"})
+        return items
+
+    def _due_items(self,
+                   count: int,
+                   user_id: int,
+                   deck_id: int,
+                   exclude: Optional[set] = None) -> List[tuple]:
+        '''
+        Head of the review queue, without the items being written
+        '''
+
+        # Items answered but not written yet are still at the head of
+        # the queue. Skip them to avoid asking the same card twice
+        exclude = exclude or set()
+        pending = self.writer.pending_ids() if self.writer else set()
+        items = self._queue_head(pending | exclude, user_id, deck_id, count)
+
+        # Small decks where every item is pending
+        if not items and pending:
+            self.writer.flush()
+            items = self._queue_head(exclude, user_id, deck_id, count)
+
+        if not items:
             raise StorageManagerException("None item detected into database")
-        logger.info("Result: %s", self.item)
+        return items
+
+    def _queue_head(self,
+                    exclude: set,
+                    user_id: int,
+                    deck_id: int,
+                    count: int = 1) -> List[tuple]:
+        '''
+        Extract the items with the lowest due timestamps of a partition
+
+        Parameters:
+            - exclude (set): IDs of items to be skipped
+            - user_id (int): Owner of the deck
+            - deck_id (int): Deck of the user
+            - count (int): Max. number of items
+        '''
+
+        placeholders = ', '.join('?' * len(exclude))
+        with self._reader() as conn:
+            return conn.execute(f'''SELECT items.* FROM schedule
+                                JOIN items ON items.id = schedule.item_id
+                                WHERE schedule.user_id = ?
+                                AND schedule.deck_id = ?
+                                AND schedule.item_id NOT IN ({placeholders})
+                                ORDER BY schedule.due
+                                LIMIT ?''',
+                                (user_id, deck_id, *exclude,
+                                 count)).fetchall()
+
+    @timed(STORAGE_SECONDS, method="apply_reviews")
+    def apply_reviews(self,
+                      reviews: Dict[int, List[Tuple[bool, float]]]) -> None:
+        '''
+        Update answer counters and review schedule of a group of items
+        into a single transaction
+
+        Parameters:
+            - reviews (dict): {item_id: [(correct, timestamp), ...]}
+        '''
+
+        counters = []
+        schedules = []
+        # {(user_id, deck_id): [right answers, wrong answers, days]}
+        decks: Dict[Tuple[int, int], list] = {}
+        with self._transaction():
+            for item_id, results in reviews.items():
+                correct = sum(1 for result, _ in results if result)
+                counters.append((correct, len(results) - correct, item_id))
+
+                row = self.cursor.execute('''SELECT interval, ease,
+                                          repetitions, user_id, deck_id
+                                          FROM schedule
+                                          WHERE item_id = ?''',
+                                          (item_id,)).fetchone()
+                if not row:
+                    continue
+                *row, user_id, deck_id = row
+
+                totals = decks.setdefault((user_id, deck_id), [0, 0, set()])
+                totals[0] += correct
+                totals[1] += len(results) - correct
+                totals[2].update(date.fromtimestamp(timestamp).toordinal()
+                                 for _, timestamp in results)
+
+                # Apply the answers in order to get the next review
+                due = None
+                for result, timestamp in results:
+                    due, *row = scheduler.review(row, result, timestamp)
+                schedules.append((due, *row, item_id))
+
+            self.cursor.executemany('''UPDATE items
+                                    SET answer_correct_count =
+                                        answer_correct_count + ?,
+                                    answer_wrong_count =
+                                        answer_wrong_count + ?
+                                    WHERE id = ?''', counters)
+            self.cursor.executemany('''UPDATE schedule
+                                    SET due = ?, interval = ?, ease = ?,
+                                    repetitions = ?
+                                    WHERE item_id = ?''', schedules)
+            for (user_id, deck_id), (correct, wrong, days) in decks.items():
+                self._count_answers(user_id, deck_id, correct, wrong, days)
+        logger.debug("Successfully updated %s items", len(counters))
+
+    def _count_answers(self,
+                       user_id: int,
+                       deck_id: int,
+                       correct: int,
+                       wrong: int,
+                       days: Iterable[int]) -> None:
+        '''
+        Add answers to the deck totals and streak into the current
+        transaction
+        '''
+
+        self.cursor.execute('''INSERT OR IGNORE INTO deck_stats
+                            (user_id, deck_id) VALUES (?, ?)''',
+                            (user_id, deck_id))
+        streak = extend_streak(Streak(*self.cursor.execute(
+            '''SELECT last_day, streak, best_streak FROM deck_stats
+            WHERE user_id = ? AND deck_id = ?''',
+            (user_id, deck_id)).fetchone()), days)
+        self.cursor.execute('''UPDATE deck_stats
+                            SET correct = correct + ?, wrong = wrong + ?,
+                            last_day = ?, streak = ?, best_streak = ?
+                            WHERE user_id = ? AND deck_id = ?''',
+                            (correct, wrong, *streak, user_id, deck_id))
+
+    @timed(STORAGE_SECONDS, method="stats")
+    def stats(self,
+              user_id: int = 0,
+              deck_id: int = 0,
+              hardest: int = 3) -> DeckStats:
+        '''
+        Statistics of a deck, read from the summary table and indexes
+        whatever the deck size
+
+        Parameters:
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+            - hardest (int): Number of hardest cards
+
+        Returns:
+            - DeckStats: Totals, accuracy, streak and hardest cards
+        '''
+
+        # Include the answers waiting to be written
+        if self.writer:
+            self.writer.flush()
+
+        with self._reader() as conn:
+            row = conn.execute('''SELECT items, correct, wrong, last_day,
+                               streak, best_streak FROM deck_stats
+                               WHERE user_id = ? AND deck_id = ?''',
+                               (user_id, deck_id)).fetchone()
+            cards = conn.execute('''SELECT answer, quiz, answer_wrong_count,
+                                 answer_correct_count FROM items
+                                 WHERE user_id = ? AND deck_id = ?
+                                 AND answer_wrong_count -
+                                     answer_correct_count > 0
+                                 ORDER BY answer_wrong_count -
+                                     answer_correct_count DESC
+                                 LIMIT ?''',
+                                 (user_id, deck_id, hardest)).fetchall()
+
+        if not row:
+            return DeckStats(0, 0, 0, Streak(None, 0, 0), [])
+        return DeckStats(row[0], row[1], row[2], Streak(*row[3:]), cards)
+
+    def export_items(self,
+                     user_id: int = 0,
+                     deck_id: int = 0,
+                     batch_size: int = 1000
+                     ) -> Iterator[Tuple[str, str, str, int, int]]:
+        '''
+        Stream the items of a deck sorted by answer. Only a batch of
+        rows is kept in memory, and no connection is held between
+        batches, so handlers are not blocked by slow consumers
+
+        Parameters:
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+            - batch_size (int): Rows read per query
+
+        Returns:
+            - iterator: (item_type, answer, quiz, right answers, wrong
+                answers) of every item
+        '''
+
+        query = '''SELECT item_type, answer, quiz, answer_correct_count,
+                answer_wrong_count FROM items
+                WHERE user_id = ? AND deck_id = ? {}
+                ORDER BY answer LIMIT ?'''
+        params: tuple = (user_id, deck_id)
+        while True:
+            # Keyset pagination over the partition index: every batch
+            # starts where the previous one ended
+            with self._reader() as conn:
+                rows = conn.execute(
+                    query.format("AND answer > ?" if len(params) > 2
+                                 else ""),
+                    (*params, batch_size)).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            params = (user_id, deck_id, rows[-1][1])
+
+    @timed(STORAGE_SECONDS, method="backup")
+    def backup(self,
+               target: str,
+               pages: int = 256,
+               sleep: float = 0.01) -> None:
+        '''
+        Copy the database into another file while it is in use. The
+        copy is done in steps of a few pages holding the writer lock, so
+        no step copies a transaction in progress, and writers take the
+        lock between steps. Writes done meanwhile go into the copy too,
+        as they use the same connection. The target file is replaced
+        once the copy is complete, so it is never left half written
+
+        Parameters:
+            - target (str): Path of the copy
+            - pages (int): Pages copied per step
+            - sleep (float): Seconds between steps
+        '''
+
+        # Include the answers waiting to be written
+        if self.writer:
+            self.writer.flush()
+
+        partial = f"{target}.partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        def step(status, remaining, total):
+            self.lock.release()
+            try:
+                time.sleep(sleep)
+            finally:
+                self.lock.acquire()
+
+        destination = sqlite3.connect(partial)
+        try:
+            with self.lock:
+                self.conn.backup(destination, pages=pages, progress=step,
+                                 sleep=sleep)
+        except sqlite3.Error as error:
+            raise StorageManagerException(f"Backup failed: {error}") \
+                from error
+        finally:
+            destination.close()
+        os.replace(partial, target)
+
+    @timed(STORAGE_SECONDS, method="select_random_item")
+    def select_random_item(self,
+                           user_id: int = 0,
+                           deck_id: int = 0) -> tuple:
+        '''
+        Extract a random item from database and keep it as the
+        current quiz item
+
+        Parameters:
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - item: The quiz string and type of randomly selected item
+        '''
+
+        self.item = self.select_random_row(user_id, deck_id)
 
         quiz = self.item[3]
         item_type = self.item[6]
         return quiz, item_type
 
+    @timed(STORAGE_SECONDS, method="check_quiz_item")
     def check_quiz_item(self,
-                        attempt: str) -> bool:
+                        attempt: str,
+                        item_id: Optional[int] = None,
+                        user_id: int = 0,
+                        deck_id: int = 0) -> bool:
         '''
-        Check if attempt string is into database
+        Check if attempt string is into database. Typos are only
+        tolerated against the answer of the quiz item
 
         Parameters
             - attempt (str): String to check into database
+            - item_id (int): ID of the quiz item whose counters are
+                updated. Current item by default
+            - user_id (int): Owner of the deck whose answers are
+                accepted. 0 for the shared deck
+            - deck_id (int): Deck of the user
 
         Returns
             -  bool: True is attempt string is into database. False otherwise
         '''
 
-        query = '''SELECT EXISTS(SELECT 1 FROM items WHERE answer = ?)'''
-        is_matched = self.cursor.execute(query, (attempt,)).fetchone()[0]
+        partition = self._partition(user_id, deck_id)
+
+        # Answers known to be missing by the index need no query
+        is_matched = None
+        if partition.answer_index is not None:
+            with self.index_lock:
+                is_matched = partition.answer_index.lookup(attempt)
+
+        if is_matched is None:
+            query = '''SELECT EXISTS(SELECT 1 FROM items WHERE user_id = ?
+                    AND deck_id = ? AND answer = ?)'''
+            with self._reader() as conn:
+                is_matched = conn.execute(
+                    query, (user_id, deck_id, attempt)).fetchone()[0]
 
-        # Update attempt counters
-        field = "answer_wrong_count"
-        if is_matched:
-            field = "answer_correct_count"
-        self._update_db_numeric_field(field, self.item[0])
+        if item_id is None:
+            item_id = self.item[0]
+
+        # Accept guesses with different case, accents or small typos of
+        # the answer of the quiz item only
+        if not is_matched and partition.matcher is not None:
+            with self._reader() as conn:
+                row = conn.execute('''SELECT answer FROM items WHERE id = ?
+                                   AND user_id = ? AND deck_id = ?''',
+                                   (item_id, user_id, deck_id)).fetchone()
+            is_matched = row is not None and self.match_answer(
+                attempt, row[0], user_id, deck_id)
+
+        # Update attempt counters and schedule
+        if self.writer:
+            self.writer.record(item_id, bool(is_matched))
+        else:
+            self.apply_reviews({item_id: [(bool(is_matched), time.time())]})
 
         return is_matched
 
+    def match_answer(self,
+                     attempt: str,
+                     answer: str,
+                     user_id: int = 0,
+                     deck_id: int = 0) -> bool:
+        '''
+        Check a guess against the answer of a known item, with the
+        matching rules of the deck and without queries
+
+        Parameters:
+            - attempt (str): User guess
+            - answer (str): Answer of the quiz item
+            - user_id (int): Owner of the deck. 0 for the shared deck
+            - deck_id (int): Deck of the user
+
+        Returns:
+            - bool: True if the guess is right
+        '''
+
+        if attempt == answer:
+            return True
+        matcher = self._partition(user_id, deck_id).matcher
+        return matcher is not None and matcher.matches(attempt, answer)
+
+    def record_reviews(self,
+                       reviews: Dict[int, List[Tuple[bool, float]]],
+                       user_id: int = 0,
+                       deck_id: int = 0) -> None:
+        '''
+        Update the counters and schedule of several answered items into
+        a single transaction
+
+        Parameters:
+            - reviews (dict): {item_id: [(correct, timestamp), ...]}
+            - user_id (int): Owner of the items. 0 for the shared deck
+            - deck_id (int): Deck of the user
+        '''
+
+        if self.writer:
+            self.writer.record_many(reviews)
+        else:
+            self.apply_reviews(reviews)
+
     def close_connection(self):
         '''
         Close connection to database
         '''
 
-        self.cursor.close()
-        self.conn.close()
+        # Write pending reviews before closing
+        if self.writer:
+            self.writer.close()
+
+        # Readers are closed first: the WAL file is checkpointed and
+        # removed by the last (writer) connection
+        while self.readers is not None and not self.readers.empty():
+            self.readers.get().close()
+
+        with self.lock:
+            self.cursor.close()
+            self.conn.close()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+'''
+Multi-process mode: one process polls the updates and routes them to
+worker processes by chat, each one owning a shard of the storage
+'''
+
+import copy
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from typing import List, Optional
+
+from bot_api import BotAPIException, parse_update
+from metrics import Counter
+from sharding import shard_path
+
+logger = logging.getLogger(__name__)
+
+ROUTED_UPDATES = Counter('flashcard_supervisor_updates_total',
+                         'Updates routed to the worker processes',
+                         ['worker'])
+WORKER_RESTARTS = Counter('flashcard_supervisor_restarts_total',
+                          'Worker processes restarted',
+                          ['reason'])
+DROPPED_UPDATES = Counter('flashcard_supervisor_dropped_updates_total',
+                          'Updates dropped because their worker queue '
+                          'was full',
+                          ['worker'])
+
+# Seconds between health checks of the workers
+CHECK_INTERVAL = 1.0
+
+
+def worker_index(chat_id: int,
+                 workers: int) -> int:
+    '''
+    Worker owning a chat. Same routing as ShardedStorage, so the shard
+    files can be used in both modes
+    '''
+    return chat_id % workers
+
+
+def beat(pool,
+         heartbeat) -> None:
+    '''
+    Refresh the heartbeat of a worker from the progress of its handlers:
+    the current time while they are idle, or the start time of the
+    oldest message being handled. A handler stuck on a message lets the
+    heartbeat age, even though the worker process keeps running
+    '''
+
+    since = pool.busy_since()
+    heartbeat.value = time.time() if since is None else since
+
+
+def forward_updates(updates: multiprocessing.Queue,
+                    pool,
+                    heartbeat) -> None:
+    '''
+    Move the routed updates into the handler pool of a worker until the
+    stop sentinel, beating while waiting for updates and for room in a
+    busy pool
+
+    Parameters:
+        - updates (Queue): (chat_id, message) routed to this worker
+        - pool (WorkerPool): Handlers of the worker
+        - heartbeat (Value): Progress timestamp of the handlers
+    '''
+
+    while True:
+        beat(pool, heartbeat)
+        try:
+            item = updates.get(timeout=CHECK_INTERVAL)
+        except queue.Empty:
+            continue
+        if item is None:
+            return
+
+        chat_id, message = item
+        while not pool.submit(chat_id, message):
+            beat(pool, heartbeat)
+            time.sleep(0.01)
+
+
+def run_worker(config: dict,
+               updates: multiprocessing.Queue,
+               heartbeat) -> None:  # pragma: no cover
+    '''
+    Entry point of a worker process: handle the routed messages with
+    a FlashCardBot until the stop sentinel
+
+    Parameters:
+        - config (dict): Configuration of the worker
+        - updates (Queue): (chat_id, message) routed to this worker
+        - heartbeat (Value): Timestamp refreshed while the handlers of
+            the worker make progress
+    '''
+
+    # Interrupts are handled by the supervisor, which stops the
+    # workers once the updates already routed are handled
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from flashcard import FlashCardBot
+    from log_config import setup_logging
+    from webhook import WorkerPool
+
+    setup_logging(config.get('Logging'))
+    bot = FlashCardBot(config)
+    bot.start_backups()
+    pool = WorkerPool(bot.handle_message,
+                      workers=config['FlashCardBot'].get('Workers', 4),
+                      queue_size=100)
+    try:
+        forward_updates(updates, pool, heartbeat)
+    finally:
+        pool.close()
+        bot.close()
+
+
+class Supervisor:
+    '''
+    Poll the Bot API from this process and handle the messages into
+    worker processes, to use several cores.
+
+    Updates are routed by chat, so the messages of a chat are handled
+    in order by the same worker, which owns the storage shard and the
+    sessions of the chat. Dead workers, or workers whose heartbeat is
+    older than `heartbeat_timeout` because their process stopped
+    responding or a handler is stuck on a message, are restarted. The
+    queued updates of a restarted worker are kept for the new process.
+    Updates routed to a full queue are dropped, so a stuck worker never
+    blocks the polling of the others.
+    '''
+    def __init__(self,
+                 config: dict,
+                 api,
+                 workers: int = 2,
+                 heartbeat_timeout: float = 30,
+                 queue_size: int = 1000,
+                 poll_timeout: int = 30,
+                 retry_delay: float = 1) -> None:
+
+        self.config = config
+        self.api = api
+        self.heartbeat_timeout = heartbeat_timeout
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.offset: Optional[int] = None
+
+        # Spawned workers do not inherit the threads and locks of this
+        # process
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [self.context.Queue(maxsize=queue_size)
+                       for _ in range(workers)]
+        self.heartbeats = [self.context.Value('d', 0.0, lock=False)
+                           for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = \
+            [None] * workers
+
+        self._running = False
+        self._monitor = threading.Thread(target=self._watch,
+                                         name="supervisor",
+                                         daemon=True)
+
+    def worker_config(self,
+                      index: int) -> dict:
+        '''
+        Configuration of a worker: its own database shard and a share
+        of the global rate limit
+        '''
+
+        config = copy.deepcopy(self.config)
+        bot_config = config['FlashCardBot']
+        bot_config['Database'] = shard_path(bot_config['Database'], index)
+        backup = bot_config.get('Backup')
+        if backup and backup.get('Path'):
+            backup['Path'] = shard_path(backup['Path'], index)
+        bot_config.setdefault('Storage', {})['Shards'] = 1
+        outbound = bot_config.setdefault('Outbound', {})
+        outbound['GlobalRate'] = outbound.get('GlobalRate', 30) / \
+            len(self.queues)
+        return config
+
+    def start_worker(self,
+                     index: int) -> None:
+        '''
+        Start, or start again, a worker process
+        '''
+
+        # The startup is given a full heartbeat period
+        self.heartbeats[index].value = time.time()
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.worker_config(index), self.queues[index],
+                  self.heartbeats[index]),
+            name=f"worker-{index}")
+        process.start()
+        self.processes[index] = process
+        logger.info("Started worker %s (pid %s)", index, process.pid)
+
+    def check_workers(self) -> None:
+        '''
+        Restart the dead and stuck workers
+        '''
+
+        now = time.time()
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                reason = "exited"
+                logger.error("Worker %s exited with status %s",
+                             index, process.exitcode)
+            elif now - self.heartbeats[index].value > self.heartbeat_timeout:
+                reason = "stuck"
+                logger.error("Worker %s is not responding. Killing it",
+                             index)
+                process.kill()
+            else:
+                continue
+
+            process.join()
+            WORKER_RESTARTS.inc(reason=reason)
+            if self._running:
+                self.start_worker(index)
+
+    def _watch(self) -> None:
+        while self._running:
+            time.sleep(CHECK_INTERVAL)
+            if self._running:
+                self.check_workers()
+
+    def dispatch(self,
+                 chat_id: int,
+                 message: dict) -> bool:
+        '''
+        Route a message to the worker of its chat
+
+        Returns:
+            - bool: False if the worker queue is full and the message
+                was dropped
+        '''
+
+        index = worker_index(chat_id, len(self.queues))
+        try:
+            self.queues[index].put_nowait((chat_id, message))
+        except queue.Full:
+            logger.error("Worker %s is saturated. Dropping a message "
+                         "from chat %s", index, chat_id)
+            DROPPED_UPDATES.inc(worker=str(index))
+            return False
+        ROUTED_UPDATES.inc(worker=str(index))
+        return True
+
+    def poll_once(self) -> None:
+        '''
+        Fetch a batch of updates and route them
+        '''
+
+        updates = self.api.get_updates(self.offset, self.poll_timeout)
+        for update in updates:
+            self.offset = update["update_id"] + 1
+            chat_id, message = parse_update(update)
+            if chat_id is None or message is None:
+                continue
+            self.dispatch(chat_id, message)
+
+    def run(self) -> None:
+        '''
+        Start the workers and poll until interrupted
+        '''
+
+        self._running = True
+        for index in range(len(self.processes)):
+            self.start_worker(index)
+        self._monitor.start()
+
+        try:
+            while self._running:
+                try:
+                    self.poll_once()
+                except BotAPIException as error:
+                    logger.error("Polling error: %s", error)
+                    time.sleep(error.retry_after or self.retry_delay)
+        finally:
+            self.stop()
+
+    def stop(self,
+             timeout: float = 30) -> None:
+        '''
+        Let the workers handle the routed updates and stop them
+        '''
+
+        self._running = False
+        if self._monitor.is_alive():
+            self._monitor.join()
+        for pending in self.queues:
+            try:
+                pending.put(None, timeout=CHECK_INTERVAL)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.error("Killing worker %s", process.name)
+                process.kill()
+                process.join()
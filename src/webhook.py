@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+'''
+Webhook receiver, alternative to the polling engine
+'''
+
+from collections import OrderedDict
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from bot_api import parse_update
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+PENDING_UPDATES = Gauge('flashcard_webhook_pending_updates',
+                        'Updates received and not handled yet')
+REJECTED_UPDATES = Counter('flashcard_webhook_rejected_updates_total',
+                           'Updates rejected by the webhook',
+                           ['reason'])
+
+# Header sent by Telegram with the secret token set by setWebhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Telegram updates are a few KiB. Larger bodies are not updates
+MAX_BODY_SIZE = 1024 * 1024
+
+# Seconds Telegram is asked to wait before retrying a rejected update
+RETRY_AFTER = 1
+
+
+class WorkerPool:
+    '''
+    Fixed set of threads with a bounded queue each.
+
+    Updates are routed by chat, so the messages of a chat are handled
+    in arrival order by the same worker, while different chats are
+    handled in parallel. A full queue rejects new updates instead of
+    buffering them without limit.
+    '''
+    def __init__(self,
+                 handler: Callable[[dict, int], object],
+                 workers: int = 4,
+                 queue_size: int = 100) -> None:
+
+        self.handler = handler
+        self.queues: List[queue.Queue] = [queue.Queue(maxsize=queue_size)
+                                          for _ in range(workers)]
+        # Start time of the message handled by every worker, None if idle
+        self.started: List[Optional[float]] = [None] * workers
+        self.threads = [threading.Thread(target=self._run,
+                                         args=(i, pending),
+                                         name=f"webhook-worker-{i}",
+                                         daemon=True)
+                        for i, pending in enumerate(self.queues)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self,
+               chat_id: int,
+               message: dict) -> bool:
+        '''
+        Queue a message into the worker of its chat
+
+        Returns:
+            - bool: False if the worker queue is full
+        '''
+
+        pending = self.queues[hash(chat_id) % len(self.queues)]
+        try:
+            pending.put_nowait((chat_id, message))
+        except queue.Full:
+            return False
+        PENDING_UPDATES.inc()
+        return True
+
+    def busy_since(self) -> Optional[float]:
+        '''
+        Start time of the oldest message being handled
+
+        Returns:
+            - float: Timestamp, or None if every worker is idle
+        '''
+
+        running = [started for started in self.started
+                   if started is not None]
+        return min(running) if running else None
+
+    def _run(self,
+             index: int,
+             pending: queue.Queue) -> None:
+        '''
+        Handle the messages of a queue until the stop sentinel
+        '''
+
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            chat_id, message = item
+            self.started[index] = time.time()
+            try:
+                self.handler(message, chat_id)
+            except Exception:
+                logger.exception("Error handling message from chat %s",
+                                 chat_id)
+            finally:
+                self.started[index] = None
+                PENDING_UPDATES.dec()
+
+    def close(self) -> None:
+        '''
+        Handle the queued messages and stop the workers
+        '''
+
+        for pending in self.queues:
+            pending.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class WebhookServer:
+    '''
+    HTTP server receiving the updates pushed by Telegram.
+
+    Telegram only delivers webhooks over HTTPS, so the server is meant
+    to run behind a TLS terminating reverse proxy. Updates are
+    acknowledged as soon as they are queued; when the workers are
+    saturated the server answers 503 and Telegram retries the delivery
+    later.
+    '''
+    def __init__(self,
+                 handler: Callable[[dict, int], object],
+                 api,
+                 url: str,
+                 host: str = "0.0.0.0",
+                 port: int = 8443,
+                 path: str = "/webhook",
+                 secret_token: str = "",
+                 workers: int = 4,
+                 queue_size: int = 100,
+                 max_connections: int = 40) -> None:
+
+        self.api = api
+        self.url = url
+        self.path = path
+        self.secret_token = secret_token
+        self.max_connections = max_connections
+        self.pool = WorkerPool(handler, workers, queue_size)
+
+        # Telegram may deliver an update again if the answer to the
+        # first delivery is lost
+        self.recent: OrderedDict = OrderedDict()
+        self.recent_size = 10 * workers * queue_size
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        '''
+        Listening port, useful when binding to port 0
+        '''
+        return self.server.server_address[1]
+
+    def authorized(self,
+                   token: Optional[str]) -> bool:
+        '''
+        Check the secret token header of a request
+
+        Parameters:
+            - token (str): Secret token header of the request
+
+        Returns:
+            - bool: False if the token is wrong or missing
+        '''
+
+        if self.secret_token and not hmac.compare_digest(
+                (token or "").encode(), self.secret_token.encode()):
+            REJECTED_UPDATES.inc(reason="token")
+            return False
+        return True
+
+    def receive(self,
+                body: bytes,
+                token: Optional[str]) -> int:
+        '''
+        Validate and queue an incoming update
+
+        Parameters:
+            - body (bytes): JSON encoded Telegram update
+            - token (str): Secret token header of the request
+
+        Returns:
+            - int: HTTP status code of the response
+        '''
+
+        if not self.authorized(token):
+            return 403
+
+        try:
+            update = json.loads(body)
+            update_id = update["update_id"]
+            chat_id, message = parse_update(update)
+        except (ValueError, TypeError, KeyError):
+            REJECTED_UPDATES.inc(reason="malformed")
+            return 400
+
+        if chat_id is None or message is None:
+            logger.debug("Skipping update %s", update_id)
+            return 200
+
+        with self.lock:
+            if update_id in self.recent:
+                logger.debug("Skipping duplicated update %s", update_id)
+                return 200
+            self.recent[update_id] = None
+            if len(self.recent) > self.recent_size:
+                self.recent.popitem(last=False)
+
+        if not self.pool.submit(chat_id, message):
+            # Telegram will deliver it again
+            with self.lock:
+                self.recent.pop(update_id, None)
+            REJECTED_UPDATES.inc(reason="busy")
+            return 503
+        return 200
+
+    def _handler(self):
+        '''
+        Request handler class bound to this server
+        '''
+
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                # Every update would be logged otherwise
+                pass
+
+            def _respond(self, status):
+                self.send_response(status)
+                if status == 503:
+                    self.send_header("Retry-After", str(RETRY_AFTER))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path.split('?')[0] != webhook.path:
+                    self._respond(404)
+                    return
+
+                # Checked before reading any byte of the body
+                token = self.headers.get(SECRET_HEADER)
+                if not webhook.authorized(token):
+                    self._respond(403)
+                    return
+
+                length = self.headers.get("Content-Length")
+                if length is None:
+                    REJECTED_UPDATES.inc(reason="length")
+                    self._respond(411)
+                    return
+                try:
+                    length = int(length)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    REJECTED_UPDATES.inc(reason="length")
+                    self._respond(400)
+                    return
+                if length > MAX_BODY_SIZE:
+                    REJECTED_UPDATES.inc(reason="size")
+                    self._respond(413)
+                    return
+
+                self._respond(webhook.receive(self.rfile.read(length),
+                                              token))
+
+        return Handler
+
+    def register(self) -> None:
+        '''
+        Ask Telegram to push the updates to this server
+        '''
+
+        params = {"url": self.url,
+                  "max_connections": self.max_connections,
+                  "allowed_updates": ["message", "edited_message"]}
+        if self.secret_token:
+            params["secret_token"] = self.secret_token
+        self.api.call("setWebhook", **params)
+        logger.info("Webhook registered on %s", self.url)
+
+    def run(self) -> None:
+        '''
+        Register the webhook and serve requests until stop() is called
+        '''
+
+        self.register()
+        logger.info("Listening for updates on port %s", self.port)
+        try:
+            self.server.serve_forever()
+        finally:
+            # Handle the queued updates before leaving
+            self.server.server_close()
+            self.pool.close()
+
+    def stop(self) -> None:
+        '''
+        Stop serving requests. Must be called from another thread
+        '''
+        self.server.shutdown()
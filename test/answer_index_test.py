@@ -0,0 +1,56 @@
+import pytest
+
+from answer_index import AnswerIndex, BloomFilter
+
+
+def test_bloom_filter_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"answer{i}")
+    assert all(f"answer{i}" in bloom for i in range(1000))
+
+def test_bloom_filter_error_rate():
+    '''
+    False positives stay close to the configured error rate
+    '''
+
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"answer{i}")
+    false_positives = sum(f"miss{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+def test_set_index():
+    index = AnswerIndex("set", ["Cat", "Dog"])
+    assert index.lookup("Cat")
+    assert index.lookup("Bird") is False
+
+    index.add("Bird")
+    index.discard("Cat")
+    assert index.lookup("Bird")
+    assert index.lookup("Cat") is False
+
+def test_bloom_index():
+    '''
+    Bloom index hits must be confirmed (None), misses are exact
+    '''
+
+    index = AnswerIndex("bloom", ["Cat", "Dog"])
+    assert index.lookup("Cat") is None
+    assert index.lookup("Bird") is False
+    assert index.memory_usage() < AnswerIndex(
+        "set", (f"answer{i}" for i in range(1000))).memory_usage()
+
+def test_bloom_index_rebuild():
+    index = AnswerIndex("bloom")
+    for i in range(index.bloom.capacity + 1):
+        index.add(f"answer{i}")
+    assert index.needs_rebuild
+
+    index.rebuild(f"answer{i}" for i in range(2000))
+    assert not index.needs_rebuild
+    assert index.bloom.capacity == 4000
+
+def test_invalid_kind():
+    with pytest.raises(ValueError):
+        AnswerIndex("trie")
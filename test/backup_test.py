@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import os
+import sqlite3
+
+from backup import BACKUPS, BackupScheduler
+from sharding import ShardedStorage
+from storage_manager import StorageManager
+
+def test_run_once(tmp_path):
+    '''
+    Backups are complete copies, written into new directories
+    '''
+
+    storage_manager = StorageManager(database=str(tmp_path / "bot.db"))
+    storage_manager.insert_items([(f"answer{i}", f"quiz{i}")
+                                  for i in range(500)])
+    path = str(tmp_path / "backup" / "bot.db")
+
+    done = BACKUPS.value(result="done")
+    assert BackupScheduler(storage_manager, path, pages=1).run_once()
+    assert BACKUPS.value(result="done") == done + 1
+    assert not os.path.exists(f"{path}.partial")
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM items").fetchone() == (500,)
+    conn.close()
+    storage_manager.close_connection()
+
+def test_run_once_error(tmp_path):
+    '''
+    Failed backups are counted and reported, not raised
+    '''
+
+    storage_manager = StorageManager(database=":memory:")
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+
+    errors = BACKUPS.value(result="error")
+    scheduler = BackupScheduler(storage_manager, str(blocker / "bot.db"))
+    assert not scheduler.run_once()
+    assert BACKUPS.value(result="error") == errors + 1
+
+def test_sharded_backup(tmp_path):
+    '''
+    Every shard is backed up into its own file
+    '''
+
+    storage = ShardedStorage(str(tmp_path / "bot.db"), 2)
+    storage.insert_item("text", "Cat", "Gato", user_id=1)
+    storage.backup(str(tmp_path / "copy.db"))
+
+    for shard, count in ((0, 0), (1, 1)):
+        conn = sqlite3.connect(str(tmp_path / f"copy.{shard}.db"))
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone() == \
+            (count,)
+        conn.close()
+    storage.close_connection()
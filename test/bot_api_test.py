@@ -0,0 +1,128 @@
+import io
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from bot_api import BotAPI, BotAPIException, parse_message, parse_update
+
+
+def test_parse_text_message():
+    assert parse_message({"text": "/new_round"}) == {"text": "/new_round"}
+
+
+def test_parse_photo_message():
+    '''
+    The biggest photo size is used as quiz and caption as answer
+    '''
+
+    message = {"photo": [{"file_id": "small"}, {"file_id": "big"}],
+               "caption": "Cat"}
+    assert parse_message(message) == {"photo": ("big", "Cat")}
+
+
+def test_parse_document_message():
+    message = {"document": {"file_id": "1234ABCD"}}
+    assert parse_message(message) == {"document": "1234ABCD"}
+
+
+def test_parse_unsupported_message():
+    assert parse_message({"sticker": {}}) is None
+
+
+def test_parse_update():
+    update = {"update_id": 1,
+              "message": {"chat": {"id": 42}, "text": "Hello"}}
+    assert parse_update(update) == (42, {"text": "Hello"})
+
+
+def test_call_error_with_retry_after():
+    '''
+    Bot API errors are reported with the requested retry delay
+    '''
+
+    api = BotAPI({"API_KEY": "api_key"})
+    response = MagicMock()
+    response.json.return_value = {"ok": False,
+                                  "description": "Too Many Requests",
+                                  "parameters": {"retry_after": 3}}
+    with patch.object(api.session, "post", return_value=response):
+        with pytest.raises(BotAPIException) as error:
+            api.send_message(42, "Hello")
+    assert error.value.retry_after == 3
+
+
+def test_send_photo():
+    api = BotAPI({"API_KEY": "api_key", "API_URL": "http://localhost:8081"})
+    response = MagicMock()
+    response.json.return_value = {"ok": True, "result": {"message_id": 1}}
+    with patch.object(api.session, "post", return_value=response) as post:
+        assert api.send("photo", 42, "file_id") == {"message_id": 1}
+    post.assert_called_once_with(
+        "http://localhost:8081/botapi_key/sendPhoto",
+        json={"chat_id": 42, "photo": "file_id"},
+        timeout=10)
+
+
+def test_get_updates():
+    '''
+    The long polling timeout is a Bot API parameter, while the HTTP
+    request waits some more
+    '''
+
+    api = BotAPI({"API_KEY": "api_key"})
+    response = MagicMock()
+    response.json.return_value = {"ok": True, "result": []}
+    with patch.object(api.session, "post", return_value=response) as post:
+        assert api.get_updates(offset=5, timeout=30) == []
+    post.assert_called_once_with(
+        "https://api.telegram.org/botapi_key/getUpdates",
+        json={"timeout": 30, "offset": 5},
+        timeout=40)
+
+
+def test_download():
+    api = BotAPI({"API_KEY": "api_key"})
+    response = MagicMock()
+    response.iter_content.return_value = iter([b"Cat,", b"Gato"])
+    response.__enter__.return_value = response
+    with patch.object(api.session, "get", return_value=response) as get:
+        assert b"".join(api.download("documents/file.csv")) == b"Cat,Gato"
+    get.assert_called_once_with(
+        "https://api.telegram.org/file/botapi_key/documents/file.csv",
+        stream=True,
+        timeout=10)
+
+
+def test_download_error():
+    api = BotAPI({"API_KEY": "api_key"})
+    with patch.object(api.session, "get",
+                      side_effect=requests.ConnectionError("refused")):
+        with pytest.raises(BotAPIException):
+            list(api.download("documents/file.csv"))
+
+
+def test_send_document():
+    '''
+    Documents are uploaded as a multipart body read while it is sent,
+    with a known length
+    '''
+
+    api = BotAPI({"API_KEY": "api_key"})
+    response = MagicMock()
+    response.json.return_value = {"ok": True, "result": {"message_id": 1}}
+    with patch.object(api.session, "post", return_value=response) as post:
+        api.send_document(42, io.BytesIO(b"Cat,Gato\n"), 9, "deck.csv")
+
+    upload = post.call_args.kwargs["data"]
+    request = requests.Request(
+        "POST", "http://localhost", data=upload,
+        headers=post.call_args.kwargs["headers"]).prepare()
+    assert request.headers["Content-Length"] == str(len(upload))
+    assert "Transfer-Encoding" not in request.headers
+
+    body = b"".join(iter(lambda: upload.read(4), b""))
+    assert len(body) == len(upload)
+    assert b'name="chat_id"\r\n\r\n42\r\n' in body
+    assert b'filename="deck.csv"' in body
+    assert b"\r\n\r\nCat,Gato\n\r\n--" in body
@@ -1,17 +1,125 @@
+import json
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
 import pytest
 from configuration import Configuration, ConfigurationException
 
-def test_config_validation():
+# Max. time to load a cached configuration in a fresh process, as a
+# fraction of the time to parse and validate it in the same run
+STARTUP_BUDGET = 0.25
+
+# Modules a cached startup of the bot with the default options must not
+# import
+OPTIONAL_MODULES = {"pydantic", "tomli", "telegrambot", "backup", "exporter",
+                    "reloader", "sharding", "supervisor", "webhook"}
+
+def test_config_validation(tmp_path):
 
-    config = Configuration("test/config/template.toml")
+    config = Configuration("test/config/template.toml",
+                           cache_dir=str(tmp_path))
     assert config.validate()
 
-def test_config_validation_invalid_field():
-    config = Configuration("test/config/invalid_field.toml")
+def test_config_validation_invalid_field(tmp_path):
+    config = Configuration("test/config/invalid_field.toml",
+                           cache_dir=str(tmp_path))
     with pytest.raises(ConfigurationException):
         config.validate()
 
 def test_config_file_not_found():
     config = Configuration("test/config/aaaa.toml")
     with pytest.raises(ConfigurationException):
-        config.read()
\ No newline at end of file
+        config.read()
+
+def test_config_webhook_requires_https(tmp_path):
+    config_file = tmp_path / "webhook.toml"
+    with open("test/config/template.toml", encoding="utf-8") as template:
+        config_file.write_text(template.read() + '''
+[FlashCardBot.Webhook]
+    Enabled = true
+    URL = "http://example.com/webhook"
+''')
+    with pytest.raises(ConfigurationException):
+        Configuration(str(config_file),
+                      cache_dir=str(tmp_path / "cache")).validate()
+
+def test_config_cache(tmp_path):
+    '''
+    Unchanged configurations are loaded from the cache, without parsing
+    nor validation. Changed ones are validated again
+    '''
+
+    config_file = tmp_path / "config.toml"
+    with open("test/config/template.toml", encoding="utf-8") as template:
+        config_file.write_text(template.read())
+
+    config = Configuration(str(config_file), cache_dir=str(tmp_path / "cache"))
+    data = config.validate()
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+    with patch.object(Configuration, "parse") as parse:
+        assert config.validate() == data
+        parse.assert_not_called()
+
+    config_file.write_text(config_file.read_text() + '\n[Logging]\n'
+                           '    Level = "VERBOSE"\n')
+    with pytest.raises(ConfigurationException):
+        config.validate()
+
+def test_config_cache_disabled(tmp_path):
+    config = Configuration("test/config/template.toml", cache_dir=None)
+    with patch.object(Configuration, "write_cache") as write_cache:
+        assert config.validate()
+    write_cache.assert_called_once_with(None, config.read())
+
+def startup(cache_dir: str) -> dict:
+    '''
+    Import the bot and load its configuration in a fresh process
+
+    Returns:
+        - dict: Configuration data, seconds spent loading it and the
+            optional modules imported
+    '''
+
+    code = f'''
+import json, sys, time
+import flashcard
+start = time.perf_counter()
+data = flashcard.Configuration("test/config/template.toml",
+                               cache_dir={cache_dir!r}).validate()
+seconds = time.perf_counter() - start
+print(json.dumps({{"data": data, "seconds": seconds, "modules": sorted(
+    set({sorted(OPTIONAL_MODULES)!r}) & set(sys.modules))}}))
+'''
+    src = os.path.join(os.path.dirname(__file__), "..", "src")
+    output = subprocess.run([sys.executable, "-c", code],
+                            env={**os.environ, "PYTHONPATH": src},
+                            capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+def test_config_cached_startup(tmp_path):
+    '''
+    A cached configuration is loaded in a fresh process without
+    importing tomli nor pydantic, within the startup budget, and the
+    bot imports its optional subsystems only when they are enabled
+    '''
+
+    cache_dir = str(tmp_path / "cache")
+    cold = startup(cache_dir)
+    warm = startup(cache_dir)
+
+    assert warm["data"] == cold["data"]
+    assert warm["modules"] == []
+    assert warm["seconds"] <= STARTUP_BUDGET * cold["seconds"]
+
+def test_config_supervisor_requires_private_decks(tmp_path):
+    config_file = tmp_path / "supervisor.toml"
+    with open("test/config/template.toml", encoding="utf-8") as template:
+        config_file.write_text(template.read() + '''
+[FlashCardBot.Supervisor]
+    Enabled = true
+''')
+    with pytest.raises(ConfigurationException):
+        Configuration(str(config_file), cache_dir=None).validate()
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+from engine import PollingEngine
+
+
+class FakeAPI:
+    '''
+    Bot API stand-in returning a scripted list of update batches
+    '''
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.offsets = []
+
+    def get_updates(self, offset=None, timeout=0):
+        self.offsets.append(offset)
+        if self.batches:
+            return self.batches.pop(0)
+        return []
+
+
+def text_update(update_id, chat_id, text):
+    return {"update_id": update_id,
+            "message": {"chat": {"id": chat_id}, "text": text}}
+
+
+def test_poll_once_confirms_offset():
+    '''
+    The offset of the next getUpdates call must confirm the last update
+    '''
+
+    api = FakeAPI([[text_update(10, 1, "a"), text_update(11, 1, "b")]])
+    received = []
+
+    async def scenario():
+        engine = PollingEngine(lambda msg, chat: received.append(msg), api)
+        assert await engine.poll_once() == 2
+        await engine.poll_once()
+        await engine.join()
+
+    asyncio.run(scenario())
+    assert api.offsets == [None, 12]
+    assert received == [{"text": "a"}, {"text": "b"}]
+
+
+def test_same_chat_is_sequential():
+    '''
+    Messages of the same chat are handled in arrival order
+    '''
+
+    api = FakeAPI([[text_update(i, 1, str(i)) for i in range(5)]])
+    received = []
+
+    def handler(message, chat_id):
+        # Slower handling for the first messages
+        time.sleep(0.01 * (5 - int(message["text"])))
+        received.append(message["text"])
+
+    async def scenario():
+        engine = PollingEngine(handler, api, workers=4)
+        await engine.poll_once()
+        await engine.join()
+
+    asyncio.run(scenario())
+    assert received == ["0", "1", "2", "3", "4"]
+
+
+def test_different_chats_are_concurrent():
+    '''
+    A slow handler must not stall the messages of other chats
+    '''
+
+    api = FakeAPI([[text_update(1, 1, "slow"), text_update(2, 2, "fast")]])
+    release = threading.Event()
+    received = []
+
+    def handler(message, chat_id):
+        if message["text"] == "slow":
+            # Only released once the other chat has been handled
+            assert release.wait(timeout=2)
+        else:
+            release.set()
+        received.append(message["text"])
+
+    async def scenario():
+        engine = PollingEngine(handler, api, workers=2)
+        await engine.poll_once()
+        await engine.join()
+
+    asyncio.run(scenario())
+    assert received == ["fast", "slow"]
+
+
+def test_skip_updates_without_message():
+    '''
+    Updates without a message (e.g. callback queries) are confirmed
+    but not dispatched
+    '''
+
+    api = FakeAPI([[{"update_id": 5, "callback_query": {}}]])
+    received = []
+
+    async def scenario():
+        engine = PollingEngine(lambda msg, chat: received.append(msg), api)
+        await engine.poll_once()
+        await engine.join()
+        return engine.offset
+
+    assert asyncio.run(scenario()) == 6
+    assert not received
+
+
+def test_skip_unsupported_messages():
+    '''
+    Messages of unsupported formats, edited or not, are confirmed but
+    not dispatched
+    '''
+
+    api = FakeAPI([[
+        {"update_id": 7, "edited_message": {"chat": {"id": 1},
+                                            "sticker": {"file_id": "x"}}},
+        {"update_id": 8, "message": {"chat": {"id": 1},
+                                     "location": {"latitude": 0}}},
+        text_update(9, 1, "a"),
+    ]])
+    received = []
+
+    async def scenario():
+        engine = PollingEngine(lambda msg, chat: received.append(msg), api)
+        await engine.poll_once()
+        await engine.join()
+        return engine.offset
+
+    assert asyncio.run(scenario()) == 10
+    assert received == [{"text": "a"}]
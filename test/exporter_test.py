@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import io
+import json
+
+import pytest
+
+from exporter import ExportException, write_export
+from importer import import_csv
+from storage_manager import StorageManager
+
+ITEMS = [("text", "Cat", "Gato, felino", 2, 1),
+         ("photo", "Dog", "file_id", 0, 3)]
+
+def test_write_export_csv():
+    '''
+    CSV exports have the two columns of the imports, quoted if needed
+    '''
+
+    output = io.BytesIO()
+    size = write_export(iter(ITEMS), output, "csv")
+    assert output.getvalue() == b'Cat,"Gato, felino"\nDog,file_id\n'
+    assert size == len(output.getvalue())
+
+def test_write_export_jsonl():
+    '''
+    JSONL exports keep the type and counters of every item
+    '''
+
+    output = io.BytesIO()
+    write_export(iter(ITEMS), output, "jsonl")
+    lines = output.getvalue().decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"type": "text", "answer": "Cat", "quiz": "Gato, felino",
+         "correct": 2, "wrong": 1},
+        {"type": "photo", "answer": "Dog", "quiz": "file_id",
+         "correct": 0, "wrong": 3}]
+
+def test_write_export_errors():
+    '''
+    Unknown formats and exports larger than the limit are refused
+    '''
+
+    with pytest.raises(ExportException):
+        write_export(iter(ITEMS), io.BytesIO(), "xml")
+    with pytest.raises(ExportException, match="too large"):
+        write_export(iter(ITEMS), io.BytesIO(), "csv", max_size=20)
+
+def test_export_import_round_trip():
+    '''
+    A CSV export imported into another deck gives back the same items
+    '''
+
+    storage_manager = StorageManager(database=":memory:")
+    storage_manager.insert_items([(f"answer{i}", f"quiz, {i}")
+                                  for i in range(25)], user_id=1)
+    output = io.BytesIO()
+    write_export(storage_manager.export_items(user_id=1, batch_size=10),
+                 output)
+
+    lines = io.StringIO(output.getvalue().decode("utf-8"))
+    summary = import_csv(storage_manager, lines, user_id=2)
+    assert summary.inserted == 25
+    assert list(storage_manager.export_items(user_id=2)) == \
+        list(storage_manager.export_items(user_id=1))
@@ -1,26 +1,29 @@
-import os
 import pytest
-from flashcard import FlashCardBot, CommandException
+from bot_api import BotAPIException
+from flashcard import FlashCardBot, CommandException, split_message
+from importer import ImportException
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 @pytest.fixture
-def flashcard_bot():
+def flashcard_bot(tmp_path):
     config = {'Telegram':
                 {
                     'API_KEY': 'api_key'
                 },
               'FlashCardBot':
               {
-                    'Commands': ['/new_item', '/new_round'],
+                    'Commands': ['/new_item', '/new_round', '/stats',
+                                 '/export'],
                     'SleepTime': 1,
-                    'Database': 'test_database.db',
+                    'Database': str(tmp_path / 'test_database.db'),
                     'Timeout': 20,
-                    'MaxAttempts': 3,
-                    'DownloadPath': 'download/'
+                    'MaxAttempts': 3
               }
             }
-    return FlashCardBot(config)
+    bot = FlashCardBot(config)
+    yield bot
+    bot.close(timeout=0)
 
 
 def test_check_command(flashcard_bot):
@@ -88,7 +91,9 @@ def test_new_text_item(flashcard_bot):
         flashcard_bot.new_item(message)
         mock_new_item.assert_called_once_with("text",
                                               "Hello",
-                                              "Hola")
+                                              "Hola",
+                                              user_id=0,
+                                              deck_id=0)
 
 def test_new_photo_item(flashcard_bot):
     '''
@@ -100,7 +105,9 @@ def test_new_photo_item(flashcard_bot):
         flashcard_bot.new_item(message)
         mock_new_item.assert_called_once_with("photo",
                                               "2wrgvweghrv4",
-                                              "Cat")
+                                              "Cat",
+                                              user_id=0,
+                                              deck_id=0)
 
 def test_processing_command_new_item(flashcard_bot):
     '''
@@ -125,58 +132,367 @@ def test_processing_command_new_round(flashcard_bot):
     command = flashcard_bot.processing_command(command_message)
     assert command == "new_round"
 
+def downloaded_file(flashcard_bot, *chunks):
+    '''
+    Mock the Bot API download of a file with the given content
+    '''
+
+    file_info = {"file_id": "1234ABCD",
+                 "file_path": "documents/file.csv",
+                 "file_size": sum(len(chunk) for chunk in chunks)}
+    return patch.multiple(flashcard_bot.bot_api,
+                          get_file=MagicMock(return_value=file_info),
+                          download=MagicMock(
+                              return_value=(chunk for chunk in chunks)))
+
 def test_new_item_document(flashcard_bot):
     '''
     Test adding new item import CSV file. The method returns False due to
-    none existing file into download folder.
+    a file that cannot be downloaded.
     '''
 
     command_message = {"document": "1234ABCD"}
-    assert not flashcard_bot.new_item(command_message)
+    with patch.object(flashcard_bot.bot_api, "get_file",
+                      side_effect=BotAPIException("Bad Request")):
+        assert not flashcard_bot.new_item(command_message)
 
 def test_import_csv_file(flashcard_bot):
     '''
     Test import CSV file functionality
     '''
 
-    # Create a CSV file into download folder and write a single row
-    with open("download/test_data.csv", "w", encoding="utf-8") as file_obj:
-        file_obj.write("Cat,Gato")
-
-    with patch("telegrambot.TelegramBot.download_file") as mock_download:
-        assert flashcard_bot.import_csv_file(file_id="1234ABCD")
-        mock_download.assert_called_once()
+    with downloaded_file(flashcard_bot, b"Cat,Gato"):
+        summary = flashcard_bot.import_csv_file(file_id="1234ABCD")
+        flashcard_bot.bot_api.download.assert_called_once_with(
+            "documents/file.csv")
+    assert summary.inserted + summary.duplicates == 1
 
-def test_import_csv_file_empty_files(flashcard_bot):
+def test_import_csv_file_download_error(flashcard_bot):
     '''
-    Test import a non-existing CSV file
+    Test import a file whose download fails
     '''
 
-    with patch("telegrambot.TelegramBot.download_file") as mock_download:
+    def failed_download(file_path):
+        raise BotAPIException("Download failed")
+        yield
+
+    with downloaded_file(flashcard_bot, b""):
+        flashcard_bot.bot_api.download.side_effect = failed_download
         assert not flashcard_bot.import_csv_file(file_id="1234ABCD")
-        mock_download.assert_called_once()
 
 def test_import_csv_file_item_already_stored(flashcard_bot):
     '''
     Test import CSV file functionality trying to import the same item twice
     '''
 
-    # Create a CSV file into download folder and write a single row
-    with open("download/test_data.csv", "w", encoding="utf-8") as file_obj:
-        file_obj.write("Cat,Gato\n")
-        file_obj.write("Cat,Gato")
+    with downloaded_file(flashcard_bot, b"Cat,Gato\n", b"Cat,Gato"):
+        summary = flashcard_bot.import_csv_file(file_id="1234ABCD")
+    assert summary.duplicates >= 1
+
+def test_import_csv_file_too_large(flashcard_bot):
+    '''
+    Files over MaxImportSize are rejected before being downloaded
+    '''
+
+    flashcard_bot.settings = flashcard_bot.settings._replace(
+        max_import_size=4)
+    with downloaded_file(flashcard_bot, b"Cat,Gato"):
+        with pytest.raises(ImportException):
+            flashcard_bot.import_csv_file(file_id="1234ABCD")
+        flashcard_bot.bot_api.download.assert_not_called()
+
+def test_handle_message_round(flashcard_bot):
+    '''
+    Test a full round: the first message starts the command and the
+    second one is handled as the answer
+    '''
+
+    flashcard_bot.new_item({"text": "Dog - Perro"})
+
+    with patch("flashcard.FlashCardBot.reply") as mock_reply:
+        flashcard_bot.handle_message({"text": "/new_round"}, chat_id=42)
+        assert flashcard_bot.sessions.get(42).command == "new_round"
+
+        flashcard_bot.handle_message({"text": "Dog"}, chat_id=42)
+        assert flashcard_bot.sessions.get(42).command == ""
+        mock_reply.assert_called_with("Correct!🎉", chat_id=42)
+
+def test_handle_message_invalid_command(flashcard_bot):
+    '''
+    Command errors are reported to the user instead of being raised
+    '''
+
+    with patch("flashcard.FlashCardBot.reply") as mock_reply:
+        flashcard_bot.handle_message({"text": "invalid_command"}, chat_id=42)
+        mock_reply.assert_called_once()
+    assert flashcard_bot.sessions.get(42).command == ""
+
+def test_handle_message_independent_chats(flashcard_bot):
+    '''
+    A pending command of a chat does not affect other chats
+    '''
+
+    flashcard_bot.storage_manager.insert_item("text", "Cat", "Gato")
+    with patch("flashcard.FlashCardBot.reply"):
+        flashcard_bot.handle_message({"text": "/new_item"}, chat_id=1)
+        flashcard_bot.handle_message({"text": "/new_round"}, chat_id=2)
+
+    assert flashcard_bot.sessions.get(1).command == "new_item"
+    assert flashcard_bot.sessions.get(2).command == "new_round"
+
+def test_handle_message_metrics(flashcard_bot):
+    '''
+    Every handled message is timed by command
+    '''
+
+    from flashcard import HANDLER_SECONDS
+
+    before = HANDLER_SECONDS.count(command="processing_command")
+    with patch.object(flashcard_bot, "reply"):
+        flashcard_bot.handle_message({"text": "/new_item"}, 42)
+    assert HANDLER_SECONDS.count(command="processing_command") == before + 1
+
+def test_reload(flashcard_bot):
+    '''
+    A reload replaces the commands and keeps the pending commands
+    '''
+
+    with patch.object(flashcard_bot, "reply"):
+        flashcard_bot.handle_message({"text": "/new_item"}, 42)
+
+    config = {'Telegram': flashcard_bot.config['Telegram'],
+              'FlashCardBot': {**flashcard_bot.config['FlashCardBot'],
+                               'Commands': ['/new_round'],
+                               'MaxAttempts': 5}}
+    flashcard_bot.reload(config)
+
+    assert flashcard_bot.settings.max_attempts == 5
+    assert flashcard_bot.check_command({"text": "/new_round"}) == "new_round"
+    with pytest.raises(CommandException, match="Available commands: "
+                       "/new_round$"):
+        flashcard_bot.check_command({"text": "/new_item"})
+    assert flashcard_bot.sessions.get(42).command == "new_item"
+
+def test_private_decks(flashcard_bot):
+    '''
+    With a deck per chat, items and guesses are scoped to the chat
+    '''
+
+    flashcard_bot.private_decks = True
+    with patch.object(flashcard_bot, "reply"):
+        flashcard_bot.handle_message({"text": "/new_item"}, 7)
+        flashcard_bot.handle_message({"text": "Private - Privado"}, 7)
+
+        flashcard_bot.handle_message({"text": "/new_round"}, 7)
+        assert flashcard_bot.sessions.get(7).item_id is not None
+        assert flashcard_bot.new_round({"text": "Private"}, 7)
+
+        # Other chats neither see nor match the item
+        flashcard_bot.handle_message({"text": "/new_round"}, 8)
+        assert flashcard_bot.sessions.get(8).command == ""
+        assert not flashcard_bot.storage_manager.check_quiz_item(
+            "Private", flashcard_bot.sessions.get(7).item_id, user_id=8)
+
+def test_stats(flashcard_bot):
+    '''
+    /stats replies at once and leaves no pending command
+    '''
+
+    with patch.object(flashcard_bot, "reply") as reply:
+        flashcard_bot.handle_message({"text": "/stats"}, 5)
+
+    assert reply.call_args.args[0].startswith("Items: ")
+    assert reply.call_args.kwargs == {"chat_id": 5}
+    assert flashcard_bot.sessions.get(5).command == ""
+
+def test_export(flashcard_bot):
+    '''
+    /export uploads the deck of the chat as a file
+    '''
+
+    flashcard_bot.storage_manager.insert_item("text", "Export", "Exportar")
+    uploads = []
+    def send_document(chat_id, document, size, filename):
+        uploads.append((chat_id, document.read(), size, filename))
+
+    with patch.object(flashcard_bot.bot_api, "send_document",
+                      side_effect=send_document):
+        flashcard_bot.handle_message({"text": "/export"}, 6)
+
+    chat_id, content, size, filename = uploads[0]
+    assert (chat_id, filename) == (6, "flashcards.csv")
+    assert b"Export,Exportar\n" in content
+    assert size == len(content)
+    assert flashcard_bot.sessions.get(6).command == ""
+
+def test_export_errors(flashcard_bot):
+    '''
+    Exports too large or not sent are reported to the chat
+    '''
+
+    flashcard_bot.storage_manager.insert_item("text", "Big", "Grande")
+    flashcard_bot.settings = flashcard_bot.settings._replace(
+        max_export_size=4)
+    with patch.object(flashcard_bot, "reply") as reply:
+        flashcard_bot.handle_message({"text": "/export"}, 6)
+    assert "Export too large" in reply.call_args.args[0]
+
+    flashcard_bot.settings = flashcard_bot.settings._replace(
+        max_export_size=1024 ** 3)
+    with patch.object(flashcard_bot, "reply") as reply, \
+            patch.object(flashcard_bot.bot_api, "send_document",
+                         side_effect=BotAPIException("Bad Request")):
+        assert not flashcard_bot.export_deck(6)
+    assert reply.call_args.args[0].startswith("Unable to send")
+
+def test_batch_round(flashcard_bot):
+    '''
+    /new_round N sends N quizzes, takes their answers one per line or
+    message and writes them at the end of the round
+    '''
+
+    storage_manager = flashcard_bot.storage_manager
+    cards = [(i, f"Batch{i}", f"Q{i}") for i in range(3)]
+    with patch.object(flashcard_bot, "reply") as reply, \
+            patch.object(storage_manager, "select_due_rows",
+                         return_value=[(i, "", answer, quiz, 0, 0, "text")
+                                       for i, answer, quiz in cards]), \
+            patch.object(storage_manager, "record_reviews") as record:
+        flashcard_bot.handle_message({"text": "/new_round 3"}, 9)
+        assert reply.call_count == 1
+        assert reply.call_args.args[0].splitlines()[1:] == \
+            ["1. Q0", "2. Q1", "3. Q2"]
+
+        flashcard_bot.handle_message({"text": "batch0"}, 9)
+        assert reply.call_args.args[0] == "Correct!🎉"
+        record.assert_not_called()
+
+        flashcard_bot.handle_message({"text": "Batch1\nwrong"}, 9)
+        assert reply.call_args.args[0] == ("Correct!🎉\nWrong answer 🥲 "
+                                           "It was Batch2\nRound complete: "
+                                           "2/3 right")
+
+    reviews = record.call_args.args[0]
+    assert [reviews[i][0][0] for i in range(3)] == [True, True, False]
+    assert flashcard_bot.sessions.get(9).command == ""
+
+def test_batch_round_messages(flashcard_bot):
+    '''
+    Batch rounds send their text quizzes into a single outbound message,
+    and the media ones after it
+    '''
 
-    with patch("telegrambot.TelegramBot.download_file") as mock_download:
-        assert flashcard_bot.import_csv_file(file_id="1234ABCD")
-        mock_download.assert_called_once()
+    storage_manager = flashcard_bot.storage_manager
+    rows = [(i, "", f"A{i}", f"Q{i}", 0, 0, "text") for i in range(20)]
+    rows[1] = (1, "", "A1", "photo_id", 0, 0, "photo")
+    with patch.object(flashcard_bot.outbound, "send") as send, \
+            patch.object(storage_manager, "select_due_rows",
+                         return_value=rows):
+        flashcard_bot.handle_message({"text": "/new_round 20"}, 9)
+
+    assert [call.args[:2] for call in send.call_args_list] == \
+        [("text", 9), ("photo", 9)]
+    quizzes = send.call_args_list[0].args[2].splitlines()[1:]
+    assert quizzes[:2] == ["1. Q0", "2. Q2"] and len(quizzes) == 19
+    # The photo is answered last
+    assert flashcard_bot.sessions.get(9).round.cards[-1] == (1, "A1")
+
+def test_split_message():
+    assert split_message(["a", "b", "c"], limit=3) == ["a\nb", "c"]
+    assert split_message(["abcd", "e"], limit=3) == ["abcd", "e"]
+    assert split_message([]) == []
+
+def test_batch_round_size(flashcard_bot):
+    '''
+    Round sizes out of range are refused
+    '''
+
+    assert flashcard_bot.round_size({"text": "/new_round"}) == 1
+    assert flashcard_bot.round_size({"text": "/new_round 5"}) == 5
+    for text in ("/new_round 0", "/new_round 21", "/new_round x",
+                 "/new_round 2 3"):
+        with pytest.raises(CommandException, match="Usage"):
+            flashcard_bot.round_size({"text": text})
 
-# Remove test database after execution
-@pytest.fixture(scope='session', autouse=True)
-def setup_tests():
+def test_new_round_prefetch(flashcard_bot):
     '''
-    Create a download folder before test execution and remove the database
-    when the test ends.
+    The next card is selected while the current one is answered, and
+    prefetched cards of a changed deck are not used
     '''
-    os.mkdir("download/")
-    yield
-    os.remove("test_database.db")
+
+    storage_manager = flashcard_bot.storage_manager
+    for i in range(3):
+        storage_manager.insert_item("text", f"Prefetch{i}", f"P{i}")
+
+    with patch.object(flashcard_bot, "reply"):
+        flashcard_bot.processing_command({"text": "/new_round"}, 11)
+        first = flashcard_bot.sessions.get(11).item_id
+        assert flashcard_bot.prefetch.flush(5)
+
+        with patch.object(storage_manager, "select_due_row") as select:
+            flashcard_bot.processing_command({"text": "/new_round"}, 11)
+        select.assert_not_called()
+        assert flashcard_bot.sessions.get(11).item_id != first
+
+        flashcard_bot.prefetch.flush(5)
+        storage_manager.insert_item("text", "Prefetch3", "P3")
+        with patch.object(storage_manager, "select_due_row",
+                          wraps=storage_manager.select_due_row) as select:
+            flashcard_bot.processing_command({"text": "/new_round"}, 11)
+        select.assert_called_once()
+
+def test_batch_round_then_prefetch(flashcard_bot):
+    '''
+    Cards answered into a batch round are not served again from the
+    prefetched cards
+    '''
+
+    flashcard_bot.private_decks = True
+    storage_manager = flashcard_bot.storage_manager
+    chat_id = 21
+    answers = {}
+    for i in range(6):
+        storage_manager.insert_item("text", f"Due{i}", f"D{i}",
+                                    user_id=chat_id)
+    for item_id, answer in storage_manager.cursor.execute(
+            "SELECT id, answer FROM items WHERE user_id = ?", (chat_id,)):
+        answers[item_id] = answer
+    session = flashcard_bot.sessions.get(chat_id)
+
+    with patch.object(flashcard_bot, "reply"):
+        flashcard_bot.handle_message({"text": "/new_round"}, chat_id)
+        first = session.item_id
+        assert flashcard_bot.prefetch.flush(5)
+        flashcard_bot.handle_message({"text": answers[first]}, chat_id)
+
+        flashcard_bot.handle_message({"text": "/new_round 3"}, chat_id)
+        reviewed = [card[0] for card in session.round.cards]
+        flashcard_bot.handle_message(
+            {"text": "\n".join(answers[i] for i in reviewed)}, chat_id)
+
+        flashcard_bot.handle_message({"text": "/new_round"}, chat_id)
+        assert session.item_id not in reviewed + [first]
+
+def test_tolerance(flashcard_bot):
+    '''
+    /tolerance shows and changes the typos allowed by the deck of a chat
+    '''
+
+    flashcard_bot.private_decks = True
+    flashcard_bot.settings = flashcard_bot.settings._replace(
+        commands={**flashcard_bot.settings.commands,
+                  "/tolerance": "tolerance"})
+    with patch.object(flashcard_bot, "reply") as reply:
+        flashcard_bot.handle_message({"text": "/tolerance"}, 5)
+        assert reply.call_args.args[0] == "Typos allowed per answer: 1"
+        flashcard_bot.handle_message({"text": "/tolerance 2"}, 5)
+        assert reply.call_args.args[0] == "Typos allowed per answer: 2"
+        flashcard_bot.handle_message({"text": "/tolerance 9"}, 5)
+        assert reply.call_args.args[0].startswith("Usage")
+
+        flashcard_bot.private_decks = False
+        flashcard_bot.handle_message({"text": "/tolerance 2"}, 5)
+        assert "shared deck" in reply.call_args.args[0]
+
+    assert flashcard_bot.storage_manager.deck_max_distance(user_id=5) == 2
+    assert flashcard_bot.sessions.get(5).command == ""
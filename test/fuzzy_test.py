@@ -0,0 +1,80 @@
+import random
+import string
+
+import pytest
+
+from fuzzy import FuzzyMatcher, SegmentIndex, levenshtein, normalize
+
+
+def test_normalize():
+    assert normalize("  Canción   de\tCUNA ") == "cancion de cuna"
+
+@pytest.mark.parametrize("source, target, distance", [
+    ("gato", "gato", 0),
+    ("gato", "pato", 1),
+    ("gato", "gatos", 1),
+    ("gato", "ato", 1),
+    ("gato", "toga", 4),
+    ("", "abc", 3),
+])
+def test_levenshtein(source, target, distance):
+    # Distances above the bound are reported as bound + 1
+    assert levenshtein(source, target, 1) == min(distance, 2)
+    assert levenshtein(source, target, 3) == min(distance, 4)
+
+def test_segment_index_against_full_scan():
+    '''
+    The index finds the same words as a full scan
+    '''
+
+    random.seed(0)
+    words = {''.join(random.choice("abc") for _ in range(random.randint(1, 12)))
+             for _ in range(500)}
+    index = SegmentIndex(max_distance=2)
+    for word in words:
+        index.add(word)
+
+    for query in ["abcabcab", "aaaa", "cbacbacbacb", "ab"]:
+        expected = {word for word in words
+                    if 0 < index.tolerance(len(word)) and
+                    levenshtein(query, word, index.tolerance(len(word))) <=
+                    index.tolerance(len(word))}
+        assert set(index.search(query)) == expected
+
+def test_matcher():
+    matcher = FuzzyMatcher(["Canción", "Elephant", "cat"], max_distance=1)
+    assert matcher.match("cancion") == "Canción"
+    assert matcher.match("Elephnt") == "Elephant"
+    assert matcher.match("Elefent") is None
+
+    # Short answers only match exactly after normalization
+    assert matcher.match("CAT") == "cat"
+    assert matcher.match("car") is None
+
+    matcher.discard("Elephant")
+    assert matcher.match("Elephnt") is None
+
+def test_matcher_matches():
+    '''
+    Guesses checked against a single answer use its own tolerance
+    '''
+
+    matcher = FuzzyMatcher(max_distance=1)
+    assert matcher.matches("cancion", "Canción")
+    assert matcher.matches("Elephnt", "Elephant")
+    assert not matcher.matches("car", "cat")
+    assert not matcher.matches("Elephant", "Elegant")
+
+def test_matcher_large_deck():
+    '''
+    Typos are found into large decks
+    '''
+
+    random.seed(1)
+    words = [''.join(random.choice(string.ascii_lowercase)
+                     for _ in range(random.randint(4, 14)))
+             for _ in range(20000)]
+    matcher = FuzzyMatcher(words, max_distance=2)
+    for word in words[:100]:
+        typo = word[:2] + "#" + word[3:]
+        assert normalize(matcher.match(typo)) in matcher.answers
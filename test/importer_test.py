@@ -0,0 +1,74 @@
+import csv
+import io
+import os
+
+import pytest
+
+from importer import (CSVItems, ImportException, ImportSummary, import_csv,
+                      stream_lines)
+from storage_manager import StorageManager
+
+
+def test_csv_items():
+    '''
+    Quoted fields are supported and malformed rows are counted
+    '''
+
+    lines = io.StringIO('Cat,Gato\n"Hello, world","Hola, mundo"\n\n'
+                        'single column\nA,B,C\nDog,\n')
+    items = CSVItems(lines)
+    assert list(items) == [("Cat", "Gato"), ("Hello, world", "Hola, mundo")]
+    assert items.malformed == 3
+
+def test_import_csv():
+    '''
+    Import a file with duplicated and malformed lines in small batches
+    '''
+
+    storage_manager = StorageManager(database="test_import.db")
+    storage_manager.insert_item("text", "Cat", "Gato")
+
+    lines = io.StringIO("Cat,Gato\nDog,Perro\nDog,Perro\nMouse,Raton\n"
+                        "broken\nBird,Pajaro\n")
+    summary = import_csv(storage_manager, lines, batch_size=2)
+    assert summary == ImportSummary(inserted=3, duplicates=2, malformed=1)
+
+    # Imported items are scheduled and available for random selection
+    assert len(storage_manager.random_index) == 4
+    count = storage_manager.cursor.execute(
+        'SELECT COUNT(*) FROM schedule').fetchone()[0]
+    assert count == 4
+
+
+def test_stream_lines_across_chunks():
+    '''
+    Multibyte characters and line breaks split between chunks
+    '''
+
+    data = '﻿Café,Coffee\r\n"Two\nlines",Dos líneas\r\n'.encode('utf-8')
+    chunks = [data[i:i + 3] for i in range(0, len(data), 3)]
+    with stream_lines(chunks, max_size=len(data)) as lines:
+        assert list(csv.reader(lines)) == [["Café", "Coffee"],
+                                           ["Two\nlines", "Dos líneas"]]
+
+def test_stream_lines_max_size():
+    with stream_lines([b"a,b\n"] * 10, max_size=16) as lines:
+        with pytest.raises(ImportException):
+            lines.read()
+
+def test_import_invalid_encoding():
+    storage_manager = StorageManager(database="test_import.db")
+    with stream_lines([b"caf\xe9,coffee\n"], max_size=100) as lines:
+        with pytest.raises(ImportException):
+            import_csv(storage_manager, lines)
+    storage_manager.close_connection()
+
+
+# Remove test database after execution
+@pytest.fixture(scope='session', autouse=True)
+def remove_test_db():
+    '''
+    Remove database after execute tests
+    '''
+    yield
+    os.remove("test_import.db")
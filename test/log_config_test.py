@@ -0,0 +1,74 @@
+import atexit
+import json
+import logging
+
+import pytest
+
+from log_config import (DROPPED_RECORDS, JSONFormatter,
+                        NonBlockingQueueHandler, SamplingFilter,
+                        setup_logging)
+
+
+def record(message="Hello %s", args=("world",), event=None):
+    log_record = logging.LogRecord("storage_manager", logging.INFO, __file__,
+                                   1, message, args, None)
+    if event:
+        log_record.event = event
+    return log_record
+
+
+@pytest.fixture
+def root_logger():
+    '''
+    Restore the root logger after the test
+    '''
+
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    logging.getLogger("noisy").setLevel(logging.NOTSET)
+
+
+def test_json_formatter():
+    data = json.loads(JSONFormatter().format(record(event="guess")))
+    assert data["message"] == "Hello world"
+    assert data["level"] == "INFO"
+    assert data["logger"] == "storage_manager"
+    assert data["event"] == "guess"
+
+def test_sampling_filter():
+    sampling = SamplingFilter({"guess": 0, "quiz": 1})
+    assert not sampling.filter(record(event="guess"))
+    assert sampling.filter(record(event="quiz"))
+    # Records without sampling rate are always kept
+    assert sampling.filter(record(event="other"))
+    assert sampling.filter(record())
+
+def test_full_queue_drops_records():
+    import queue
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    before = DROPPED_RECORDS.value()
+    handler.handle(record())
+    handler.handle(record())
+    assert DROPPED_RECORDS.value() == before + 1
+
+def test_setup_logging(root_logger, tmp_path):
+    log_file = tmp_path / "bot.log"
+    listener = setup_logging({"Format": "json",
+                              "File": str(log_file),
+                              "Levels": {"noisy": "ERROR"},
+                              "Sampling": {"guess": 0}})
+    atexit.unregister(listener.stop)
+
+    logging.getLogger("storage_manager").info("Stored %s", "Cat")
+    logging.getLogger("noisy").warning("Filtered by level")
+    logging.getLogger("flashcard").info("Sampled", extra={"event": "guess"})
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+    lines = log_file.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["message"] for line in lines] == ["Stored Cat"]
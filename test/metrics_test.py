@@ -0,0 +1,91 @@
+import urllib.request
+
+import pytest
+
+from metrics import (Counter, Gauge, Histogram, MetricsServer, Registry,
+                     timed)
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_and_gauge(registry):
+    errors = Counter('errors_total', 'Errors', ['kind'], registry=registry)
+    errors.inc(kind="storage")
+    errors.inc(2, kind="storage")
+    assert errors.value(kind="storage") == 3
+
+    depth = Gauge('depth', 'Queue depth', registry=registry)
+    depth.inc()
+    depth.inc()
+    depth.dec()
+    assert depth.value() == 1
+    depth.set(7)
+
+    output = registry.render()
+    assert 'errors_total{kind="storage"} 3' in output
+    assert '# TYPE depth gauge\ndepth 7' in output
+
+def test_missing_labels(registry):
+    errors = Counter('errors_total', 'Errors', ['kind'], registry=registry)
+    with pytest.raises(ValueError):
+        errors.inc()
+
+def test_duplicated_metric(registry):
+    Counter('errors_total', 'Errors', registry=registry)
+    with pytest.raises(ValueError):
+        Counter('errors_total', 'Errors', registry=registry)
+
+def test_histogram_buckets(registry):
+    '''
+    Buckets are cumulative and an observation equal to a bound belongs
+    to its bucket
+    '''
+
+    latency = Histogram('latency_seconds', 'Latency', ['method'],
+                        buckets=(0.1, 1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, method="select")
+    assert latency.count(method="select") == 4
+
+    output = registry.render()
+    assert 'latency_seconds_bucket{method="select",le="0.1"} 2' in output
+    assert 'latency_seconds_bucket{method="select",le="1.0"} 3' in output
+    assert 'latency_seconds_bucket{method="select",le="+Inf"} 4' in output
+    assert 'latency_seconds_sum{method="select"} 3.65' in output
+    assert 'latency_seconds_count{method="select"} 4' in output
+
+def test_timed(registry):
+    latency = Histogram('latency_seconds', 'Latency', ['method'],
+                        registry=registry)
+
+    @timed(latency, method="fail")
+    def fail():
+        raise RuntimeError("Error")
+
+    with pytest.raises(RuntimeError):
+        fail()
+    with latency.time(method="block"):
+        pass
+    assert latency.count(method="fail") == 1
+    assert latency.count(method="block") == 1
+
+def test_label_escaping(registry):
+    errors = Counter('errors_total', 'Errors', ['kind'], registry=registry)
+    errors.inc(kind='a "quoted"\nvalue')
+    assert 'errors_total{kind="a \\"quoted\\"\\nvalue"} 1' in registry.render()
+
+def test_metrics_server(registry):
+    Counter('errors_total', 'Errors', registry=registry).inc()
+    server = MetricsServer(port=0, registry=registry).start()
+    try:
+        url = f"http://127.0.0.1:{server.port}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert b'errors_total 1' in response.read()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.stop()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import sqlite3
+
+import pytest
+
+import migrations
+from migrations import (AddColumn, Backfill, CreateTable, Migration,
+                        MigrationException, Migrator)
+from storage_manager import (MIGRATIONS, StorageManager,
+                             StorageManagerException)
+
+def legacy_database(path: str, size: int) -> None:
+    '''
+    Database created before the decks and the versioning
+    '''
+
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE items (id INTEGER PRIMARY KEY,
+                 inserted_date TEXT, answer TEXT, quiz TEXT,
+                 answer_correct_count INTEGER, answer_wrong_count INTEGER,
+                 item_type TEXT)''')
+    conn.execute('CREATE UNIQUE INDEX idx_answer_unique ON items (answer)')
+    conn.executemany("INSERT INTO items VALUES (?, '', ?, ?, 1, 2, 'text')",
+                     [(i, f"answer{i}", f"quiz{i}")
+                      for i in range(1, size + 1)])
+    conn.commit()
+    conn.close()
+
+def test_new_database():
+    '''
+    New databases get every version, and nothing is left to apply
+    '''
+
+    conn = sqlite3.connect(":memory:")
+    migrator = Migrator(conn, MIGRATIONS)
+    assert migrator.run() == len(MIGRATIONS)
+    assert migrator.version == len(MIGRATIONS)
+    assert migrator.plan() == []
+    assert migrator.run() == 0
+
+def test_dry_run(tmp_path):
+    '''
+    Plans estimate the rows of every pending step without writing
+    '''
+
+    database = str(tmp_path / "old.db")
+    legacy_database(database, 25)
+    conn = sqlite3.connect(database)
+    plan = Migrator(conn, MIGRATIONS, batch_size=10).plan()
+
+    assert {estimate.version for estimate in plan} == \
+        set(range(1, len(MIGRATIONS) + 1))
+    costs = {estimate.step: (estimate.rows, estimate.batches)
+             for estimate in plan}
+    assert costs["Add column items.user_id"] == (0, 0)
+    assert costs["Create index idx_items_partition_answer"] == (25, 0)
+    assert costs["Backfill review schedule of the items"] == (25, 3)
+    assert "~25 rows in 3 batches" in str(
+        next(estimate for estimate in plan
+             if estimate.step == "Backfill totals of the decks"))
+
+    assert conn.execute('PRAGMA user_version').fetchone() == (0,)
+    assert conn.execute('''SELECT name FROM sqlite_master
+                        WHERE type = 'table' ''').fetchall() == [('items',)]
+    conn.close()
+
+def test_upgrade_in_batches(tmp_path):
+    '''
+    Backfills commit every batch and give the same totals as the writes
+    '''
+
+    database = str(tmp_path / "old.db")
+    legacy_database(database, 25)
+    conn = sqlite3.connect(database)
+    commits = []
+    conn.set_trace_callback(
+        lambda statement: statement == 'COMMIT' and commits.append(1))
+    Migrator(conn, MIGRATIONS, batch_size=10).run()
+    conn.close()
+    # Schedule and totals: 3 batches each
+    assert len(commits) >= 6
+
+    storage_manager = StorageManager(database=database)
+    stats = storage_manager.stats()
+    assert (stats.items, stats.correct, stats.wrong) == (25, 25, 50)
+    assert storage_manager.cursor.execute(
+        "SELECT COUNT(*) FROM schedule").fetchone() == (25,)
+    assert storage_manager.cursor.execute(
+        "SELECT name FROM sqlite_master WHERE name = 'migration_progress'"
+    ).fetchone() is None
+    storage_manager.close_connection()
+
+def test_resume_backfill(monkeypatch):
+    '''
+    Interrupted backfills go on from their last batch
+    '''
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE numbers (value INTEGER)")
+    conn.executemany("INSERT INTO numbers VALUES (?)",
+                     [(i,) for i in range(10)])
+    conn.commit()
+    steps = [
+        AddColumn('numbers', 'double', 'INTEGER'),
+        CreateTable('total', 'value INTEGER'),
+        Backfill("totals", 'numbers', '''INSERT INTO total
+                 SELECT SUM(value) FROM numbers
+                 WHERE rowid BETWEEN :start AND :end'''),
+    ]
+    migrator = Migrator(conn, [Migration("Totals", steps)],
+                        batch_size=4, pause=0.1)
+
+    def interrupt(_):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(migrations.time, "sleep", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        migrator.run()
+    assert migrator.version == 0
+    assert conn.execute("SELECT * FROM total").fetchall() == [(6,)]
+
+    monkeypatch.setattr(migrations.time, "sleep", lambda _: None)
+    assert migrator.run() == 1
+    assert conn.execute("SELECT SUM(value) FROM total").fetchone() == (45,)
+    assert not migrations.table_exists(conn, 'migration_progress')
+
+def test_unversioned_database(tmp_path):
+    '''
+    Databases created before the versioning are not counted again
+    '''
+
+    database = str(tmp_path / "bot.db")
+    storage_manager = StorageManager(database=database)
+    storage_manager.insert_items([("Cat", "Gato"), ("Dog", "Perro")])
+    storage_manager.cursor.execute("PRAGMA user_version = 0")
+    storage_manager.close_connection()
+
+    storage_manager = StorageManager(database=database)
+    assert storage_manager.stats().items == 2
+    assert storage_manager.cursor.execute(
+        "SELECT COUNT(*) FROM schedule").fetchone() == (2,)
+    storage_manager.close_connection()
+
+def test_newer_database(tmp_path):
+    '''
+    Databases of a newer version are refused
+    '''
+
+    database = str(tmp_path / "new.db")
+    conn = sqlite3.connect(database)
+    conn.execute(f"PRAGMA user_version = {len(MIGRATIONS) + 1}")
+    with pytest.raises(MigrationException):
+        Migrator(conn, MIGRATIONS).plan()
+    conn.close()
+
+    with pytest.raises(StorageManagerException):
+        StorageManager(database=database)
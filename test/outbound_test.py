@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from bot_api import BotAPIException
+from outbound import OutboundDispatcher, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeAPI:
+    '''
+    Bot API stand-in recording the sent replies and failing on demand
+    '''
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, item_type, chat_id, content):
+        with self.lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.sent.append((chat_id, content, time.monotonic()))
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    for _ in range(2):
+        assert bucket.delay() == 0
+        bucket.consume()
+    assert bucket.delay() == pytest.approx(0.5)
+
+    clock.now = 0.5
+    assert bucket.delay() == 0
+    bucket.consume()
+    assert not bucket.idle()
+
+    # Tokens never exceed the capacity
+    clock.now = 100
+    assert bucket.idle()
+    assert bucket.tokens == 2
+
+def test_replies_keep_chat_order():
+    api = FakeAPI()
+    dispatcher = OutboundDispatcher(api, workers=4, global_rate=1000,
+                                    chat_rate=1000, chat_burst=1000)
+    for i in range(20):
+        dispatcher.send("text", i % 2, i)
+    dispatcher.close()
+
+    for chat_id in (0, 1):
+        contents = [content for chat, content, _ in api.sent
+                    if chat == chat_id]
+        assert contents == list(range(chat_id, 20, 2))
+
+def test_chat_rate_limit():
+    '''
+    Replies to the same chat are spaced by the chat rate, while other
+    chats are not delayed
+    '''
+
+    api = FakeAPI()
+    dispatcher = OutboundDispatcher(api, global_rate=1000, chat_rate=20,
+                                    chat_burst=1)
+    for i in range(3):
+        dispatcher.send("text", 1, i)
+    dispatcher.send("text", 2, "other")
+    dispatcher.close()
+
+    times = [sent for chat, _, sent in api.sent if chat == 1]
+    assert times[2] - times[0] >= 0.09
+    other = [sent for chat, _, sent in api.sent if chat == 2][0]
+    assert other < times[1]
+
+def test_retry_after():
+    api = FakeAPI([BotAPIException("Too Many Requests", retry_after=0.1)])
+    dispatcher = OutboundDispatcher(api, chat_rate=1000, chat_burst=1000)
+    start = time.monotonic()
+    dispatcher.send("text", 1, "hello")
+    assert dispatcher.flush(timeout=5)
+    dispatcher.close()
+
+    assert [content for _, content, _ in api.sent] == ["hello"]
+    assert api.sent[0][2] - start >= 0.1
+
+def test_drop_after_max_retries():
+    api = FakeAPI([BotAPIException("Bad Request")] * 3)
+    dispatcher = OutboundDispatcher(api, chat_rate=1000, max_retries=2,
+                                    backoff=0.01)
+    dispatcher.send("text", 1, "lost")
+    dispatcher.send("text", 1, "sent")
+    dispatcher.close()
+    assert [content for _, content, _ in api.sent] == ["sent"]
+    assert not dispatcher.pending
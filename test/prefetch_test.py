@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+from prefetch import PREFETCH_REQUESTS, PrefetchBuffer
+
+SCOPE = {"user_id": 0, "deck_id": 0}
+
+
+class FakeDeck:
+    def __init__(self, size):
+        self.items = [(i, f"quiz{i}") for i in range(size)]
+        self.version = 0
+        self.fetches = []
+
+    def fetch(self, count, exclude, user_id, deck_id):
+        self.fetches.append(exclude)
+        return [item for item in self.items
+                if item[0] not in exclude][:count]
+
+    def generation(self, user_id, deck_id):
+        return self.version
+
+
+def counts():
+    return {result: PREFETCH_REQUESTS.value(result=result)
+            for result in ("hit", "miss", "stale")}
+
+
+def test_pop_and_refill():
+    '''
+    Cards are taken from memory once the background refill is done
+    '''
+
+    deck = FakeDeck(5)
+    prefetch = PrefetchBuffer(deck.fetch, deck.generation, depth=2)
+    before = counts()
+
+    assert prefetch.pop(1, SCOPE) is None
+    prefetch.refill(1, SCOPE, exclude=(0,))
+    assert prefetch.flush(5)
+    assert deck.fetches == [(0,)]
+    assert prefetch.pop(1, SCOPE) == (1, "quiz1")
+    assert prefetch.pop(1, SCOPE) == (2, "quiz2")
+    assert prefetch.pop(1, SCOPE) is None
+
+    after = counts()
+    assert after["hit"] - before["hit"] == 2
+    assert after["miss"] - before["miss"] == 2
+    prefetch.close()
+
+def test_invalidation():
+    '''
+    Buffers of a changed deck, or of another deck, are dropped
+    '''
+
+    deck = FakeDeck(5)
+    prefetch = PrefetchBuffer(deck.fetch, deck.generation)
+    prefetch.refill(1, SCOPE)
+    prefetch.flush(5)
+
+    stale = PREFETCH_REQUESTS.value(result="stale")
+    deck.version += 1
+    assert prefetch.pop(1, SCOPE) is None
+    assert PREFETCH_REQUESTS.value(result="stale") == stale + 1
+    assert 1 not in prefetch.buffers
+
+    prefetch.refill(1, SCOPE)
+    prefetch.flush(5)
+    assert prefetch.pop(1, {"user_id": 1, "deck_id": 0}) is None
+    prefetch.close()
+
+def test_reviewed():
+    '''
+    Cards reviewed after a refill are skipped, in the buffers of every
+    chat of the deck
+    '''
+
+    deck = FakeDeck(5)
+    prefetch = PrefetchBuffer(deck.fetch, deck.generation, depth=3)
+    for chat_id in (1, 2):
+        prefetch.refill(chat_id, SCOPE)
+        prefetch.flush(5)
+
+    prefetch.reviewed(SCOPE, (0,))
+    prefetch.reviewed({"user_id": 1, "deck_id": 0}, (1,))
+    assert prefetch.pop(1, SCOPE) == (1, "quiz1")
+    assert prefetch.pop(2, SCOPE) == (1, "quiz1")
+
+    # Reviewed before the refill: due again
+    prefetch.refill(1, SCOPE)
+    prefetch.flush(5)
+    assert prefetch.pop(1, SCOPE) == (0, "quiz0")
+
+    stale = PREFETCH_REQUESTS.value(result="stale")
+    prefetch.reviewed(SCOPE, (1, 2))
+    assert prefetch.pop(1, SCOPE) is None
+    assert PREFETCH_REQUESTS.value(result="stale") == stale + 1
+
+    prefetch.discard(2)
+    assert 2 not in prefetch.buffers
+    prefetch.close()
+
+def test_forgotten_reviews():
+    '''
+    Buffers older than the forgotten reviews are dropped
+    '''
+
+    deck = FakeDeck(5)
+    prefetch = PrefetchBuffer(deck.fetch, deck.generation, depth=1,
+                              max_chats=2)
+    prefetch.refill(1, SCOPE)
+    prefetch.flush(5)
+    prefetch.reviewed(SCOPE, (3, 4, 5))
+    assert len(prefetch.reviews) == 2
+    assert prefetch.pop(1, SCOPE) is None
+    prefetch.close()
+
+def test_max_chats():
+    '''
+    Only the buffers of the most recent chats are kept
+    '''
+
+    deck = FakeDeck(5)
+    prefetch = PrefetchBuffer(deck.fetch, deck.generation, max_chats=2)
+    for chat_id in range(3):
+        prefetch.refill(chat_id, SCOPE)
+        prefetch.flush(5)
+    assert list(prefetch.buffers) == [1, 2]
+    prefetch.close()
+
+def test_fetch_error():
+    '''
+    Failed selections, e.g. of an empty deck, leave no buffer
+    '''
+
+    def fetch(count, exclude, user_id, deck_id):
+        raise ValueError("empty")
+
+    prefetch = PrefetchBuffer(fetch, lambda **scope: 0)
+    prefetch.refill(1, SCOPE)
+    assert prefetch.flush(5)
+    assert prefetch.pop(1, SCOPE) is None
+    prefetch.close()
+    prefetch.refill(1, SCOPE)
+    assert not prefetch.requests
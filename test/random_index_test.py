@@ -0,0 +1,53 @@
+from collections import Counter
+
+from random_index import RandomIndex
+
+
+def test_choice_empty():
+    assert RandomIndex().choice() is None
+
+def test_choice_uniform():
+    '''
+    Every ID must be selected with the same probability
+    '''
+
+    index = RandomIndex(range(10))
+    counts = Counter(index.choice() for _ in range(20000))
+    assert set(counts) == set(range(10))
+    assert all(1700 < count < 2300 for count in counts.values())
+
+def test_discard():
+    '''
+    Deleted IDs are never selected
+    '''
+
+    index = RandomIndex(range(100))
+    for item_id in range(1, 100):
+        index.discard(item_id)
+    assert len(index) == 1
+    assert {index.choice() for _ in range(100)} == {0}
+
+def test_add_reused_id():
+    '''
+    A deleted ID added again is stored only once
+    '''
+
+    index = RandomIndex([1, 2, 3])
+    index.discard(3)
+    index.add(3)
+    assert len(index) == 3
+    assert sorted(index.ids) == [1, 2, 3]
+
+def test_sample():
+    '''
+    Samples have distinct live IDs, all of them if there are not enough
+    '''
+
+    index = RandomIndex(range(100))
+    index.discard(5)
+    for count in (1, 10, 60, 99):
+        sample = index.sample(count)
+        assert len(sample) == len(set(sample)) == count
+        assert 5 not in sample
+    assert sorted(index.sample(200)) == [i for i in range(100) if i != 5]
+    assert RandomIndex().sample(3) == []
@@ -0,0 +1,61 @@
+import os
+
+from configuration import Configuration
+from reloader import ConfigReloader
+
+
+def write_config(path, max_attempts):
+    with open("test/config/template.toml", encoding="utf-8") as template:
+        content = template.read()
+    path.write_text(content.replace("MaxAttempts = 3",
+                                    f"MaxAttempts = {max_attempts}"))
+    # Make the change visible even with a coarse mtime resolution
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def reloader(tmp_path, applied):
+    config_file = tmp_path / "config.toml"
+    write_config(config_file, 3)
+    configuration = Configuration(str(config_file), cache_dir=None)
+    return config_file, ConfigReloader(configuration, applied.append,
+                                       interval=0)
+
+
+def test_reload_on_change(tmp_path):
+    applied = []
+    config_file, config_reloader = reloader(tmp_path, applied)
+    assert not config_reloader.check()
+
+    write_config(config_file, 5)
+    assert config_reloader.check()
+    assert applied[0]['FlashCardBot']['MaxAttempts'] == 5
+    assert not config_reloader.check()
+
+def test_reload_invalid_config(tmp_path):
+    '''
+    Invalid files are not applied
+    '''
+
+    applied = []
+    config_file, config_reloader = reloader(tmp_path, applied)
+    write_config(config_file, '"three"')
+    assert not config_reloader.check()
+    assert not applied
+
+def test_reload_requested(tmp_path):
+    '''
+    Requested reloads are done from the background thread, even if the
+    file did not change
+    '''
+
+    applied = []
+    _, config_reloader = reloader(tmp_path, applied)
+    config_reloader.start()
+    config_reloader.request()
+    for _ in range(100):
+        if applied:
+            break
+        config_reloader.thread.join(0.05)
+    config_reloader.stop()
+    assert len(applied) == 1
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from review_writer import ReviewWriter
+
+
+def test_flush_groups_reviews():
+    '''
+    Reviews of the same item are written together and in order
+    '''
+
+    flushes = []
+    writer = ReviewWriter(flushes.append, flush_interval=60)
+    writer.record(1, True)
+    writer.record(2, False)
+    writer.record(1, False)
+    assert writer.pending_ids() == {1, 2}
+
+    assert writer.flush() == 3
+    writer.close()
+
+    assert len(flushes) == 1
+    assert [result for result, _ in flushes[0][1]] == [True, False]
+    assert not writer.pending_ids()
+
+def test_flush_size_threshold():
+    '''
+    The background thread flushes as soon as flush_size is reached
+    '''
+
+    flushed = threading.Event()
+    writer = ReviewWriter(lambda reviews: flushed.set(),
+                          flush_interval=60,
+                          flush_size=2)
+    writer.record(1, True)
+    writer.record(2, True)
+    assert flushed.wait(timeout=2)
+    writer.close()
+
+def test_close_flushes():
+    flushes = []
+    writer = ReviewWriter(flushes.append, flush_interval=60)
+    writer.record(1, True)
+    writer.close()
+    assert list(flushes[0]) == [1]
+
+def test_failed_flush_keeps_reviews():
+    '''
+    Reviews are kept for the next flush if the write fails
+    '''
+
+    def apply(reviews):
+        raise RuntimeError("disk I/O error")
+
+    writer = ReviewWriter(apply, flush_interval=60)
+    writer.record(1, True)
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert writer.pending_ids() == {1}
+
+    writer.apply = lambda reviews: None
+    writer.close()
+
+def test_record_many():
+    '''
+    Reviews recorded together are written into the same flush
+    '''
+
+    flushes = []
+    writer = ReviewWriter(flushes.append, flush_interval=60, flush_size=3)
+    writer.record(1, True)
+    writer.record_many({2: [(True, 1.0)], 3: [(False, 2.0)]})
+    writer.close()
+
+    assert flushes == [{1: flushes[0][1], 2: [(True, 1.0)],
+                        3: [(False, 2.0)]}]
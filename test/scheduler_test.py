@@ -0,0 +1,38 @@
+import pytest
+
+from scheduler import DAY, INITIAL_EASE, MIN_EASE, RELEARN_DELAY, review, sm2
+
+
+def test_sm2_intervals():
+    '''
+    Consecutive right answers follow the 1, 6, interval * ease sequence
+    '''
+
+    state = (0, INITIAL_EASE, 0)
+    intervals = []
+    for _ in range(4):
+        state = sm2(*state, quality=5)
+        intervals.append(state[0])
+
+    assert intervals[:2] == [1, 6]
+    # Perfect answers increase the ease by 0.1 each review
+    assert intervals[2] == round(6 * (INITIAL_EASE + 0.2))
+    assert intervals[3] > intervals[2]
+
+def test_sm2_wrong_answer_resets():
+    interval, ease, repetitions = sm2(15, 2.0, 4, quality=1)
+    assert interval == 0
+    assert repetitions == 0
+    assert ease == 2.0
+
+def test_sm2_min_ease():
+    assert sm2(6, MIN_EASE, 2, quality=3)[1] == pytest.approx(MIN_EASE)
+
+def test_review_due():
+    '''
+    Right answers are due days later, wrong ones after a short delay
+    '''
+
+    now = 1000.0
+    assert review((0, INITIAL_EASE, 0), True, now)[0] == now + DAY
+    assert review((6, INITIAL_EASE, 2), False, now)[0] == now + RELEARN_DELAY
@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+
+from session import Round, SessionStore
+
+
+def test_get_creates_session():
+    store = SessionStore()
+    session = store.get(1)
+    assert session.command == ''
+    assert session.attempt_count == 0
+    assert store.get(1) is session
+
+def test_lru_eviction():
+    '''
+    Least recently used sessions are dropped when the store is full
+    '''
+
+    store = SessionStore(max_sessions=2)
+    store.get(1).command = "new_item"
+    store.get(2)
+    store.get(1)
+    store.get(3)
+
+    assert len(store) == 2
+    assert 2 not in store.sessions
+    assert store.get(1).command == "new_item"
+
+def test_ttl_eviction():
+    '''
+    Idle sessions expire after TTL seconds
+    '''
+
+    store = SessionStore(ttl=1)
+    store.get(1).command = "new_round"
+    store.get(1).updated = time.monotonic() - 2
+    assert store.get(1).command == ''
+
+def test_persisted_session():
+    '''
+    A persisted session is restored by a new store
+    '''
+
+    store = SessionStore(database="test_sessions.db")
+    session = store.get(1)
+    session.command = "new_round"
+    session.item_id = 7
+    store.save(session)
+    store.close()
+
+    restored = SessionStore(database="test_sessions.db").get(1)
+    assert restored.command == "new_round"
+    assert restored.item_id == 7
+
+def test_persisted_session_after_eviction():
+    '''
+    A session evicted from memory is restored from database
+    '''
+
+    store = SessionStore(max_sessions=1, database="test_sessions.db")
+    session = store.get(10)
+    session.attempt_count = 2
+    store.save(session)
+    store.get(11)
+
+    assert 10 not in store.sessions
+    assert store.get(10).attempt_count == 2
+
+
+# Remove test database after execution
+@pytest.fixture(scope='session', autouse=True)
+def remove_test_db():
+    '''
+    Remove database after execute tests
+    '''
+    yield
+    os.remove("test_sessions.db")
+
+
+def test_round():
+    '''
+    Cards of a round are answered in order and reset with the session
+    '''
+
+    current = Round([(1, "Cat"), (2, "Dog")])
+    assert current.current == (1, "Cat")
+    current.answer(True)
+    current.answer(False)
+    assert current.done
+    assert current.correct == 1
+    assert [results[0][0] for results in current.reviews.values()] == \
+        [True, False]
+
+    session = SessionStore().get(7)
+    session.round = current
+    session.reset()
+    assert session.round is None
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from sharding import ShardedStorage, shard_path
+
+
+def test_shard_path():
+    assert shard_path("data/flashcard.db", 3) == os.path.join(
+        "data", "flashcard.3.db")
+
+def test_sharded_storage(tmp_path):
+    '''
+    Users are routed to a single shard
+    '''
+
+    storage = ShardedStorage(str(tmp_path / "deck.db"), shards=2)
+    storage.insert_item("text", "Cat", "Gato", user_id=1)
+    storage.insert_items([("Dog", "Perro")], user_id=2)
+
+    item = storage.select_due_row(user_id=1)
+    assert item[3] == "Gato"
+    assert storage.check_quiz_item("Cat", item[0], user_id=1)
+    assert storage.select_random_row(user_id=2)[3] == "Perro"
+    assert storage.delete_item("Dog", user_id=2)
+    storage.close_connection()
+
+    assert sorted(os.listdir(tmp_path)) == ["deck.0.db", "deck.1.db"]
+
+def test_sharded_storage_invalid():
+    with pytest.raises(ValueError):
+        ShardedStorage("deck.db", shards=0)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+from datetime import date
+
+from stats import DeckStats, Streak, extend_streak
+
+def test_extend_streak():
+    '''
+    Consecutive days extend the streak and a missed day restarts it
+    '''
+
+    day = date(2024, 5, 1).toordinal()
+    streak = extend_streak(Streak(None, 0, 0), [day, day, day + 1])
+    assert streak == Streak(day + 1, 2, 2)
+
+    # Days already counted are ignored
+    assert extend_streak(streak, [day + 1]) == streak
+
+    streak = extend_streak(streak, [day + 3])
+    assert streak == Streak(day + 3, 1, 2)
+
+def test_deck_stats():
+    '''
+    Accuracy, current streak and text of the summary
+    '''
+
+    today = date(2024, 5, 3)
+    stats = DeckStats(10, 3, 1, Streak(today.toordinal() - 1, 4, 6),
+                      [("Cat", "Gato", 2, 0)])
+    assert stats.accuracy == 0.75
+    assert stats.current_streak(today) == 4
+    assert stats.current_streak(date(2024, 5, 5)) == 0
+    assert "Answers: 3 right, 1 wrong (75%)" in str(stats)
+    assert "Hardest: Cat (2✗ 0✓)" in str(stats)
+
+    empty = DeckStats(0, 0, 0, Streak(None, 0, 0), [])
+    assert empty.accuracy is None
+    assert str(empty) == "Items: 0\nNo answers yet\nStreak: 0 days (best 0)"
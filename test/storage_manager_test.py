@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 
 import os
+import sqlite3
+import threading
+import time
+
 import pytest
+from unittest.mock import MagicMock
 
 from storage_manager import StorageManager, StorageManagerException
 
@@ -50,6 +55,45 @@ def test_select_random_item():
     assert quiz == "testB"
     assert item_type == "text"
 
+def test_delete_item():
+    '''
+    Test a removed item is not selected anymore
+    '''
+
+    # Initialize Storage Manager
+    storage_manager = StorageManager(database="test_flashcard_delete.db")
+
+    # Insert two items and remove the first one
+    storage_manager.insert_item("text", "testA", "testB")
+    storage_manager.insert_item("text", "testC", "testD")
+    assert storage_manager.delete_item("testA")
+    assert not storage_manager.delete_item("testA")
+
+    # Only the remaining item can be selected
+    for _ in range(10):
+        quiz, _ = storage_manager.select_random_item()
+        assert quiz == "testD"
+
+def test_select_due_row():
+    '''
+    Test a right answered item goes to the end of the review queue
+    '''
+
+    # Initialize Storage Manager
+    storage_manager = StorageManager(database="test_flashcard_due.db")
+
+    # Insert two items
+    storage_manager.insert_item("text", "testA", "testB")
+    storage_manager.insert_item("text", "testC", "testD")
+
+    # The oldest item is the first one to be reviewed
+    item = storage_manager.select_due_row()
+    assert item[2] == "testA"
+
+    # After a right answer, the other item is the next one
+    storage_manager.check_quiz_item("testA", item[0])
+    assert storage_manager.select_due_row()[2] == "testC"
+
 def test_check_quiz_item():
     '''
     Test checking value of a quiz string
@@ -70,6 +114,441 @@ def test_check_quiz_item():
     # Check if "test3" is not into database
     assert not storage_manager.check_quiz_item("test3")
 
+def test_check_quiz_item_write_behind():
+    '''
+    Test answer counters are written on flush
+    '''
+
+    # Initialize Storage Manager with a write-behind buffer
+    storage_manager = StorageManager(database="test_flashcard_writer.db",
+                                     flush_interval=60)
+    storage_manager.insert_item("text", "test1", "test2")
+    storage_manager.insert_item("text", "test3", "test4")
+
+    item = storage_manager.select_due_row()
+    assert storage_manager.check_quiz_item("test1", item[0])
+    assert not storage_manager.check_quiz_item("test5", item[0])
+
+    # The answered item is skipped until its review is written
+    assert storage_manager.select_due_row()[0] != item[0]
+
+    storage_manager.writer.flush()
+    counters = storage_manager.cursor.execute(
+        '''SELECT answer_correct_count, answer_wrong_count
+        FROM items WHERE id = ?''', (item[0],)).fetchone()
+    assert counters == (1, 1)
+    storage_manager.close_connection()
+
+def test_pragmas_and_read_connections():
+    '''
+    Test a WAL database read through the read-only connections pool
+    '''
+
+    storage_manager = StorageManager(database="test_flashcard_wal.db",
+                                     pragmas={"journal_mode": "wal",
+                                              "synchronous": "NORMAL",
+                                              "busy_timeout": 1000},
+                                     read_connections=2)
+    journal_mode = storage_manager.cursor.execute(
+        "PRAGMA journal_mode").fetchone()[0]
+    assert journal_mode == "wal"
+
+    # Committed items are visible to the readers
+    storage_manager.insert_item("text", "testA", "testB")
+    assert storage_manager.select_random_item() == ("testB", "text")
+    assert storage_manager.check_quiz_item("testA")
+    storage_manager.close_connection()
+
+def test_invalid_pragma():
+    '''
+    Test unsupported pragmas and values are rejected
+    '''
+
+    with pytest.raises(StorageManagerException):
+        StorageManager(database=":memory:", pragmas={"foo": 1})
+    with pytest.raises(StorageManagerException):
+        StorageManager(database=":memory:",
+                       pragmas={"synchronous": "NORMAL; DROP TABLE items"})
+
+@pytest.mark.parametrize("kind", ["set", "bloom"])
+def test_check_quiz_item_answer_index(kind):
+    '''
+    Test guesses checked through the in-memory answer index
+    '''
+
+    storage_manager = StorageManager(database=":memory:", answer_index=kind)
+    storage_manager.insert_item("text", "testA", "testB")
+    storage_manager.insert_items([("testC", "testD")])
+    item = storage_manager.select_random_row()
+
+    assert storage_manager.check_quiz_item("testA", item[0])
+    assert storage_manager.check_quiz_item("testC", item[0])
+    assert not storage_manager.check_quiz_item("testE", item[0])
+
+    # Deleted answers are not matched anymore
+    storage_manager.delete_item("testA")
+    assert not storage_manager.check_quiz_item("testA", item[0])
+
+def test_check_quiz_item_fuzzy():
+    '''
+    Test guesses with accents, case changes and typos
+    '''
+
+    storage_manager = StorageManager(database=":memory:", max_distance=1)
+    storage_manager.insert_item("text", "Canción", "Song")
+    item = storage_manager.select_random_row()
+
+    assert storage_manager.check_quiz_item("cancion", item[0])
+    assert storage_manager.check_quiz_item("Cancoin ", item[0]) is False
+    assert storage_manager.check_quiz_item("Canciin", item[0])
+
+def test_check_quiz_item_fuzzy_other_answer():
+    '''
+    Typos of the answer of another item are wrong guesses
+    '''
+
+    storage_manager = StorageManager(database=":memory:", max_distance=1)
+    storage_manager.insert_items([("dog", "perro"), ("gato", "cat"),
+                                  ("mesa", "table"), ("casa", "house")])
+    dog = storage_manager.cursor.execute(
+        "SELECT id FROM items WHERE answer = 'dog'").fetchone()[0]
+
+    for guess in ("gata", "misa", "cosa"):
+        assert not storage_manager.check_quiz_item(guess, dog)
+    assert storage_manager.check_quiz_item("Dog", dog)
+    assert storage_manager.cursor.execute(
+        '''SELECT answer_correct_count, answer_wrong_count FROM items
+        WHERE id = ?''', (dog,)).fetchone() == (1, 3)
+
+def test_partitions():
+    '''
+    Decks of different users are independent
+    '''
+
+    storage_manager = StorageManager(database=":memory:", answer_index="set")
+    storage_manager.insert_item("text", "Cat", "Gato", user_id=1)
+    storage_manager.insert_item("text", "Cat", "Chat", user_id=2)
+    storage_manager.insert_items([("Dog", "Perro")], user_id=1, deck_id=5)
+    with pytest.raises(StorageManagerException):
+        storage_manager.insert_item("text", "Cat", "Gatito", user_id=1)
+
+    assert storage_manager.select_due_row(user_id=2)[3] == "Chat"
+    assert storage_manager.select_random_row(1, 5)[3] == "Perro"
+    with pytest.raises(StorageManagerException):
+        storage_manager.select_due_row(user_id=3)
+
+    item = storage_manager.select_due_row(user_id=1)
+    assert storage_manager.check_quiz_item("Cat", item[0], user_id=1)
+    assert not storage_manager.check_quiz_item("Dog", item[0], user_id=1)
+    assert not storage_manager.check_quiz_item("Cat", item[0], user_id=3)
+
+    assert storage_manager.delete_item("Cat", user_id=2)
+    assert storage_manager.check_quiz_item("Cat", item[0], user_id=1)
+
+def test_partitions_lru():
+    '''
+    Only the recently used partitions are kept in memory
+    '''
+
+    storage_manager = StorageManager(database=":memory:", max_partitions=2)
+    for user_id in range(3):
+        storage_manager.insert_item("text", "Cat", "Gato", user_id=user_id)
+        storage_manager.select_random_row(user_id)
+    assert list(storage_manager.partitions) == [(1, 0), (2, 0)]
+
+    # Reloaded with the items written while evicted
+    storage_manager.insert_item("text", "Dog", "Perro", user_id=0)
+    assert len(storage_manager._partition(0, 0).random_index) == 2
+
+def test_partition_query_plans():
+    '''
+    Queries of a user only read the index entries of its partition
+    '''
+
+    storage_manager = StorageManager(database=":memory:")
+    plans = {
+        "due": '''SELECT items.* FROM schedule
+                JOIN items ON items.id = schedule.item_id
+                WHERE schedule.user_id = 1 AND schedule.deck_id = 0
+                ORDER BY schedule.due LIMIT 1''',
+        "answer": '''SELECT EXISTS(SELECT 1 FROM items WHERE user_id = 1
+                   AND deck_id = 0 AND answer = 'a')''',
+    }
+    for query in plans.values():
+        plan = " ".join(row[3] for row in storage_manager.cursor.execute(
+            f"EXPLAIN QUERY PLAN {query}"))
+        assert "idx_schedule_partition_due" in plan or \
+            "idx_items_partition_answer" in plan
+        assert "SCAN" not in plan.replace("SCAN CONSTANT ROW", "")
+        assert "TEMP B-TREE" not in plan
+
+def test_upgrade_schema(tmp_path):
+    '''
+    Items of databases created without partitions go to the shared deck
+    '''
+
+    database = str(tmp_path / "old.db")
+    conn = sqlite3.connect(database)
+    conn.execute('''CREATE TABLE items (id INTEGER PRIMARY KEY,
+                 inserted_date TEXT, answer TEXT, quiz TEXT,
+                 answer_correct_count INTEGER, answer_wrong_count INTEGER,
+                 item_type TEXT)''')
+    conn.execute('''CREATE UNIQUE INDEX idx_answer_unique
+                 ON items (answer)''')
+    conn.execute("INSERT INTO items VALUES (1, '', 'Cat', 'Gato', 0, 0, "
+                 "'text')")
+    conn.commit()
+    conn.close()
+
+    storage_manager = StorageManager(database=database)
+    assert storage_manager.select_due_row()[:4] == (1, '', 'Cat', 'Gato')
+    storage_manager.insert_item("text", "Cat", "Gato", user_id=1)
+    storage_manager.close_connection()
+
+def test_stats():
+    '''
+    Deck totals are updated by the writes and read without scans
+    '''
+
+    storage_manager = StorageManager(database=":memory:")
+    storage_manager.insert_item("text", "Cat", "Gato")
+    storage_manager.insert_items([("Dog", "Perro"), ("Cow", "Vaca")])
+    storage_manager.insert_item("text", "Own", "Propio", user_id=1)
+    storage_manager.delete_item("Cow")
+
+    ids = {row[2]: row[0] for row in storage_manager.cursor.execute(
+        "SELECT * FROM items")}
+    cat = ids["Cat"]
+    assert not storage_manager.check_quiz_item("Horse", cat)
+    assert not storage_manager.check_quiz_item("Cow", cat)
+    assert storage_manager.check_quiz_item("Dog", ids["Dog"])
+
+    stats = storage_manager.stats()
+    assert (stats.items, stats.correct, stats.wrong) == (2, 1, 2)
+    assert stats.streak.current == 1
+    assert stats.current_streak() == 1
+    assert stats.hardest == [("Cat", "Gato", 2, 0)]
+
+    own = storage_manager.stats(user_id=1)
+    assert (own.items, own.correct, own.wrong) == (1, 0, 0)
+    assert storage_manager.stats(user_id=2).items == 0
+
+    plan = " ".join(row[3] for row in storage_manager.cursor.execute(
+        '''EXPLAIN QUERY PLAN SELECT answer FROM items
+        WHERE user_id = 0 AND deck_id = 0
+        AND answer_wrong_count - answer_correct_count > 0
+        ORDER BY answer_wrong_count - answer_correct_count DESC
+        LIMIT 3'''))
+    assert "idx_items_hardest" in plan
+    assert "TEMP B-TREE" not in plan
+
+def test_stats_backfill(tmp_path):
+    '''
+    Databases created without statistics get the totals of their items
+    '''
+
+    database = str(tmp_path / "stats.db")
+    storage_manager = StorageManager(database=database)
+    storage_manager.insert_items([("Cat", "Gato"), ("Dog", "Perro")],
+                                 user_id=3)
+    storage_manager.cursor.execute(
+        "UPDATE items SET answer_correct_count = 2, answer_wrong_count = 1")
+    storage_manager.cursor.execute("DROP TABLE deck_stats")
+    storage_manager.cursor.execute("PRAGMA user_version = 2")
+    storage_manager.conn.commit()
+    storage_manager.close_connection()
+
+    stats = StorageManager(database=database).stats(user_id=3)
+    assert (stats.items, stats.correct, stats.wrong) == (2, 4, 2)
+
+def test_export_items():
+    '''
+    Exports are read in batches, sorted by answer, from a single deck
+    '''
+
+    storage_manager = StorageManager(database=":memory:")
+    storage_manager.insert_items([(f"answer{i:02}", f"quiz{i}")
+                                  for i in range(10)])
+    storage_manager.insert_item("text", "Other", "Otro", user_id=1)
+
+    items = list(storage_manager.export_items(batch_size=3))
+    assert [item[1] for item in items] == [f"answer{i:02}"
+                                           for i in range(10)]
+    assert items[0] == ("text", "answer00", "quiz0", 0, 0)
+    assert list(storage_manager.export_items(user_id=1)) == [
+        ("text", "Other", "Otro", 0, 0)]
+
+def test_backup_while_writing(tmp_path):
+    '''
+    Writes done while a backup is in progress are not blocked and are
+    included into the copy
+    '''
+
+    storage_manager = StorageManager(database=str(tmp_path / "bot.db"))
+    storage_manager.insert_items([(f"answer{i}", f"quiz{i}" * 100)
+                                  for i in range(2000)])
+
+    # Copy a page per step and write between the steps
+    original = storage_manager.conn.backup
+    def backup(target, pages, progress, sleep):
+        def step(status, remaining, total):
+            if remaining and not step.written:
+                storage_manager.insert_item("text", "during", "backup")
+                step.written = True
+            progress(status, remaining, total)
+        step.written = False
+        original(target, pages=pages, sleep=sleep, progress=step)
+
+    storage_manager.conn = MagicMock(wraps=storage_manager.conn)
+    storage_manager.conn.backup = backup
+    path = str(tmp_path / "copy.db")
+    storage_manager.backup(path, pages=1, sleep=0)
+
+    copy = StorageManager(database=path)
+    assert copy.stats().items == 2001
+    assert copy.check_quiz_item("during", 1)
+    copy.close_connection()
+
+def test_backup_skips_open_transactions(tmp_path):
+    '''
+    Backup steps wait for the transaction of another thread, so its
+    uncommitted writes are not copied
+    '''
+
+    storage_manager = StorageManager(database=str(tmp_path / "bot.db"))
+    storage_manager.insert_items([("Cat", "Gato")])
+    path = str(tmp_path / "copy.db")
+
+    started = threading.Event()
+    with storage_manager.lock:
+        storage_manager.cursor.execute(
+            "UPDATE items SET answer = 'Uncommitted'")
+        backup = threading.Thread(
+            target=lambda: (started.set(),
+                            storage_manager.backup(path, pages=1, sleep=0)))
+        backup.start()
+        started.wait()
+        time.sleep(0.1)
+        assert backup.is_alive()
+        storage_manager.conn.rollback()
+    backup.join()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT answer FROM items").fetchall() == [("Cat",)]
+    conn.close()
+    storage_manager.close_connection()
+
+def test_batch_selection():
+    '''
+    Cards of a batch round are distinct and selected with one query
+    '''
+
+    storage_manager = StorageManager(database=":memory:")
+    storage_manager.insert_items([(f"answer{i}", f"quiz{i}")
+                                  for i in range(10)])
+    queries = []
+    storage_manager.conn.set_trace_callback(queries.append)
+
+    due = storage_manager.select_due_rows(4)
+    assert [row[2] for row in due] == [f"answer{i}" for i in range(4)]
+    rows = storage_manager.select_random_rows(4)
+    assert len({row[0] for row in rows}) == 4
+    assert len(queries) == 2
+
+    assert len(storage_manager.select_random_rows(50)) == 10
+    with pytest.raises(StorageManagerException):
+        storage_manager.select_random_rows(3, user_id=1)
+
+def test_record_reviews():
+    '''
+    Answers of a round are matched without queries and written into a
+    single transaction
+    '''
+
+    storage_manager = StorageManager(database=":memory:", max_distance=1)
+    storage_manager.insert_items([("Elephant", "Elefante"), ("Cat", "Gato")])
+    assert storage_manager.match_answer("elephnt", "Elephant")
+    assert not storage_manager.match_answer("Cat", "Elephant")
+
+    rows = storage_manager.select_due_rows(2)
+    commits = []
+    storage_manager.conn.set_trace_callback(
+        lambda query: query == "COMMIT" and commits.append(query))
+    storage_manager.record_reviews({rows[0][0]: [(True, time.time())],
+                                    rows[1][0]: [(False, time.time())]})
+    assert len(commits) == 1
+
+    stats = storage_manager.stats()
+    assert (stats.correct, stats.wrong) == (1, 1)
+
+def test_failed_write_rolled_back():
+    '''
+    Writes failing halfway leave nothing to be committed by the next
+    writer of the connection
+    '''
+
+    storage_manager = StorageManager(database=":memory:")
+    storage_manager.insert_items([("Cat", "Gato")])
+    item_id = storage_manager.select_due_row()[0]
+
+    storage_manager._count_answers = MagicMock(
+        side_effect=sqlite3.OperationalError("disk I/O error"))
+    with pytest.raises(sqlite3.OperationalError):
+        storage_manager.apply_reviews({item_id: [(True, time.time())]})
+    assert not storage_manager.conn.in_transaction
+
+    storage_manager._count_items = MagicMock(
+        side_effect=sqlite3.OperationalError("disk I/O error"))
+    with pytest.raises(sqlite3.OperationalError):
+        storage_manager.insert_items([("Dog", "Perro")])
+    del storage_manager._count_items
+    storage_manager.insert_item("text", "Cow", "Vaca")
+
+    assert storage_manager.cursor.execute(
+        "SELECT answer, answer_correct_count FROM items ORDER BY id"
+    ).fetchall() == [("Cat", 0), ("Cow", 0)]
+    assert storage_manager.stats().items == 2
+
+def test_deck_max_distance():
+    '''
+    Decks allow the typos of their own setting, or the default one
+    '''
+
+    storage_manager = StorageManager(database=":memory:", max_distance=1)
+    storage_manager.insert_item("text", "Elephant", "Elefante", user_id=1)
+    storage_manager.insert_item("text", "Elephant", "Elefante", user_id=2)
+    assert storage_manager.check_quiz_item("elephnt", 1, user_id=1)
+
+    storage_manager.set_max_distance(0, user_id=1)
+    assert storage_manager.deck_max_distance(user_id=1) == 0
+    assert storage_manager.deck_max_distance(user_id=2) == 1
+    assert not storage_manager.check_quiz_item("elephnt", 1, user_id=1)
+    assert storage_manager.check_quiz_item("ELEPHANT", 1, user_id=1)
+    assert storage_manager.check_quiz_item("elephnt", 2, user_id=2)
+
+    storage_manager.set_max_distance(2, user_id=1)
+    assert storage_manager.match_answer("elefant", "Elephant", user_id=1)
+    storage_manager.set_max_distance(None, user_id=1)
+    assert storage_manager.deck_max_distance(user_id=1) == 1
+
+def test_generation():
+    '''
+    Inserts and deletes increase the generation of their deck only
+    '''
+
+    storage_manager = StorageManager(database=":memory:")
+    assert storage_manager.generation() == 0
+    storage_manager.insert_item("text", "Cat", "Gato")
+    storage_manager.insert_items([("Dog", "Perro")])
+    storage_manager.delete_item("Cat")
+    assert not storage_manager.delete_item("Cat")
+    assert storage_manager.generation() == 3
+    assert storage_manager.generation(user_id=1) == 0
+
+    # The card being answered can be left out of the next ones
+    with pytest.raises(StorageManagerException):
+        storage_manager.select_due_rows(2, exclude=[2])
+
 def test_successfully_close_connection():
     '''
     Check close connection DB
@@ -98,4 +577,8 @@ def remove_test_db():
     os.remove("test_flashcard.db")
     os.remove("test_flashcard_random.db")
     os.remove("test_flashcard_empty.db")
-    os.remove("test_flashcard_quiz.db")
\ No newline at end of file
+    os.remove("test_flashcard_quiz.db")
+    os.remove("test_flashcard_delete.db")
+    os.remove("test_flashcard_due.db")
+    os.remove("test_flashcard_writer.db")
+    os.remove("test_flashcard_wal.db")
\ No newline at end of file
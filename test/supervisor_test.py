@@ -0,0 +1,210 @@
+import os
+import queue
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from supervisor import (DROPPED_UPDATES, Supervisor, WORKER_RESTARTS,
+                        forward_updates, worker_index)
+from webhook import WorkerPool
+
+CONFIG = {'Telegram': {'API_KEY': 'api_key'},
+          'FlashCardBot': {'Commands': ['/new_item', '/new_round'],
+                           'SleepTime': 1,
+                           'Database': os.path.join('data', 'deck.db'),
+                           'Timeout': 20,
+                           'MaxAttempts': 3,
+                           'Storage': {'Partition': 'chat'},
+                           'Backup': {'Path': os.path.join('backup',
+                                                           'deck.db')}}}
+
+
+class FakeProcess:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.exitcode = None if alive else 1
+        self.killed = False
+
+    def is_alive(self):
+        return self.alive
+
+    def kill(self):
+        self.killed = True
+        self.alive = False
+
+    def join(self, timeout=None):
+        pass
+
+
+def test_worker_config():
+    '''
+    Every worker gets its own shard and a share of the rate limit
+    '''
+
+    supervisor = Supervisor(CONFIG, MagicMock(), workers=3)
+    config = supervisor.worker_config(2)
+    assert config['FlashCardBot']['Database'] == os.path.join('data',
+                                                              'deck.2.db')
+    assert config['FlashCardBot']['Outbound']['GlobalRate'] == 10
+    assert config['FlashCardBot']['Backup']['Path'] == \
+        os.path.join('backup', 'deck.2.db')
+    assert CONFIG['FlashCardBot']['Database'] == os.path.join('data',
+                                                              'deck.db')
+
+def test_poll_once_routes_by_chat():
+    api = MagicMock()
+    api.get_updates.return_value = [
+        {"update_id": 1, "message": {"chat": {"id": 7}, "text": "a"}},
+        {"update_id": 2},
+        {"update_id": 3, "edited_message": {"chat": {"id": 8},
+                                            "sticker": {}}},
+        {"update_id": 4, "message": {"chat": {"id": 8}, "text": "b"}},
+        {"update_id": 5, "message": {"chat": {"id": 7}, "text": "c"}},
+    ]
+    supervisor = Supervisor(CONFIG, api, workers=2)
+    supervisor.poll_once()
+    assert supervisor.offset == 6
+
+    received = [[], []]
+    for index, pending in enumerate(supervisor.queues):
+        while True:
+            try:
+                received[index].append(pending.get(timeout=0.2)[0])
+            except queue.Empty:
+                break
+    assert received[worker_index(7, 2)] == [7, 7]
+    assert received[worker_index(8, 2)] == [8]
+
+def test_check_workers_restarts():
+    '''
+    Dead and stuck workers are replaced
+    '''
+
+    supervisor = Supervisor(CONFIG, MagicMock(), workers=3,
+                            heartbeat_timeout=10)
+    supervisor._running = True
+    dead, stuck, healthy = FakeProcess(False), FakeProcess(), FakeProcess()
+    supervisor.processes = [dead, stuck, healthy]
+    now = time.time()
+    for heartbeat, value in zip(supervisor.heartbeats,
+                                (now, now - 60, now)):
+        heartbeat.value = value
+
+    before = WORKER_RESTARTS.value(reason="stuck")
+    with patch.object(supervisor, "start_worker") as start_worker:
+        supervisor.check_workers()
+    assert [call.args for call in start_worker.call_args_list] == [(0,), (1,)]
+    assert stuck.killed and not healthy.killed
+    assert WORKER_RESTARTS.value(reason="stuck") == before + 1
+
+def test_slow_worker_alive():
+    '''
+    Workers waiting for their slow handlers keep beating while the
+    handlers make progress, and are not restarted
+    '''
+
+    supervisor = Supervisor(CONFIG, MagicMock(), workers=1,
+                            heartbeat_timeout=0.25)
+    supervisor._running = True
+    process = FakeProcess()
+    supervisor.processes = [process]
+
+    handled = []
+    pool = WorkerPool(lambda message, chat_id: (time.sleep(0.1),
+                                                handled.append(chat_id)),
+                      workers=1, queue_size=1)
+    updates = queue.Queue()
+    for chat_id in range(6):
+        updates.put((chat_id, {"text": "slow"}))
+    updates.put(None)
+    forward = threading.Thread(target=forward_updates,
+                               args=(updates, pool, supervisor.heartbeats[0]))
+    forward.start()
+
+    with patch.object(supervisor, "start_worker") as start_worker:
+        while forward.is_alive():
+            supervisor.check_workers()
+            time.sleep(0.05)
+    forward.join()
+    pool.close()
+
+    start_worker.assert_not_called()
+    assert not process.killed
+    assert handled == list(range(6))
+
+def test_wedged_handler():
+    '''
+    Workers whose handler is stuck on a message are restarted, even if
+    their process is still forwarding updates
+    '''
+
+    supervisor = Supervisor(CONFIG, MagicMock(), workers=1,
+                            heartbeat_timeout=0.2)
+    supervisor._running = True
+    process = FakeProcess()
+    supervisor.processes = [process]
+
+    release = threading.Event()
+    pool = WorkerPool(lambda message, chat_id: release.wait(),
+                      workers=2, queue_size=1)
+    updates = queue.Queue()
+    updates.put((1, {"text": "wedged"}))
+    forward = threading.Thread(target=forward_updates,
+                               args=(updates, pool, supervisor.heartbeats[0]))
+    forward.start()
+
+    try:
+        with patch.object(supervisor, "start_worker") as start_worker:
+            for _ in range(40):
+                supervisor.check_workers()
+                if process.killed:
+                    break
+                time.sleep(0.05)
+    finally:
+        release.set()
+        updates.put(None)
+        forward.join()
+        pool.close()
+
+    assert process.killed
+    start_worker.assert_called_once_with(0)
+
+def test_dispatch_full_queue():
+    '''
+    Messages routed to a saturated worker are dropped without blocking
+    the other workers
+    '''
+
+    supervisor = Supervisor(CONFIG, MagicMock(), workers=2, queue_size=1)
+    before = DROPPED_UPDATES.value(worker="0")
+    assert supervisor.dispatch(0, {"text": "a"})
+    assert not supervisor.dispatch(2, {"text": "b"})
+    assert supervisor.dispatch(1, {"text": "c"})
+    assert DROPPED_UPDATES.value(worker="0") == before + 1
+    assert supervisor.queues[1].get(timeout=1) == (1, {"text": "c"})
+
+def test_worker_process(tmp_path):
+    '''
+    A worker process starts, handles the routed messages and stops
+    '''
+
+    # Replies fail at once and are not retried
+    config = {'Telegram': {'API_KEY': 'api_key',
+                           'API_URL': 'http://127.0.0.1:9'},
+              'FlashCardBot': {**CONFIG['FlashCardBot'],
+                               'Database': str(tmp_path / "deck.db"),
+                               'Outbound': {'MaxRetries': 0}}}
+    supervisor = Supervisor(config, MagicMock(), workers=1)
+    supervisor._running = True
+    supervisor.start_worker(0)
+    started = supervisor.heartbeats[0].value
+    supervisor.dispatch(1, {"text": "/new_item"})
+    for _ in range(200):
+        if supervisor.heartbeats[0].value > started:
+            break
+        time.sleep(0.05)
+    supervisor.stop()
+
+    assert supervisor.heartbeats[0].value > started
+    assert supervisor.processes[0].exitcode == 0
+    assert os.listdir(tmp_path) == ["deck.0.db"]
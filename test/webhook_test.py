@@ -0,0 +1,169 @@
+import http.client
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from webhook import SECRET_HEADER, WebhookServer, WorkerPool
+
+
+class FakeAPI:
+    '''
+    Bot API stand-in recording the requests
+    '''
+    def __init__(self):
+        self.calls = []
+
+    def call(self, method, **params):
+        self.calls.append((method, params))
+        return True
+
+
+def update(update_id, chat_id, text):
+    return json.dumps({"update_id": update_id,
+                       "message": {"chat": {"id": chat_id},
+                                   "text": text}}).encode()
+
+
+@pytest.fixture
+def received():
+    return []
+
+
+@pytest.fixture
+def webhook(received):
+    server = WebhookServer(lambda message, chat_id:
+                           received.append((chat_id, message)),
+                           FakeAPI(),
+                           url="https://example.com/webhook",
+                           host="127.0.0.1",
+                           port=0,
+                           secret_token="secret",
+                           workers=2)
+    yield server
+    server.server.server_close()
+    server.pool.close()
+
+
+@pytest.fixture
+def serving(webhook):
+    thread = threading.Thread(target=webhook.run)
+    thread.start()
+    yield webhook
+    webhook.stop()
+    thread.join()
+
+
+def post(webhook, headers):
+    '''
+    Send the headers of a POST request without its body, and return the
+    response status
+    '''
+
+    conn = http.client.HTTPConnection("127.0.0.1", webhook.port, timeout=5)
+    try:
+        conn.putrequest("POST", "/webhook")
+        for name, value in headers.items():
+            conn.putheader(name, value)
+        conn.endheaders()
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def test_worker_pool_keeps_chat_order():
+    received = []
+    pool = WorkerPool(lambda message, chat_id: received.append(message),
+                      workers=3)
+    for i in range(50):
+        assert pool.submit(7, i)
+    pool.close()
+    assert received == list(range(50))
+
+def test_worker_pool_backpressure():
+    '''
+    A saturated worker rejects new messages instead of queueing them
+    '''
+
+    release = threading.Event()
+    pool = WorkerPool(lambda message, chat_id: release.wait(), workers=1,
+                      queue_size=1)
+    accepted = [pool.submit(1, "a") for _ in range(5)]
+    release.set()
+    pool.close()
+    # One message being handled and one queued at most
+    assert accepted[:1] == [True]
+    assert accepted.count(True) <= 2
+    assert not accepted[-1]
+
+def test_receive_checks_secret_token(webhook, received):
+    assert webhook.receive(update(1, 42, "/new_round"), None) == 403
+    assert webhook.receive(update(1, 42, "/new_round"), "wrong") == 403
+    assert webhook.receive(update(1, 42, "/new_round"), "secret") == 200
+    webhook.pool.close()
+    assert received == [(42, {"text": "/new_round"})]
+
+def test_receive_skips_duplicates(webhook, received):
+    assert webhook.receive(update(1, 42, "a"), "secret") == 200
+    assert webhook.receive(update(1, 42, "a"), "secret") == 200
+    webhook.pool.close()
+    assert len(received) == 1
+
+def test_receive_malformed(webhook):
+    assert webhook.receive(b"not json", "secret") == 400
+    assert webhook.receive(b'{"message": {}}', "secret") == 400
+    # Updates without message are acknowledged and ignored
+    assert webhook.receive(b'{"update_id": 3}', "secret") == 200
+
+def test_register(webhook):
+    webhook.register()
+    method, params = webhook.api.calls[0]
+    assert method == "setWebhook"
+    assert params["url"] == "https://example.com/webhook"
+    assert params["secret_token"] == "secret"
+
+def test_http_delivery(webhook, received):
+    thread = threading.Thread(target=webhook.run)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{webhook.port}"
+        request = urllib.request.Request(f"{url}/webhook",
+                                         data=update(5, 42, "hello"),
+                                         headers={SECRET_HEADER: "secret"})
+        with urllib.request.urlopen(request) as response:
+            assert response.status == 200
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(urllib.request.Request(
+                f"{url}/other", data=update(6, 42, "hello")))
+        assert error.value.code == 404
+    finally:
+        webhook.stop()
+        thread.join()
+    assert received == [(42, {"text": "hello"})]
+
+def test_http_invalid_length(serving):
+    '''
+    Requests without a valid Content-Length are rejected unread
+    '''
+
+    assert post(serving, {SECRET_HEADER: "secret"}) == 411
+    assert post(serving, {SECRET_HEADER: "secret",
+                          "Content-Length": "-1"}) == 400
+    assert post(serving, {SECRET_HEADER: "secret",
+                          "Content-Length": "many"}) == 400
+    assert post(serving, {SECRET_HEADER: "secret",
+                          "Content-Length": str(3 * 1024 * 1024)}) == 413
+
+def test_http_token_checked_first(serving, received):
+    '''
+    Bodies of unauthenticated requests are never read
+    '''
+
+    # The body is not sent: reading it would time out
+    assert post(serving, {SECRET_HEADER: "wrong",
+                          "Content-Length": "1000"}) == 403
+    assert post(serving, {"Content-Length": "1000"}) == 403
+    assert received == []